@@ -0,0 +1,161 @@
+"""
+Measures the import time and resident memory of a module defining N models.
+
+Each measurement imports a generated module in a fresh interpreter after
+mongoclasses itself has been imported, so only the models are counted. Run from the repository
+root:
+
+    python benchmarks/registry.py
+    python benchmarks/registry.py --models 100 300 1000 --precompile
+    python benchmarks/registry.py --use
+
+With `--use`, an instance of each model is also converted to a document and
+back after the import, and the time and memory include it.
+"""
+
+import argparse
+from datetime import datetime, timezone
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Any, Dict, List, Optional
+
+from mongoclasses.__about__ import __version__
+
+HEADER = """\
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import List, Optional
+
+from bson import ObjectId
+
+from mongoclasses import mongoclass
+from mongoclasses.memory import MemoryDatabase
+
+db = MemoryDatabase()
+
+
+@dataclass
+class Address:
+    street: str = ""
+    city: str = ""
+"""
+
+MODEL = """
+
+@mongoclass(db=db, precompile={precompile})
+class Model{index}:
+    _id: ObjectId = field(default_factory=ObjectId)
+    name: str = ""
+    count: int = 0
+    score: float = 0.0
+    active: bool = False
+    created: Optional[datetime] = None
+    tags: List[str] = field(default_factory=list)
+    address: Address = field(default_factory=Address)
+"""
+
+# Prints the seconds spent importing the module, and using the models if `use`
+# is set, and the resident memory in KiB.
+PROBE = """\
+import sys, time
+import mongoclasses
+rss_before = int(open("/proc/self/statm").read().split()[1])
+start = time.perf_counter()
+module = __import__({module!r})
+if {use}:
+    for name in dir(module):
+        if name.startswith("Model"):
+            cls = getattr(module, name)
+            mongoclasses.from_document(cls, mongoclasses.to_document(cls()))
+elapsed = time.perf_counter() - start
+rss_after = int(open("/proc/self/statm").read().split()[1])
+page = __import__("resource").getpagesize() // 1024
+print(elapsed, (rss_after - rss_before) * page)
+"""
+
+
+def write_module(directory: str, count: int, precompile: bool) -> str:
+    name = f"models_{count}_{int(precompile)}"
+    with open(os.path.join(directory, f"{name}.py"), "w") as f:
+        f.write(HEADER)
+        for index in range(count):
+            f.write(MODEL.format(index=index, precompile=precompile))
+    return name
+
+
+def probe(directory: str, module: str, use: bool) -> List[float]:
+    env = dict(os.environ, PYTHONPATH=directory, PYTHONDONTWRITEBYTECODE="1")
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module, use=use)],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return [float(value) for value in output.split()]
+
+
+def measure(
+    directory: str, module: str, use: bool, repeat: int
+) -> Dict[str, float]:
+    samples = [probe(directory, module, use) for _ in range(repeat)]
+    times = [elapsed for elapsed, _ in samples]
+    memory = [rss for _, rss in samples]
+    return {
+        "min_ms": min(times) * 1e3,
+        "median_ms": statistics.median(times) * 1e3,
+        "rss_kib": statistics.median(memory),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--models", type=int, nargs="+", default=[10, 100, 300], help="Model counts."
+    )
+    parser.add_argument(
+        "--precompile", action="store_true", help="Generate the hooks at import."
+    )
+    parser.add_argument(
+        "--use", action="store_true", help="Convert an instance of each model."
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="Imports per count.")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    args = parser.parse_args(argv)
+
+    results: List[Dict[str, Any]] = []
+    with tempfile.TemporaryDirectory() as directory:
+        for count in args.models:
+            module = write_module(directory, count, args.precompile)
+            measurement = measure(directory, module, args.use, args.repeat)
+            result = {"models": count, **measurement}
+            result["per_model_us"] = result["min_ms"] * 1e3 / count
+            results.append(result)
+            print(
+                f"{count:6} models {result['min_ms']:10.2f} ms "
+                f"{result['per_model_us']:10.2f} us/model "
+                f"{result['rss_kib']:10.0f} KiB"
+            )
+
+    if args.output:
+        report = {
+            "mongoclasses": __version__,
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "precompile": args.precompile,
+            "use": args.use,
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+"""
+Benchmarks of the conversion and CRUD hot paths of mongoclasses.
+
+The CRUD benchmarks use the in-memory databases of `mongoclasses.memory`, so
+no MongoDB server is needed. Run from the repository root:
+
+    python benchmarks/run.py
+    python benchmarks/run.py --filter convert --output results.json
+
+The results are printed as a table and, with --output, written as JSON so
+that runs can be compared over time.
+"""
+
+import argparse
+import asyncio
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from decimal import Decimal
+from enum import Enum
+import json
+import platform
+import statistics
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import uuid
+
+from bson import Decimal128, ObjectId, decode, encode
+from bson.binary import UuidRepresentation
+from bson.codec_options import CodecOptions, TypeCodec, TypeEncoder
+from cattrs.preconf.bson import make_converter
+from typing_extensions import Annotated
+
+from mongoclasses import (
+    FieldMeta,
+    afind_one,
+    ainsert_one,
+    aiter_objects,
+    find,
+    find_one,
+    from_document,
+    get_collection,
+    insert_one,
+    iter_objects,
+    mongoclass,
+    to_document,
+)
+from mongoclasses.__about__ import __version__
+from mongoclasses.memory import AsyncMemoryDatabase, MemoryDatabase
+
+
+# A function that runs a case `number` times and returns the elapsed seconds.
+Timer = Callable[[int], float]
+
+CASES: Dict[str, Callable[[], Timer]] = {}
+
+
+def case(name: str) -> Callable[[Callable[[], Timer]], Callable[[], Timer]]:
+    def register(setup: Callable[[], Timer]) -> Callable[[], Timer]:
+        CASES[name] = setup
+        return setup
+
+    return register
+
+
+def sync_timer(fn: Callable[[], Any]) -> Timer:
+    def timer(number: int) -> float:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        return time.perf_counter() - start
+
+    return timer
+
+
+def async_timer(fn: Callable[[], Awaitable[Any]]) -> Timer:
+    loop = asyncio.new_event_loop()
+
+    async def run(number: int) -> float:
+        start = time.perf_counter()
+        for _ in range(number):
+            await fn()
+        return time.perf_counter() - start
+
+    def timer(number: int) -> float:
+        return loop.run_until_complete(run(number))
+
+    return timer
+
+
+# Models
+
+
+def make_models(db: Any) -> Dict[str, Any]:
+    @dataclass
+    class Address:
+        street: str = "1 Main St"
+        city: str = "Springfield"
+        zip_code: str = "12345"
+
+    @mongoclass(db=db, collection_name="flat")
+    class Flat:
+        _id: ObjectId = field(default_factory=ObjectId)
+        name: str = "name"
+        email: str = "user@example.com"
+        age: int = 42
+        score: float = 1.5
+        active: bool = True
+        created: datetime = datetime(2024, 1, 1)
+
+    @mongoclass(db=db, collection_name="nested")
+    class Nested:
+        _id: ObjectId = field(default_factory=ObjectId)
+        name: str = "name"
+        home: Address = field(default_factory=Address)
+        work: Optional[Address] = field(default_factory=Address)
+        tags: List[str] = field(default_factory=lambda: ["a", "b", "c"])
+
+    @mongoclass(db=db, collection_name="renamed")
+    class Renamed:
+        id: Annotated[ObjectId, FieldMeta(db_field="_id")] = field(
+            default_factory=ObjectId
+        )
+        first_name: Annotated[str, FieldMeta(db_field="fn")] = "first"
+        last_name: Annotated[str, FieldMeta(db_field="ln")] = "last"
+        age: Annotated[int, FieldMeta(db_field="a")] = 42
+
+    @mongoclass(db=db, collection_name="large_array")
+    class LargeArray:
+        _id: ObjectId = field(default_factory=ObjectId)
+        values: List[int] = field(default_factory=lambda: list(range(1000)))
+        addresses: List[Address] = field(
+            default_factory=lambda: [Address() for _ in range(100)]
+        )
+
+    return {
+        "flat": Flat,
+        "nested": Nested,
+        "renamed": Renamed,
+        "large_array": LargeArray,
+    }
+
+
+MODELS = make_models(MemoryDatabase())
+
+
+class Status(Enum):
+    ACTIVE = 1
+    CLOSED = 2
+
+
+class DecimalCodec(TypeCodec):
+    python_type = Decimal
+    bson_type = Decimal128
+
+    def transform_python(self, value: Decimal) -> Decimal128:
+        return Decimal128(value)
+
+    def transform_bson(self, value: Decimal128) -> Decimal:
+        return value.to_decimal()
+
+
+class StatusEncoder(TypeEncoder):
+    python_type = Status
+
+    def transform_python(self, value: Status) -> int:
+        return value.value
+
+
+def make_custom_model(codecs: bool) -> Any:
+    """
+    Returns a model with custom field types, converted by BSON type codecs or
+    by converter hooks.
+    """
+    db = MemoryDatabase(
+        codec_options=CodecOptions(uuid_representation=UuidRepresentation.STANDARD)
+    )
+    if codecs:
+        options: Dict[str, Any] = {"codecs": [DecimalCodec(), StatusEncoder()]}
+    else:
+        converter = make_converter()
+        converter.register_unstructure_hook(Decimal, Decimal128)
+        converter.register_structure_hook(
+            Decimal, lambda value, _: value.to_decimal()
+        )
+        converter.register_structure_hook(uuid.UUID, lambda value, _: value)
+        options = {"converter": converter}
+
+    @mongoclass(db=db, collection_name="custom", **options)
+    class Custom:
+        _id: uuid.UUID = field(default_factory=uuid.uuid4)
+        price: Decimal = Decimal("19.99")
+        tax: Decimal = Decimal("3.80")
+        status: Status = Status.ACTIVE
+        prices: List[Decimal] = field(
+            default_factory=lambda: [Decimal(i) / 100 for i in range(20)]
+        )
+
+    return Custom
+
+
+# Cases
+
+
+def conversion_cases(model: str) -> None:
+    cls = MODELS[model]
+
+    @case(f"convert.{model}.to_document")
+    def to_document_case() -> Timer:
+        obj = cls()
+        return sync_timer(lambda: to_document(obj))
+
+    @case(f"convert.{model}.from_document")
+    def from_document_case() -> Timer:
+        document = to_document(cls())
+        return sync_timer(lambda: from_document(cls, document))
+
+    @case(f"convert.{model}.from_document_trusted")
+    def from_document_trusted_case() -> Timer:
+        document = to_document(cls())
+        return sync_timer(lambda: from_document(cls, document, trusted=True))
+
+
+for model in MODELS:
+    conversion_cases(model)
+
+
+def codec_cases(codecs: bool) -> None:
+    name = "codecs" if codecs else "converter"
+
+    # Includes the BSON encoding and decoding, which the codecs take part in.
+    @case(f"custom_types.{name}.encode")
+    def encode_case() -> Timer:
+        cls = make_custom_model(codecs)
+        codec_options = get_collection(cls).codec_options
+        obj = cls()
+        return sync_timer(
+            lambda: encode(to_document(obj), codec_options=codec_options)
+        )
+
+    @case(f"custom_types.{name}.decode")
+    def decode_case() -> Timer:
+        cls = make_custom_model(codecs)
+        codec_options = get_collection(cls).codec_options
+        data = encode(to_document(cls()), codec_options=codec_options)
+        return sync_timer(
+            lambda: from_document(cls, decode(data, codec_options=codec_options))
+        )
+
+
+for codecs in (False, True):
+    codec_cases(codecs)
+
+
+@case("class.mongoclass")
+def mongoclass_case() -> Timer:
+    db = MemoryDatabase()
+    return sync_timer(lambda: make_models(db))
+
+
+@case("crud.insert_one")
+def insert_one_case() -> Timer:
+    cls = make_models(MemoryDatabase())["flat"]
+    return sync_timer(lambda: insert_one(cls()))
+
+
+@case("crud.find_one")
+def find_one_case() -> Timer:
+    cls = make_models(MemoryDatabase())["flat"]
+    obj = cls()
+    insert_one(obj)
+    return sync_timer(lambda: find_one(cls, {"_id": obj._id}))
+
+
+@case("crud.iter_objects")
+def iter_objects_case() -> Timer:
+    cls = make_models(MemoryDatabase())["nested"]
+    for _ in range(100):
+        insert_one(cls())
+    return sync_timer(lambda: list(iter_objects(cls, find(cls))))
+
+
+@case("crud.ainsert_one")
+def ainsert_one_case() -> Timer:
+    cls = make_models(AsyncMemoryDatabase())["flat"]
+    return async_timer(lambda: ainsert_one(cls()))
+
+
+@case("crud.afind_one")
+def afind_one_case() -> Timer:
+    cls = make_models(AsyncMemoryDatabase())["flat"]
+    obj = cls()
+    asyncio.new_event_loop().run_until_complete(ainsert_one(obj))
+    return async_timer(lambda: afind_one(cls, {"_id": obj._id}))
+
+
+@case("crud.aiter_objects")
+def aiter_objects_case() -> Timer:
+    cls = make_models(AsyncMemoryDatabase())["nested"]
+    loop = asyncio.new_event_loop()
+    for _ in range(100):
+        loop.run_until_complete(ainsert_one(cls()))
+
+    async def consume() -> None:
+        async for _ in aiter_objects(cls, find(cls)):
+            pass
+
+    return async_timer(consume)
+
+
+# Runner
+
+
+def measure(timer: Timer, repeat: int, min_time: float) -> Tuple[int, List[float]]:
+    """
+    Returns the number of calls per round and the seconds per call of each
+    round. The number is doubled until a round takes at least `min_time`.
+    """
+    timer(1)  # Warm up, e.g. generate the converter functions.
+    number = 1
+    while timer(number) < min_time:
+        number *= 2
+    return number, [timer(number) / number for _ in range(repeat)]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--filter", default="", help="Only run cases containing this text.")
+    parser.add_argument("--repeat", type=int, default=5, help="Rounds per case.")
+    parser.add_argument(
+        "--min-time", type=float, default=0.1, help="Minimum seconds per round."
+    )
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    args = parser.parse_args(argv)
+
+    results = []
+    for name, setup in CASES.items():
+        if args.filter not in name:
+            continue
+        number, times = measure(setup(), args.repeat, args.min_time)
+        result = {
+            "name": name,
+            "number": number,
+            "repeat": args.repeat,
+            "min_us": min(times) * 1e6,
+            "median_us": statistics.median(times) * 1e6,
+            "ops_per_sec": 1 / min(times),
+        }
+        results.append(result)
+        print(f"{name:45} {result['min_us']:12.2f} us {result['median_us']:12.2f} us")
+
+    if args.output:
+        report = {
+            "mongoclasses": __version__,
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
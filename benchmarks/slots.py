@@ -0,0 +1,112 @@
+"""
+Measures the memory taken by mongoclass instances with and without slots.
+
+Each measurement structures N documents with `from_document` and counts the
+bytes allocated with tracemalloc, once for a mongoclass storing its fields in
+the instance `__dict__` and once for the same mongoclass declared with
+`slots=True`. Run from the repository root:
+
+    python benchmarks/slots.py
+    python benchmarks/slots.py --instances 1000 100000 --output slots.json
+"""
+
+import argparse
+from dataclasses import field
+from datetime import datetime, timezone
+import gc
+import json
+import platform
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional, Type
+
+from bson import ObjectId
+
+from mongoclasses import from_document, mongoclass, to_document
+from mongoclasses.__about__ import __version__
+from mongoclasses.memory import MemoryDatabase
+
+
+def make_class(slots: bool) -> Type[Any]:
+    @mongoclass(db=MemoryDatabase(), collection_name="model", slots=slots)
+    class Model:
+        _id: ObjectId = field(default_factory=ObjectId)
+        name: str = ""
+        count: int = 0
+        score: float = 0.0
+        active: bool = False
+        created: Optional[datetime] = None
+        tags: List[str] = field(default_factory=list)
+
+    return Model
+
+
+def make_documents(count: int) -> List[Dict[str, Any]]:
+    cls = make_class(slots=False)
+    created = datetime(2024, 1, 1)
+    return [
+        to_document(cls(name=f"model {i}", count=i, created=created, tags=["a"]))
+        for i in range(count)
+    ]
+
+
+def measure(cls: Type[Any], documents: List[Dict[str, Any]]) -> Dict[str, float]:
+    # Compiles the hooks before measuring.
+    from_document(cls, documents[0])
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    objects = [from_document(cls, document) for document in documents]
+    elapsed = time.perf_counter() - start
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objects
+    return {
+        "bytes_per_instance": allocated / len(documents),
+        "us_per_instance": elapsed * 1e6 / len(documents),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--instances",
+        type=int,
+        nargs="+",
+        default=[1000, 10000, 100000],
+        help="Instance counts.",
+    )
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    args = parser.parse_args(argv)
+
+    results: List[Dict[str, Any]] = []
+    for count in args.instances:
+        documents = make_documents(count)
+        for slots in (False, True):
+            result = {
+                "instances": count,
+                "slots": slots,
+                **measure(make_class(slots), documents),
+            }
+            results.append(result)
+            print(
+                f"{count:8} instances {'slots' if slots else 'dict':>5} "
+                f"{result['bytes_per_instance']:10.1f} B/instance "
+                f"{result['us_per_instance']:10.2f} us/instance"
+            )
+
+    if args.output:
+        report = {
+            "mongoclasses": __version__,
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,141 @@
-from dataclasses import dataclass, fields, is_dataclass, Field
+from dataclasses import MISSING, dataclass, field, fields, is_dataclass, Field
 from typing import (
+    IO,
     Any,
+    AsyncIterator,
+    Awaitable,
     Callable,
     ClassVar,
+    Generic,
+    Deque,
     Dict,
+    FrozenSet,
+    Hashable,
     Iterable,
+    Iterator,
     List,
     Literal,
+    Mapping,
     Optional,
     Protocol,
+    Sequence,
+    Set,
+    TYPE_CHECKING,
     Tuple,
     Type,
     TypeVar,
     Union,
+    cast,
 )
 from typing_extensions import Annotated, TypeGuard, get_origin
 
+import asyncio
+import base64
+import binascii
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+import copy
+import functools
+import gzip
+import importlib
+from itertools import islice
+import os
+import struct
+import uuid
+import warnings
+import weakref
+
+from bson import ObjectId, decode, decode_all, encode, json_util
+from bson.binary import UuidRepresentation
+from bson.codec_options import CodecOptions, TypeDecoder, TypeEncoder, TypeRegistry
+from bson.errors import BSONError
+from bson.raw_bson import RawBSONDocument
 import cattrs
-from cattrs.gen import make_dict_structure_fn, make_dict_unstructure_fn, override
-from cattrs.preconf.bson import make_converter
 from motor.motor_asyncio import (
     AsyncIOMotorCollection,
     AsyncIOMotorCursor,
     AsyncIOMotorDatabase,
 )
-from pymongo import IndexModel
+from pymongo import DeleteOne, IndexModel, InsertOne, ReplaceOne, UpdateOne
 from pymongo.collection import Collection
 from pymongo.cursor import Cursor
 from pymongo.database import Database
-from pymongo.results import InsertOneResult, UpdateResult, DeleteResult
+from pymongo.errors import (
+    BulkWriteError,
+    DuplicateKeyError,
+    WriteConcernError,
+    WriteError,
+)
+from pymongo.results import (
+    BulkWriteResult,
+    InsertOneResult,
+    InsertManyResult,
+    UpdateResult,
+    DeleteResult,
+)
+
+from ._batch import BatchLoader, id_key, match_ids, unique_ids
+from ._cache import CacheStats, DocumentCache
+from ._columns import Column, ColumnBatch, make_columns, scan
+from ._hooks import ClassHooks, _strip_annotated
+from .monitoring import _listeners, _Recorder
+
+if TYPE_CHECKING:
+    # Imported on first use, see `__getattr__`, `_is_async` and
+    # `_describe_plan`.
+    from ._plans import QueryPlan
+    from .memory import (
+        AsyncMemoryCollection,
+        AsyncMemoryDatabase,
+        MemoryCollection,
+        MemoryDatabase,
+    )
 
 
 @dataclass(frozen=True)
 class MongoClassConfig:
-    collection: Union[Collection, AsyncIOMotorCollection]
+    collection: Union[
+        "Collection[Any]",
+        "AsyncIOMotorCollection[Any]",
+        "MemoryCollection",
+        "AsyncMemoryCollection",
+    ]
     id_field: Field
     indexes: Tuple[IndexModel, ...]
-    converter: cattrs.Converter
+    hooks: ClassHooks
+    track_changes: bool = False
+    db_fields: Dict[str, str] = field(default_factory=dict)
+    deferred: FrozenSet[str] = frozenset()
+    projection: Dict[str, int] = field(default_factory=dict)
+    lazy_fields: bool = False
+    cache: Optional[DocumentCache] = None
+    batch_window: Optional[float] = None
+
+    @property
+    def converter(self) -> cattrs.Converter:
+        return self.hooks.converter
+
+    @functools.cached_property
+    def read_collection(self) -> Any:
+        """
+        The collection that instances are read from. Classes that track
+        changes read `RawBSONDocument` objects, whose bytes are kept as the
+        snapshot instead of encoding the structured instance again.
+        """
+        if not self.track_changes:
+            return self.collection
+        return self.collection.with_options(
+            codec_options=self.collection.codec_options.with_options(
+                document_class=RawBSONDocument
+            )
+        )
 
 
 class DataclassInstance(Protocol):
@@ -57,43 +156,187 @@ class DeveloperError(Exception):
     pass
 
 
+class QueryPlanError(DeveloperError):
+    """
+    This exception is raised by the plan guard when a query scans the whole
+    collection or sorts in memory, see `set_plan_guard`.
+
+    Attributes:
+        plan: The `QueryPlan` of the query.
+    """
+
+    def __init__(self, message: str, plan: "QueryPlan") -> None:
+        super().__init__(message)
+        self.plan = plan
+
+
+class QueryPlanWarning(UserWarning):
+    """
+    This warning is issued by the plan guard when a query scans the whole
+    collection or sorts in memory, see `set_plan_guard`.
+    """
+
+
+class InsertManyError(BulkWriteError):
+    """
+    This exception is raised when `insert_many` could not write every instance.
+
+    The `details` attribute holds the merged bulk write result, with the index
+    of each write error relative to the objects passed to `insert_many`.
+
+    Attributes:
+        inserted: The instances that were written.
+        not_inserted: The instances that were not written.
+    """
+
+    def __init__(
+        self,
+        results: Dict[str, Any],
+        inserted: List["MongoclassInstance"],
+        not_inserted: List["MongoclassInstance"],
+    ) -> None:
+        super().__init__(results)
+        self.inserted = inserted
+        self.not_inserted = not_inserted
+
+    def __reduce__(self) -> Tuple[Any, Any]:
+        return self.__class__, (self.details, self.inserted, self.not_inserted)
+
+
+class LoadError(ValueError):
+    """
+    This exception is raised by `load` when a document of the file is not
+    valid. The batches before it were already inserted.
+
+    Attributes:
+        index: The position of the document in the file.
+        details: The merged bulk write result of the batches inserted
+            before the document, as in `BulkWriteError.details`.
+    """
+
+    def __init__(self, message: str, index: int, details: Dict[str, Any]) -> None:
+        super().__init__(message)
+        self.index = index
+        self.details = details
+
+    def __reduce__(self) -> Tuple[Any, Any]:
+        return self.__class__, (str(self), self.index, self.details)
+
+
 @dataclass(frozen=True)
 class FieldMeta:
     """
     Metadata for mongoclass fields.
+
+    Setting any of the index attributes declares an index on the field, which
+    is created by `create_indexes` and `ensure_indexes`.
+
+    Attributes:
+        db_field: The name of the field in the database.
+        unique: If True, the index is unique.
+        deferred: If True, the field is only fetched when first accessed.
+        index: The direction or type of the index, e.g. `-1` or `"text"`.
+            True is ascending.
+        sparse: If True, the index skips documents without the field.
+        expire_after: If set, a TTL index that deletes documents this many
+            seconds after the date in the field.
+        partial_filter: A filter selecting the documents that are indexed.
+        index_with: (field name, direction) pairs appended to the key of a
+            compound index.
     """
 
     db_field: Optional[str] = None
     unique: bool = False
+    deferred: bool = False
+    index: Union[bool, int, str] = False
+    sparse: bool = False
+    expire_after: Optional[int] = None
+    partial_filter: Optional[Mapping[str, Any]] = None
+    index_with: Tuple[Tuple[str, Union[int, str]], ...] = ()
 
 
 def mongoclass(
     cls: Optional[Type[Any]] = None,
     /,
     *,
-    db: Union[Database, AsyncIOMotorDatabase, None] = None,
+    db: Union[
+        "Database[Any]",
+        "AsyncIOMotorDatabase[Any]",
+        "MemoryDatabase",
+        "AsyncMemoryDatabase",
+        None,
+    ] = None,
     collection_name: Optional[str] = None,
     indexes: Optional[List[IndexModel]] = None,
+    track_changes: bool = False,
+    precompile: bool = False,
+    cache_size: Optional[int] = None,
+    cache_ttl: Optional[float] = None,
+    batch_window: Optional[float] = None,
+    converter: Optional[cattrs.Converter] = None,
+    codecs: Optional[Sequence[Union[TypeEncoder, TypeDecoder]]] = None,
+    slots: bool = False,
     **dataclass_kwargs: Any,
 ) -> Union[Type[MongoclassInstance], Callable[[Type[Any]], Type[MongoclassInstance]]]:
     """
     Converts a class into a mongoclass.
 
     Parameters:
-        db: A pymongo database object.
+        db: A pymongo, Motor or `mongoclasses.memory` database object.
         collection_name: The name of the collection to use.
         indexes: A list of pymongo `IndexModel` objects.
+        track_changes: If True, instances remember the state they were loaded
+            or saved with so that `save` only sends the fields that changed.
+        precompile: If True, the functions that convert instances to and from
+            documents are generated when the class is decorated rather than
+            on first use.
+        cache_size: If set, `find_one` caches up to this many documents
+            looked up by `_id`. Writes made through mongoclasses evict or
+            refresh the cached document.
+        cache_ttl: The number of seconds a cached document stays valid.
+        batch_window: If set, the `afind_one` lookups by `_id` made within
+            this many seconds of each other are sent as one `$in` query. With
+            0, the lookups made in the same event loop iteration are batched.
+        converter: The cattrs converter used for the types that mongoclasses
+            does not convert itself. Defaults to a BSON converter of the
+            class, created on first use.
+        codecs: pymongo `TypeCodec` objects added to the type registry of the
+            collection. The values of their Python types are left to the BSON
+            encoder and decoder instead of being converted by the converter,
+            so `to_document` returns them unchanged. With codecs, UUIDs are
+            also left to BSON if the collection has a `uuid_representation`.
+        slots: If True, the class is replaced with one that stores its fields
+            in `__slots__`, on every supported Python version. Instances take
+            less memory, but fields left out of a partial load raise
+            AttributeError instead of being fetched, and fields cannot be
+            deferred.
         **dataclass_kwargs: Keyword arguments to pass to the `dataclass` decorator.
 
     Raises:
         DeveloperError: If the class does not have an _id field.
         DeveloperError: If the class is not a mongoclass and no database is specified.
+        DeveloperError: If `cache_ttl` is given without a positive `cache_size`.
+        DeveloperError: If a codec changes how BSON encodes a built-in type.
 
     Returns:
         A decorator that converts a class into a mongoclass.
     """
     def wrap(cls: Type[Any]) -> Type[MongoclassInstance]:
-        return _process_class(cls, db, collection_name, indexes, dataclass_kwargs)
+        return _process_class(
+            cls,
+            db,
+            collection_name,
+            indexes,
+            track_changes,
+            precompile,
+            cache_size,
+            cache_ttl,
+            batch_window,
+            converter,
+            codecs,
+            slots,
+            dataclass_kwargs,
+        )
 
     if cls is None:
         return wrap
@@ -103,14 +346,31 @@ def mongoclass(
 
 def _process_class(
     cls: Type[Any],
-    db: Union[Database, AsyncIOMotorDatabase, None],
+    db: Union[
+        "Database[Any]",
+        "AsyncIOMotorDatabase[Any]",
+        "MemoryDatabase",
+        "AsyncMemoryDatabase",
+        None,
+    ],
     collection_name: Optional[str],
     indexes: Optional[List[IndexModel]],
+    track_changes: bool,
+    precompile: bool,
+    cache_size: Optional[int],
+    cache_ttl: Optional[float],
+    batch_window: Optional[float],
+    converter: Optional[cattrs.Converter],
+    codecs: Optional[Sequence[Union[TypeEncoder, TypeDecoder]]],
+    slots: bool,
     dataclass_kwargs: Dict[str, Any],
 ) -> Type[MongoclassInstance]:
-    if not is_dataclass(cls) or dataclass_kwargs:
+    if not is_dataclass(cls) or dataclass_kwargs or slots:
         cls = dataclass(**dataclass_kwargs)(cls)
 
+    if slots and "__slots__" not in cls.__dict__:
+        cls = _add_slots(cls, track_changes)
+
     if collection_name is None:
         collection_name = cls.__name__.lower()
 
@@ -128,40 +388,219 @@ def _process_class(
         indexes = []
 
     id_field = None
-    overrides = {}
+    db_fields = {}
+    deferred: Set[str] = set()
+    indexed = []
     for field in fields(cls):
         field_name = _get_field_name(field)
+        db_fields[field.name] = field_name
         if field_name == "_id":
             id_field = field
 
-        if field_name != field.name:
-            overrides[field.name] = override(rename=field_name)
-
         # Check for indexes
         field_meta = _get_field_meta(field)
-        if field_meta is not None and field_meta.unique is True:
-            indexes.append(IndexModel(field_name, unique=True))
+        if field_meta is not None and _declares_index(field_meta):
+            indexed.append((field.name, field_meta))
+
+        if field_meta is not None and field_meta.deferred is True:
+            deferred.add(field.name)
+
+    for name, field_meta in indexed:
+        indexes.append(
+            _get_field_index(cast(Type[Any], cls), name, field_meta, db_fields)
+        )
 
     if id_field is None:
         raise DeveloperError(f"Class {cls} has no _id field")
 
-    converter = make_converter()
-    if overrides:
-        unstruct_func = make_dict_unstructure_fn(cls, converter, **overrides)
-        struct_func = make_dict_structure_fn(cls, converter, **overrides)
-        converter.register_unstructure_hook(cls, unstruct_func)
-        converter.register_structure_hook(cls, struct_func)
+    if id_field.name in deferred:
+        raise DeveloperError("The _id field cannot be deferred.")
+
+    has_slots = "__slots__" in cls.__dict__
+    if deferred and has_slots:
+        raise DeveloperError("Deferred fields are not supported on slotted classes.")
+
+    if cache_size is not None and cache_size < 1:
+        raise DeveloperError("The cache size must be positive.")
+
+    if cache_ttl is not None and cache_size is None:
+        raise DeveloperError("A cache TTL requires a cache size.")
+
+    if batch_window is not None and batch_window < 0:
+        raise DeveloperError("The batch window cannot be negative.")
+
+    passthrough: FrozenSet[Type[Any]] = frozenset()
+    if codecs is not None:
+        collection = _add_codecs(collection, codecs)
+        passthrough = _codec_types(collection.codec_options, codecs)
+
+    hooks = ClassHooks(cast(Type[Any], cls), None, db_fields, passthrough=passthrough)
+    if converter is not None:
+        # The types of the codecs only pass through for this class.
+        hooks.register(converter.copy() if passthrough else converter)
 
     config = MongoClassConfig(
         collection=collection,
         id_field=id_field,
         indexes=tuple(indexes),
-        converter=converter,
+        hooks=hooks,
+        track_changes=track_changes,
+        db_fields=db_fields,
+        deferred=frozenset(deferred),
+        projection={
+            db_field: 1
+            for name, db_field in db_fields.items()
+            if name not in deferred
+        },
+        lazy_fields=not has_slots,
+        cache=None if cache_size is None else DocumentCache(cache_size, cache_ttl),
+        batch_window=batch_window,
     )
     setattr(cls, "__mongoclass_config__", config)
+    if not has_slots:
+        setattr(cls, _UNLOADED_ATTR, frozenset())
+        for field in fields(cls):
+            setattr(cls, field.name, _LazyField(field))
+    if precompile:
+        config.hooks.compile()
+    _registry[cast(Type[Any], cls)] = None
     return cls
 
 
+def _add_slots(cls: Type[Any], track_changes: bool) -> Type[Any]:
+    """
+    Returns a copy of a dataclass that stores its fields in `__slots__`.
+
+    `dataclass(slots=True)` requires Python 3.10, this does the same on every
+    supported version, with slots for the attributes mongoclasses sets on
+    instances.
+    """
+    names = [f.name for f in fields(cls)]
+    names.append(_UNLOADED_ATTR)
+    if track_changes:
+        names.append(_SNAPSHOT_ATTR)
+    inherited: Set[str] = set()
+    for base in cls.__mro__[1:-1]:
+        inherited.update(getattr(base, "__slots__", ()))
+        if "__dict__" in base.__dict__:
+            # The instances keep a __dict__ anyway.
+            inherited.update(names)
+
+    cls_dict = dict(cls.__dict__)
+    cls_dict["__slots__"] = tuple(name for name in names if name not in inherited)
+    for name in names:
+        # The defaults are kept by the fields, and would clash with the slots.
+        cls_dict.pop(name, None)
+    cls_dict.pop("__dict__", None)
+    cls_dict.pop("__weakref__", None)
+
+    if cls.__dataclass_params__.frozen:
+        # The default pickling sets the slots with setattr, which frozen
+        # dataclasses forbid.
+        cls_dict["__getstate__"] = _get_slots_state
+        cls_dict["__setstate__"] = _set_slots_state
+
+    metaclass: Any = type(cls)
+    new_cls: Type[Any] = metaclass(cls.__name__, cls.__bases__, cls_dict)
+    new_cls.__qualname__ = cls.__qualname__
+
+    # Methods calling super() without arguments refer to the class through a
+    # closure cell, which still holds the original class.
+    for value in cls_dict.values():
+        value = getattr(value, "__func__", value)
+        if isinstance(value, property):
+            functions = [value.fget, value.fset, value.fdel]
+        else:
+            functions = [value]
+        for function in functions:
+            for cell in getattr(function, "__closure__", None) or ():
+                try:
+                    if cell.cell_contents is cls:
+                        cell.cell_contents = new_cls
+                except ValueError:
+                    # An empty cell.
+                    pass
+    return new_cls
+
+
+def _add_codecs(
+    collection: Any, codecs: Sequence[Union[TypeEncoder, TypeDecoder]]
+) -> Any:
+    """
+    Returns the collection with the codecs added to its type registry.
+    """
+    registry = collection.codec_options.type_registry
+    try:
+        registry = TypeRegistry(
+            [*registry.codecs, *codecs], fallback_encoder=registry.fallback_encoder
+        )
+    except TypeError as exc:
+        raise DeveloperError(str(exc)) from exc
+    codec_options = collection.codec_options.with_options(type_registry=registry)
+    return collection.with_options(codec_options=codec_options)
+
+
+def _codec_types(
+    codec_options: "CodecOptions[Any]",
+    codecs: Sequence[Union[TypeEncoder, TypeDecoder]],
+) -> FrozenSet[Type[Any]]:
+    """
+    Returns the types whose values are handed to BSON unchanged.
+    """
+    types = {codec.python_type for codec in codecs if isinstance(codec, TypeEncoder)}
+    if codec_options.uuid_representation != UuidRepresentation.UNSPECIFIED:
+        types.add(uuid.UUID)
+    return frozenset(types)
+
+
+def _get_slots_state(self: Any) -> Dict[str, Any]:
+    return {
+        name: getattr(self, name)
+        for base in type(self).__mro__
+        for name in base.__dict__.get("__slots__", ())
+        if hasattr(self, name)
+    }
+
+
+def _set_slots_state(self: Any, state: Mapping[str, Any]) -> None:
+    for name, value in state.items():
+        object.__setattr__(self, name, value)
+
+
+class _LazyField:
+    """
+    Stands in for a dataclass field on the class so that fields left out of a
+    partial load are fetched from the database when first accessed.
+    """
+
+    def __init__(self, field: "Field[Any]") -> None:
+        self.field = field
+
+    def __get__(self, obj: Any, owner: Type[Any]) -> Any:
+        if obj is None:
+            if self.field.default is MISSING:
+                raise AttributeError(self.field.name)
+            return self.field.default
+
+        if not _resolve_pending(obj, (self.field.name,)):
+            return obj.__dict__[self.field.name]
+
+        if self.field.name not in getattr(obj, _UNLOADED_ATTR):
+            # init=False fields with a plain default are never set on the
+            # instance, dataclasses relies on the class attribute instead.
+            if self.field.default is MISSING:
+                raise AttributeError(self.field.name)
+            return self.field.default
+
+        if _is_async(get_collection(obj)):
+            raise AttributeError(
+                f"Field {self.field.name!r} is not loaded, use afetch_fields()."
+            )
+
+        fetch_fields(obj, self.field.name)
+        return obj.__dict__[self.field.name]
+
+
 def _get_field_name(field: Field) -> str:
     field_meta = _get_field_meta(field)
 
@@ -171,6 +610,39 @@ def _get_field_name(field: Field) -> str:
     return field.name
 
 
+def _declares_index(field_meta: FieldMeta) -> bool:
+    return (
+        field_meta.index is not False
+        or field_meta.unique
+        or field_meta.sparse
+        or field_meta.expire_after is not None
+        or field_meta.partial_filter is not None
+        or bool(field_meta.index_with)
+    )
+
+
+def _get_field_index(
+    cls: Type[Any], name: str, field_meta: FieldMeta, db_fields: Dict[str, str]
+) -> IndexModel:
+    direction = 1 if isinstance(field_meta.index, bool) else field_meta.index
+    keys = [(db_fields[name], direction)]
+    for other, other_direction in field_meta.index_with:
+        if other not in db_fields:
+            raise DeveloperError(f"Class {cls} has no field {other!r}.")
+        keys.append((db_fields[other], other_direction))
+
+    options: Dict[str, Any] = {}
+    if field_meta.unique:
+        options["unique"] = True
+    if field_meta.sparse:
+        options["sparse"] = True
+    if field_meta.expire_after is not None:
+        options["expireAfterSeconds"] = field_meta.expire_after
+    if field_meta.partial_filter is not None:
+        options["partialFilterExpression"] = dict(field_meta.partial_filter)
+    return IndexModel(keys, **options)
+
+
 def _get_field_meta(field: Field) -> Optional[FieldMeta]:
     if get_origin(field.type) is not Annotated:
         return None
@@ -211,7 +683,8 @@ def get_collection(
     except AttributeError:
         raise TypeError("Object must be a mongoclass.")
 
-    return config.collection
+    # The memory collections have the interface of the pymongo and Motor ones.
+    return cast(Union[Collection, AsyncIOMotorCollection], config.collection)
 
 
 def get_converter(
@@ -219,6 +692,12 @@ def get_converter(
 ) -> cattrs.Converter:
     """
     Returns the converter associated with the mongoclass.
+
+    Each mongoclass has its own converter, created on first use, unless one
+    was passed with `mongoclass(converter=...)`, which can be shared by
+    several classes. Until then, the types that the generated functions of
+    the class do not handle are converted by a BSON converter shared by all
+    mongoclasses.
     """
     try:
         config = obj.__mongoclass_config__
@@ -238,218 +717,3492 @@ def is_mongoclass(
     return hasattr(cls, "__mongoclass_config__")
 
 
+# Every mongoclass, in the order they were created.
+_registry: "weakref.WeakKeyDictionary[Type[Any], None]" = weakref.WeakKeyDictionary()
+
+
+def get_mongoclasses() -> List[Type[MongoclassInstance]]:
+    """
+    Returns every mongoclass that was created and is still referenced, in the
+    order they were created.
+    """
+    return list(_registry.keys())
+
+
 def to_document(obj: MongoclassInstance, /) -> Dict[str, Any]:
     """
     Converts a mongoclass instance into a dictionary.
+
+    Raises:
+        DeveloperError: If fields of the object were not loaded, load them
+            with `fetch_fields` or `afetch_fields` first.
     """
-    converter = get_converter(type(obj))
-    return converter.unstructure(obj)
+    try:
+        config = type(obj).__mongoclass_config__
+    except AttributeError:
+        raise TypeError("Object must be a mongoclass instance.")
+
+    unloaded = getattr(obj, _UNLOADED_ATTR, ())
+    if unloaded:
+        # Fields waiting on raw BSON values are structured from them.
+        unloaded = _resolve_pending(obj, tuple(unloaded))
+    if unloaded:
+        raise DeveloperError(
+            f"Fields {sorted(unloaded)} of {type(obj)} were not loaded, "
+            "use fetch_fields() or afetch_fields() first."
+        )
+    return config.hooks.unstructure(obj)
 
 
-def from_document(cls: Type[T], /, data: Dict[str, Any]) -> T:
+def from_document(
+    cls: Type[T], /, data: Dict[str, Any], trusted: bool = False
+) -> T:
     """
     Converts a dictionary into a mongoclass instance.
+
+    If `trusted` is True the document is assumed to have been written by
+    `to_document`: the instance is allocated without calling `__init__` or
+    `__post_init__`, and BSON native values are assigned without coercion.
     """
-    converter = get_converter(cls)
-    return converter.structure(data, cls)
+    if not hasattr(cls, "__mongoclass_config__"):
+        raise TypeError("Object must be a mongoclass.")
+    return _structure(cls, data, trusted=trusted)
 
 
-def insert_one(obj: MongoclassInstance, /) -> InsertOneResult:
+_UNLOADED_ATTR = "__mongoclass_unloaded__"
+_PENDING_ATTR = "__mongoclass_pending__"
+
+
+def _structure(
+    cls: Type[T],
+    data: Mapping[str, Any],
+    loaded: Optional[FrozenSet[str]] = None,
+    trusted: bool = False,
+) -> T:
     """
-    Inserts the object into the database.
+    Structures the document, leaving out the fields that were not loaded.
 
-    Parameters:
-        obj: A mongoclass instance.
+    A field counts as not loaded if its key is missing from the document and it
+    is not in `loaded`, which defaults to the fields that are not deferred.
 
-    Returns:
-        A pymongo `InsertOneResult` object.
+    If the document is a `RawBSONDocument`, sub-documents and arrays are kept
+    undecoded and only structured when their field is first accessed.
     """
-    document = to_document(obj)
-    collection = get_collection(obj)
-    result = collection.insert_one(document)
-    set_id(obj, result.inserted_id)
-    return result
+    config = cls.__mongoclass_config__
+    snapshot = None
+    # Checking for dict first skips the slower ABC instance check.
+    raw = type(data) is not dict and isinstance(data, RawBSONDocument)
+    if raw and (config.track_changes or not config.lazy_fields):
+        snapshot = cast(RawBSONDocument, data).raw
+        data = decode(snapshot, codec_options=config.collection.codec_options)
+        raw = False
 
+    pending = {}
+    if raw:
+        for name, db_field in config.db_fields.items():
+            value = data.get(db_field)
+            if isinstance(value, (RawBSONDocument, list)):
+                pending[name] = value
 
-async def ainsert_one(obj: MongoclassInstance, /) -> InsertOneResult:
-    document = to_document(obj)
-    collection = get_collection(obj)
-    result = await collection.insert_one(document)
-    assert isinstance(result, InsertOneResult)
-    set_id(obj, result.inserted_id)
-    return result
+    unloaded: Sequence[str]
+    if loaded is None and not config.deferred:
+        unloaded = ()
+    else:
+        if loaded is None:
+            loaded = frozenset(config.db_fields) - config.deferred
+        unloaded = [
+            name
+            for name, db_field in config.db_fields.items()
+            if name not in loaded and db_field not in data
+        ]
 
+    obj: T
+    if not unloaded and not pending:
+        if trusted:
+            obj = config.hooks.trusted_structure(data)
+        else:
+            obj = config.hooks.structure(data)
+    else:
+        obj = cls.__new__(cls)
+        for field in fields(cls):
+            if field.name not in unloaded and field.name not in pending:
+                object.__setattr__(
+                    obj, field.name, _structure_field(cls, field, data)
+                )
+        object.__setattr__(obj, _UNLOADED_ATTR, frozenset(unloaded).union(pending))
+        if pending:
+            object.__setattr__(obj, _PENDING_ATTR, pending)
 
-ainsert_one.__doc__ = insert_one.__doc__
+    if config.track_changes:
+        if snapshot is None:
+            _take_snapshot(obj, _loaded_document(obj))
+        else:
+            # The document as received, which saves encoding the instance.
+            object.__setattr__(obj, _SNAPSHOT_ATTR, snapshot)
+    return obj
 
 
-def update_one(obj: MongoclassInstance, update: Dict[str, Any], /) -> UpdateResult:
+def _structure_field(
+    cls: Type[MongoclassInstance], field: "Field[Any]", data: Mapping[str, Any]
+) -> Any:
+    config = cls.__mongoclass_config__
+    db_field = config.db_fields[field.name]
+    if db_field in data:
+        return config.hooks.fallback.structure(
+            data[db_field], _strip_annotated(field.type)
+        )
+    if field.default is not MISSING:
+        return field.default
+    if field.default_factory is not MISSING:
+        return field.default_factory()
+    raise KeyError(db_field)
+
+
+def _inflate(value: Any, codec_options: "CodecOptions[Any]") -> Any:
     """
-    Updates the object in the database.
+    Decodes the `RawBSONDocument` objects within a value.
+    """
+    if isinstance(value, RawBSONDocument):
+        return decode(value.raw, codec_options=codec_options)
+    if isinstance(value, list):
+        return [_inflate(item, codec_options) for item in value]
+    return value
 
-    Parameters:
-        obj: A mongoclass instance.
-        update: An update document.
 
-    Returns:
-        A pymongo `UpdateResult` object.
+def _resolve_pending(obj: MongoclassInstance, names: Tuple[str, ...]) -> Tuple[str, ...]:
     """
-    collection = get_collection(obj)
-    return collection.update_one(filter={"_id": get_id(obj)}, update=update)
+    Structures the fields that are waiting on raw BSON values.
 
+    Returns the names of the fields that still have to be fetched.
+    """
+    # Slotted instances have no __dict__ and never wait on raw values.
+    pending = getattr(obj, "__dict__", {}).get(_PENDING_ATTR)
+    if not pending:
+        return names
 
-async def aupdate_one(
-    obj: MongoclassInstance, update: Dict[str, Any], /
-) -> UpdateResult:
-    collection = get_collection(obj)
-    result = await collection.update_one(filter={"_id": get_id(obj)}, update=update)
-    assert isinstance(result, UpdateResult)
-    return result
+    cls = type(obj)
+    config = cls.__mongoclass_config__
+    codec_options = config.collection.codec_options
+    resolved = {}
+    for field in fields(cls):
+        if field.name in names and field.name in pending:
+            value = _inflate(pending[field.name], codec_options)
+            resolved[field.name] = config.hooks.fallback.structure(
+                value, _strip_annotated(field.type)
+            )
 
+    for name, value in resolved.items():
+        object.__setattr__(obj, name, value)
+    _mark_loaded(obj, tuple(resolved))
+    # Copies of the instance share the dictionary, which is left unchanged.
+    pending = {name: value for name, value in pending.items() if name not in resolved}
+    if pending:
+        obj.__dict__[_PENDING_ATTR] = pending
+    else:
+        del obj.__dict__[_PENDING_ATTR]
+    return tuple(name for name in names if name not in resolved)
 
-aupdate_one.__doc__ = update_one.__doc__
 
+def _mark_loaded(obj: MongoclassInstance, names: Tuple[str, ...]) -> None:
+    unloaded: FrozenSet[str] = getattr(obj, _UNLOADED_ATTR, frozenset())
+    unloaded = unloaded.difference(names)
+    if unloaded:
+        object.__setattr__(obj, _UNLOADED_ATTR, unloaded)
+    else:
+        try:
+            object.__delattr__(obj, _UNLOADED_ATTR)
+        except AttributeError:
+            # Not set on the instance, or only set on the class.
+            pass
 
-def replace_one(obj: MongoclassInstance, /, upsert: bool = False) -> UpdateResult:
+
+def _loaded_document(obj: MongoclassInstance) -> Dict[str, Any]:
     """
-    Replaces the object in the database.
+    Converts the loaded fields of a mongoclass instance into a dictionary.
+    """
+    unloaded = getattr(obj, _UNLOADED_ATTR, ())
+    if not unloaded:
+        return type(obj).__mongoclass_config__.hooks.unstructure(obj)
 
-    Parameters:
-        obj: A mongoclass instance.
-        upsert: If True, will insert the document if it does not already exist.
+    config = type(obj).__mongoclass_config__
+    return {
+        config.db_fields[field.name]: config.hooks.fallback.unstructure(
+            getattr(obj, field.name), _strip_annotated(field.type)
+        )
+        for field in fields(obj)
+        if field.name not in unloaded
+    }
 
-    Returns:
-        A pymongo `UpdateResult` object.
+
+def _get_projection(
+    cls: Type[MongoclassInstance],
+    only: Optional[Iterable[str]],
+    exclude: Optional[Iterable[str]],
+) -> Tuple[Dict[str, int], Optional[FrozenSet[str]]]:
     """
-    document = to_document(obj)
-    collection = get_collection(obj)
-    return collection.replace_one(
-        filter={"_id": get_id(obj)}, replacement=document, upsert=upsert
-    )
+    Returns the projection and the fields to load for a query.
+    """
+    config = cls.__mongoclass_config__
+    if only is None and exclude is None:
+        return config.projection, None
 
+    if only is None:
+        names = set(config.db_fields) - config.deferred
+    else:
+        names = set(only)
+    if exclude is not None:
+        names.difference_update(exclude)
+    names.add(config.id_field.name)
 
-async def areplace_one(
-    obj: MongoclassInstance, /, upsert: bool = False
-) -> UpdateResult:
-    document = to_document(obj)
-    collection = get_collection(obj)
-    result = await collection.replace_one(
-        filter={"_id": get_id(obj)}, replacement=document, upsert=upsert
-    )
-    assert isinstance(result, UpdateResult)
-    return result
+    for name in names.union(exclude or ()):
+        if name not in config.db_fields:
+            raise DeveloperError(f"Class {cls} has no field {name!r}.")
 
+    projection = {config.db_fields[name]: 1 for name in names}
+    return projection, frozenset(names)
 
-areplace_one.__doc__ = replace_one.__doc__
 
+def _is_async(collection: Any) -> bool:
+    from .memory import AsyncMemoryCollection
 
-def delete_one(obj: MongoclassInstance, /) -> DeleteResult:
+    return isinstance(collection, (AsyncIOMotorCollection, AsyncMemoryCollection))
+
+
+def _prepare_fetch(
+    obj: MongoclassInstance, names: Tuple[str, ...]
+) -> Tuple[Dict[str, Any], Dict[str, int], Tuple[str, ...]]:
+    config = type(obj).__mongoclass_config__
+    if not names:
+        names = tuple(getattr(obj, _UNLOADED_ATTR, ()))
+    for name in names:
+        if name not in config.db_fields:
+            raise DeveloperError(f"Class {type(obj)} has no field {name!r}.")
+    names = _resolve_pending(obj, names)
+
+    projection = {config.db_fields[name]: 1 for name in names}
+    return {"_id": get_id(obj)}, projection, names
+
+
+def _assign_fetched(
+    obj: MongoclassInstance,
+    names: Tuple[str, ...],
+    document: Optional[Mapping[str, Any]],
+) -> None:
+    if document is None:
+        raise LookupError(f"Document {get_id(obj)!r} no longer exists.")
+
+    cls = type(obj)
+    config = cls.__mongoclass_config__
+    fields_by_name = {field.name: field for field in fields(cls)}
+    for name in names:
+        value = _structure_field(cls, fields_by_name[name], document)
+        object.__setattr__(obj, name, value)
+
+    _mark_loaded(obj, names)
+
+    snapshot = getattr(obj, _SNAPSHOT_ATTR, None)
+    if snapshot is not None:
+        codec_options = config.collection.codec_options
+        snapshot_document = decode(snapshot, codec_options=codec_options)
+        converter = config.hooks.fallback
+        for name in names:
+            snapshot_document[config.db_fields[name]] = converter.unstructure(
+                getattr(obj, name), _strip_annotated(fields_by_name[name].type)
+            )
+        _take_snapshot(obj, snapshot_document)
+
+
+def fetch_fields(obj: MongoclassInstance, /, *names: str) -> None:
     """
-    Deletes the object from the database.
+    Loads fields that were left out when the object was read.
+
+    Deferred fields and fields left out with `only` or `exclude` are fetched
+    automatically on first access for synchronous collections. Use this
+    function to fetch several of them with a single query.
 
     Parameters:
         obj: A mongoclass instance.
+        *names: The fields to load, defaults to every field not yet loaded.
 
-    Returns:
-        A pymongo `DeleteResult` object.
+    Raises:
+        LookupError: If the document no longer exists.
     """
+    filter, projection, names = _prepare_fetch(obj, names)
+    if not names:
+        return
     collection = get_collection(obj)
-    return collection.delete_one({"_id": get_id(obj)})
+    if _is_async(collection):
+        raise TypeError("Use afetch_fields() with asynchronous collections.")
+    rec = _Recorder(type(obj), "fetch_fields") if _listeners else None
+    document = cast("Collection[Any]", collection).find_one(filter, projection)
+    if rec is not None:
+        rec.received(document)
+    _assign_fetched(obj, names, document)
+    if rec is not None:
+        rec.converted()
+        rec.publish()
 
 
-async def adelete_one(obj: MongoclassInstance, /) -> DeleteResult:
-    collection = get_collection(obj)
-    result = await collection.delete_one({"_id": get_id(obj)})
-    assert isinstance(result, DeleteResult)
-    return result
+async def afetch_fields(obj: MongoclassInstance, /, *names: str) -> None:
+    filter, projection, names = _prepare_fetch(obj, names)
+    if not names:
+        return
+    collection = cast("AsyncIOMotorCollection[Any]", get_collection(obj))
+    rec = _Recorder(type(obj), "afetch_fields") if _listeners else None
+    document = await collection.find_one(filter, projection)
+    if rec is not None:
+        rec.received(document)
+    _assign_fetched(obj, names, document)
+    if rec is not None:
+        rec.converted()
+        rec.publish()
 
 
-adelete_one.__doc__ = delete_one.__doc__
+afetch_fields.__doc__ = fetch_fields.__doc__
 
 
-def find_one(cls: Type[T], /, filter: Optional[Dict[str, Any]] = None) -> Optional[T]:
-    """
-    Return a single instance that matches the query or None.
+_SNAPSHOT_ATTR = "__mongoclass_snapshot__"
 
-    Parameters:
-        cls: A mongoclass type.
-        filter: A dictionary specifying the query to be performed.
 
-    Returns:
-        A mongoclass instance or None.
+def _take_snapshot(obj: MongoclassInstance, document: Mapping[str, Any]) -> None:
     """
-    collection = get_collection(cls)
-    document = collection.find_one(filter=filter)
-    if document is None:
-        return None
-    return from_document(cls, document)
+    Remembers the document as the state of the object in the database.
+    """
+    config = type(obj).__mongoclass_config__
+    if not config.track_changes:
+        return
 
+    if isinstance(document, RawBSONDocument):
+        data = document.raw
+    else:
+        data = encode(document, codec_options=config.collection.codec_options)
+    object.__setattr__(obj, _SNAPSHOT_ATTR, data)
 
-async def afind_one(
-    cls: Type[T], /, filter: Optional[Dict[str, Any]] = None
-) -> Optional[T]:
-    collection = get_collection(cls)
-    document = await collection.find_one(filter=filter)
-    if document is None:
-        return None
-    return from_document(cls, document)
 
+def _is_path_safe(document: Mapping[str, Any]) -> bool:
+    return all("." not in key and not key.startswith("$") for key in document)
 
-afind_one.__doc__ = find_one.__doc__
 
+def _diff_documents(
+    old: Mapping[str, Any],
+    new: Mapping[str, Any],
+    prefix: str = "",
+    update: Optional[Dict[str, Dict[str, Any]]] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Returns an update document that turns `old` into `new`.
 
-def find(
-    cls: Type[MongoclassInstance],
-    /,
-    filter: Optional[Dict[str, Any]] = None,
-    skip: int = 0,
-    limit: int = 0,
-    sort: Optional[List[Tuple[str, Literal[-1, 1]]]] = None,
-) -> Union[Cursor, AsyncIOMotorCursor]:
+    Keys of the top level document that are missing from `new` are left alone,
+    keys of nested documents that are missing from `new` are unset.
     """
-    Performs a query on the collection associated with the mongoclass.
+    if update is None:
+        update = {}
 
-    Parameters:
-        cls: A mongoclass.
-        filter: A query document that selects which documents to include in the result set.
-        skip: The number of documents to omit from the start of the result set.
-        limit: The maximum number of results to return.
-        sort: A list of (key, direction) pairs.
+    for key, value in new.items():
+        path = prefix + key
+        if key not in old:
+            update.setdefault("$set", {})[path] = value
+            continue
 
-    Returns:
-        A MongoDB cursor.
+        old_value = old[key]
+        if type(old_value) is type(value) and old_value == value:
+            continue
+
+        if (
+            isinstance(old_value, Mapping)
+            and isinstance(value, Mapping)
+            and _is_path_safe(old_value)
+            and _is_path_safe(value)
+        ):
+            _diff_documents(old_value, value, path + ".", update)
+        else:
+            update.setdefault("$set", {})[path] = value
+
+    if prefix:
+        for key in old:
+            if key not in new:
+                update.setdefault("$unset", {})[prefix + key] = ""
+
+    return update
+
+
+def _prepare_save(
+    obj: MongoclassInstance,
+) -> Tuple[Dict[str, Any], Dict[str, Any], bytes]:
     """
-    collection = get_collection(cls)
-    return collection.find(filter=filter, skip=skip, limit=limit, sort=sort)
+    Returns the filter, update and new snapshot for saving the object.
 
+    If the object has no snapshot the update is a full replacement document.
+    """
+    config = type(obj).__mongoclass_config__
+    if not config.track_changes:
+        raise DeveloperError(f"Class {type(obj)} does not track changes.")
 
-def iter_objects(cls: Type[T], cursor: Cursor) -> Iterable[T]:
-    for document in cursor:
-        yield from_document(cls, document)
+    codec_options: "CodecOptions[Any]" = config.collection.codec_options
+    snapshot = getattr(obj, _SNAPSHOT_ATTR, None)
+    document = to_document(obj) if snapshot is None else _loaded_document(obj)
+    data = encode(document, codec_options=codec_options)
+    new = decode(data, codec_options=codec_options)
 
+    if snapshot is None:
+        return {"_id": new["_id"]}, new, data
 
-async def aiter_objects(cls: Type[T], cursor: AsyncIOMotorCursor) -> Iterable[T]:
-    async for document in cursor:
-        yield from_document(cls, document)
+    if snapshot == data:
+        return {}, {}, data
 
+    old = decode(snapshot, codec_options=codec_options)
+    return {"_id": old["_id"]}, _diff_documents(old, new), data
 
-def create_indexes(cls: Type[MongoclassInstance], /) -> List[str]:
+
+def cache_stats(cls: Type[MongoclassInstance], /) -> CacheStats:
     """
-    Creates the indexes specified by the mongoclass.
+    Returns the counters of the document cache of a mongoclass.
 
-    Parameters:
-        cls: A mongoclass.
+    Raises:
+        DeveloperError: If the class was not created with a `cache_size`.
+    """
+    return _get_cache(cls).stats()
 
-    Returns:
-        A list of index names.
+
+def clear_cache(cls: Type[MongoclassInstance], /) -> None:
     """
-    collection = get_collection(cls)
-    return collection.create_indexes(list(cls.__mongoclass_config__.indexes))
+    Drops every document from the document cache of a mongoclass.
 
+    Raises:
+        DeveloperError: If the class was not created with a `cache_size`.
+    """
+    _get_cache(cls).clear()
 
-async def acreate_indexes(cls: Type[MongoclassInstance], /) -> List[str]:
-    collection = get_collection(cls)
-    return await collection.create_indexes(list(cls.__mongoclass_config__.indexes))
+
+def _get_cache(cls: Type[MongoclassInstance]) -> DocumentCache:
+    try:
+        config = cls.__mongoclass_config__
+    except AttributeError:
+        raise TypeError("Object must be a mongoclass.")
+
+    if config.cache is None:
+        raise DeveloperError(f"Class {cls} does not have a cache.")
+    return config.cache
+
+
+# The types of the `_id` values whose lookups are cached.
+_LOOKUP_ID_TYPES = (ObjectId, str, int, float, uuid.UUID)
+
+
+def _get_lookup_id(
+    filter: Optional[Mapping[str, Any]], loaded: Optional[FrozenSet[str]]
+) -> Any:
+    """
+    Returns the `_id` of a `find_one` query or MISSING if it is not a plain
+    lookup by `_id` with the default projection.
+    """
+    if loaded is not None or not filter or len(filter) != 1:
+        return MISSING
+
+    id = filter.get("_id", MISSING)
+    # Other values, such as regular expressions, are queries rather than ids.
+    if not isinstance(id, _LOOKUP_ID_TYPES):
+        return MISSING
+    return id
+
+
+def _decode_cached(config: MongoClassConfig, data: bytes) -> Mapping[str, Any]:
+    if config.track_changes:
+        # Structured from the bytes, which are kept as the snapshot.
+        return RawBSONDocument(data, config.read_collection.codec_options)
+    return decode(data, config.collection.codec_options)
+
+
+def _encode_cached(
+    config: MongoClassConfig, document: Mapping[str, Any]
+) -> bytes:
+    if isinstance(document, RawBSONDocument):
+        return cast(bytes, document.raw)
+    return encode(document, codec_options=config.collection.codec_options)
+
+
+def _invalidate(
+    obj: MongoclassInstance, document: Optional[Mapping[str, Any]] = None
+) -> None:
+    """
+    Evicts the cached document of an instance after a write, or replaces it
+    with `document` if the whole document was written.
+    """
+    config = type(obj).__mongoclass_config__
+    if config.cache is None:
+        return
+
+    key = id_key(get_id(obj))
+    if document is None:
+        config.cache.evict(key)
+    else:
+        document = {
+            name: value
+            for name, value in document.items()
+            if name in config.projection
+        }
+        config.cache.refresh(key, _encode_cached(config, document))
+
+
+def insert_one(obj: MongoclassInstance, /) -> InsertOneResult:
+    """
+    Inserts the object into the database.
+
+    Parameters:
+        obj: A mongoclass instance.
+
+    Returns:
+        A pymongo `InsertOneResult` object.
+    """
+    rec = _Recorder(type(obj), "insert_one") if _listeners else None
+    document = to_document(obj)
+    if rec is not None:
+        rec.converted(document)
+    collection = get_collection(obj)
+    result = collection.insert_one(document)
+    if rec is not None:
+        rec.received()
+        rec.publish()
+    set_id(obj, result.inserted_id)
+    _take_snapshot(obj, document)
+    return result
+
+
+async def ainsert_one(obj: MongoclassInstance, /) -> InsertOneResult:
+    rec = _Recorder(type(obj), "ainsert_one") if _listeners else None
+    document = to_document(obj)
+    if rec is not None:
+        rec.converted(document)
+    collection = get_collection(obj)
+    result = await collection.insert_one(document)
+    if rec is not None:
+        rec.received()
+        rec.publish()
+    assert isinstance(result, InsertOneResult)
+    set_id(obj, result.inserted_id)
+    _take_snapshot(obj, document)
+    return result
+
+
+ainsert_one.__doc__ = insert_one.__doc__
+
+
+@dataclass(frozen=True)
+class _WriteLimits:
+    max_bson_size: int = 16 * 1024 * 1024
+    max_message_size: int = 48_000_000
+    max_batch_size: int = 100_000
+
+    @classmethod
+    def from_hello(cls, hello: Dict[str, Any]) -> "_WriteLimits":
+        return cls(
+            max_bson_size=hello.get("maxBsonObjectSize", cls.max_bson_size),
+            max_message_size=hello.get("maxMessageSizeBytes", cls.max_message_size),
+            max_batch_size=hello.get("maxWriteBatchSize", cls.max_batch_size),
+        )
+
+
+_write_limits: "weakref.WeakKeyDictionary[Any, _WriteLimits]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _get_write_limits(collection: "Collection[Any]") -> _WriteLimits:
+    client = collection.database.client
+    limits = _write_limits.get(client)
+    if limits is None:
+        limits = _WriteLimits.from_hello(collection.database.command("hello"))
+        _write_limits[client] = limits
+    return limits
+
+
+async def _aget_write_limits(
+    collection: "AsyncIOMotorCollection[Any]",
+) -> _WriteLimits:
+    client = collection.database.client
+    limits = _write_limits.get(client)
+    if limits is None:
+        limits = _WriteLimits.from_hello(await collection.database.command("hello"))
+        _write_limits[client] = limits
+    return limits
+
+
+@dataclass
+class _InsertBatch:
+    start: int
+    documents: List[RawBSONDocument] = field(default_factory=list)
+    ids: List[Any] = field(default_factory=list)
+    size: int = 0
+
+
+class _BulkInsert:
+    """
+    Tracks the progress of an `insert_many` call across server batches.
+    """
+
+    def __init__(
+        self, objs: Iterable[MongoclassInstance], ordered: bool
+    ) -> None:
+        self.objs = list(objs)
+        self.ordered = ordered
+        self.inserted = [False] * len(self.objs)
+        self.inserted_ids: List[Any] = []
+        self.acknowledged = True
+        self.write_errors: List[Dict[str, Any]] = []
+        self.write_concern_errors: List[Dict[str, Any]] = []
+
+        cls = type(self.objs[0]) if self.objs else None
+        if any(type(obj) is not cls for obj in self.objs):
+            raise TypeError("All objects must be instances of the same mongoclass.")
+
+    @property
+    def stopped(self) -> bool:
+        return self.ordered and bool(self.write_errors)
+
+    def batches(
+        self, collection: Any, limits: _WriteLimits, batch_size: Optional[int]
+    ) -> Iterator[_InsertBatch]:
+        max_count = limits.max_batch_size
+        if batch_size is not None:
+            max_count = min(max_count, batch_size)
+
+        codec_options = collection.codec_options
+        batch = _InsertBatch(start=0)
+        for index, obj in enumerate(self.objs):
+            document = to_document(obj)
+            if "_id" not in document:
+                document["_id"] = ObjectId()
+            data = encode(document, codec_options=codec_options)
+
+            if batch.documents and (
+                len(batch.documents) >= max_count
+                or batch.size + len(data) > limits.max_message_size
+            ):
+                yield batch
+                if self.stopped:
+                    return
+                batch = _InsertBatch(start=index)
+
+            if len(data) > limits.max_bson_size:
+                if batch.documents:
+                    yield batch
+                    if self.stopped:
+                        return
+                self.write_errors.append(
+                    {
+                        "index": index,
+                        "code": 10334,
+                        "errmsg": (
+                            f"Document is {len(data)} bytes, the server maximum "
+                            f"is {limits.max_bson_size} bytes."
+                        ),
+                        "op": {"_id": document["_id"]},
+                    }
+                )
+                if self.stopped:
+                    return
+                batch = _InsertBatch(start=index + 1)
+                continue
+
+            batch.documents.append(RawBSONDocument(data))
+            batch.ids.append(document["_id"])
+            batch.size += len(data)
+
+        if batch.documents:
+            yield batch
+
+    def succeeded(self, batch: _InsertBatch, acknowledged: bool) -> None:
+        self.acknowledged = self.acknowledged and acknowledged
+        for offset in range(len(batch.ids)):
+            self._mark_inserted(batch, offset)
+
+    def failed(self, batch: _InsertBatch, details: Mapping[str, Any]) -> None:
+        failed_offsets = set()
+        for error in details.get("writeErrors", []):
+            failed_offsets.add(error["index"])
+            self.write_errors.append({**error, "index": batch.start + error["index"]})
+        self.write_concern_errors.extend(details.get("writeConcernErrors", []))
+
+        for offset in range(len(batch.ids)):
+            if offset in failed_offsets:
+                if self.ordered:
+                    break
+                continue
+            self._mark_inserted(batch, offset)
+
+    def _mark_inserted(self, batch: _InsertBatch, offset: int) -> None:
+        index = batch.start + offset
+        obj = self.objs[index]
+        set_id(obj, batch.ids[offset])
+        _take_snapshot(obj, batch.documents[offset])
+        self.inserted[index] = True
+        self.inserted_ids.append(batch.ids[offset])
+
+    def result(self) -> InsertManyResult:
+        if not self.write_errors and not self.write_concern_errors:
+            return InsertManyResult(self.inserted_ids, self.acknowledged)
+
+        self.write_errors.sort(key=lambda error: error["index"])
+        details = {
+            "writeErrors": self.write_errors,
+            "writeConcernErrors": self.write_concern_errors,
+            "nInserted": len(self.inserted_ids),
+            "nUpserted": 0,
+            "nMatched": 0,
+            "nModified": 0,
+            "nRemoved": 0,
+            "upserted": [],
+        }
+        inserted = [obj for obj, ok in zip(self.objs, self.inserted) if ok]
+        not_inserted = [obj for obj, ok in zip(self.objs, self.inserted) if not ok]
+        raise InsertManyError(details, inserted, not_inserted)
+
+
+def insert_many(
+    objs: Iterable[MongoclassInstance],
+    /,
+    ordered: bool = False,
+    batch_size: Optional[int] = None,
+) -> InsertManyResult:
+    """
+    Inserts the objects into the database.
+
+    The objects are converted and sent in batches that respect the server's
+    `maxBsonObjectSize`, `maxMessageSizeBytes` and `maxWriteBatchSize` limits.
+    The id of each inserted document is written back onto its object.
+
+    Parameters:
+        objs: Instances of a single mongoclass.
+        ordered: If True, stop at the first failed insert.
+        batch_size: The maximum number of documents to send per batch.
+
+    Raises:
+        InsertManyError: If any of the objects could not be inserted.
+
+    Returns:
+        A pymongo `InsertManyResult` object.
+    """
+    bulk = _BulkInsert(objs, ordered)
+    if not bulk.objs:
+        return InsertManyResult([], True)
+
+    collection = cast("Collection[Any]", get_collection(bulk.objs[0]))
+    limits = _get_write_limits(collection)
+    rec = _Recorder(type(bulk.objs[0]), "insert_many") if _listeners else None
+    for batch in bulk.batches(collection, limits, batch_size):
+        if rec is not None:
+            rec.converted(*batch.documents)
+        try:
+            result = collection.insert_many(batch.documents, ordered=ordered)
+        except BulkWriteError as exc:
+            bulk.failed(batch, exc.details)
+        else:
+            bulk.succeeded(batch, result.acknowledged)
+        if rec is not None:
+            rec.received()
+    if rec is not None:
+        rec.publish()
+    return bulk.result()
+
+
+async def ainsert_many(
+    objs: Iterable[MongoclassInstance],
+    /,
+    ordered: bool = False,
+    batch_size: Optional[int] = None,
+) -> InsertManyResult:
+    bulk = _BulkInsert(objs, ordered)
+    if not bulk.objs:
+        return InsertManyResult([], True)
+
+    collection = cast("AsyncIOMotorCollection[Any]", get_collection(bulk.objs[0]))
+    limits = await _aget_write_limits(collection)
+    rec = _Recorder(type(bulk.objs[0]), "ainsert_many") if _listeners else None
+    for batch in bulk.batches(collection, limits, batch_size):
+        if rec is not None:
+            rec.converted(*batch.documents)
+        try:
+            result = await collection.insert_many(batch.documents, ordered=ordered)
+        except BulkWriteError as exc:
+            bulk.failed(batch, exc.details)
+        else:
+            bulk.succeeded(batch, result.acknowledged)
+        if rec is not None:
+            rec.received()
+    if rec is not None:
+        rec.publish()
+    return bulk.result()
+
+
+ainsert_many.__doc__ = insert_many.__doc__
+
+
+def update_one(obj: MongoclassInstance, update: Dict[str, Any], /) -> UpdateResult:
+    """
+    Updates the object in the database.
+
+    Parameters:
+        obj: A mongoclass instance.
+        update: An update document.
+
+    Returns:
+        A pymongo `UpdateResult` object.
+    """
+    collection = cast("Collection[Any]", get_collection(obj))
+    rec = _Recorder(type(obj), "update_one") if _listeners else None
+    try:
+        result = collection.update_one(filter={"_id": get_id(obj)}, update=update)
+    finally:
+        _invalidate(obj)
+    if rec is not None:
+        rec.received()
+        rec.publish()
+    return result
+
+
+async def aupdate_one(
+    obj: MongoclassInstance, update: Dict[str, Any], /
+) -> UpdateResult:
+    collection = cast("AsyncIOMotorCollection[Any]", get_collection(obj))
+    rec = _Recorder(type(obj), "aupdate_one") if _listeners else None
+    try:
+        result = await collection.update_one(
+            filter={"_id": get_id(obj)}, update=update
+        )
+    finally:
+        _invalidate(obj)
+    assert isinstance(result, UpdateResult)
+    if rec is not None:
+        rec.received()
+        rec.publish()
+    return result
+
+
+aupdate_one.__doc__ = update_one.__doc__
+
+
+def replace_one(obj: MongoclassInstance, /, upsert: bool = False) -> UpdateResult:
+    """
+    Replaces the object in the database.
+
+    Parameters:
+        obj: A mongoclass instance.
+        upsert: If True, will insert the document if it does not already exist.
+
+    Returns:
+        A pymongo `UpdateResult` object.
+    """
+    rec = _Recorder(type(obj), "replace_one") if _listeners else None
+    document = to_document(obj)
+    if rec is not None:
+        rec.converted(document)
+    collection = cast("Collection[Any]", get_collection(obj))
+    try:
+        result = collection.replace_one(
+            filter={"_id": get_id(obj)}, replacement=document, upsert=upsert
+        )
+    except BaseException:
+        _invalidate(obj)
+        raise
+    if rec is not None:
+        rec.received()
+        rec.publish()
+    _invalidate(obj, document if _replaced(result) else None)
+    _take_snapshot(obj, document)
+    return result
+
+
+def _replaced(result: UpdateResult) -> bool:
+    """
+    Returns True if a replacement is known to have been written.
+    """
+    return result.acknowledged and (
+        result.matched_count > 0 or result.upserted_id is not None
+    )
+
+
+async def areplace_one(
+    obj: MongoclassInstance, /, upsert: bool = False
+) -> UpdateResult:
+    rec = _Recorder(type(obj), "areplace_one") if _listeners else None
+    document = to_document(obj)
+    if rec is not None:
+        rec.converted(document)
+    collection = cast("AsyncIOMotorCollection[Any]", get_collection(obj))
+    try:
+        result = await collection.replace_one(
+            filter={"_id": get_id(obj)}, replacement=document, upsert=upsert
+        )
+    except BaseException:
+        _invalidate(obj)
+        raise
+    if rec is not None:
+        rec.received()
+        rec.publish()
+    assert isinstance(result, UpdateResult)
+    _invalidate(obj, document if _replaced(result) else None)
+    _take_snapshot(obj, document)
+    return result
+
+
+areplace_one.__doc__ = replace_one.__doc__
+
+
+def save(obj: MongoclassInstance, /) -> Optional[UpdateResult]:
+    """
+    Saves the changes made to the object since it was loaded or last written.
+
+    Only the fields that changed are sent, as a `$set`/`$unset` update. If the
+    object was never loaded or written it is upserted with `replace_one`.
+    The class must be a mongoclass with `track_changes=True`.
+
+    Parameters:
+        obj: A mongoclass instance.
+
+    Raises:
+        DeveloperError: If the class does not track changes.
+
+    Returns:
+        A pymongo `UpdateResult` object or None if nothing changed.
+    """
+    rec = _Recorder(type(obj), "save") if _listeners else None
+    filter, update, data = _prepare_save(obj)
+    if not update:
+        return None
+    if rec is not None:
+        rec.converted(update)
+
+    collection = cast("Collection[Any]", get_collection(obj))
+    try:
+        if "_id" in update:
+            result = collection.replace_one(filter, update, upsert=True)
+        else:
+            result = collection.update_one(filter, update)
+    except BaseException:
+        _invalidate(obj)
+        raise
+    if rec is not None:
+        rec.received()
+        rec.publish()
+    _invalidate(obj, update if "_id" in update and _replaced(result) else None)
+    object.__setattr__(obj, _SNAPSHOT_ATTR, data)
+    return result
+
+
+async def asave(obj: MongoclassInstance, /) -> Optional[UpdateResult]:
+    rec = _Recorder(type(obj), "asave") if _listeners else None
+    filter, update, data = _prepare_save(obj)
+    if not update:
+        return None
+    if rec is not None:
+        rec.converted(update)
+
+    collection = cast("AsyncIOMotorCollection[Any]", get_collection(obj))
+    try:
+        if "_id" in update:
+            result = await collection.replace_one(filter, update, upsert=True)
+        else:
+            result = await collection.update_one(filter, update)
+    except BaseException:
+        _invalidate(obj)
+        raise
+    if rec is not None:
+        rec.received()
+        rec.publish()
+    assert isinstance(result, UpdateResult)
+    _invalidate(obj, update if "_id" in update and _replaced(result) else None)
+    object.__setattr__(obj, _SNAPSHOT_ATTR, data)
+    return result
+
+
+asave.__doc__ = save.__doc__
+
+
+def delete_one(obj: MongoclassInstance, /) -> DeleteResult:
+    """
+    Deletes the object from the database.
+
+    Parameters:
+        obj: A mongoclass instance.
+
+    Returns:
+        A pymongo `DeleteResult` object.
+    """
+    collection = cast("Collection[Any]", get_collection(obj))
+    rec = _Recorder(type(obj), "delete_one") if _listeners else None
+    try:
+        result = collection.delete_one({"_id": get_id(obj)})
+    finally:
+        _invalidate(obj)
+    if rec is not None:
+        rec.received()
+        rec.publish()
+    return result
+
+
+async def adelete_one(obj: MongoclassInstance, /) -> DeleteResult:
+    collection = cast("AsyncIOMotorCollection[Any]", get_collection(obj))
+    rec = _Recorder(type(obj), "adelete_one") if _listeners else None
+    try:
+        result = await collection.delete_one({"_id": get_id(obj)})
+    finally:
+        _invalidate(obj)
+    assert isinstance(result, DeleteResult)
+    if rec is not None:
+        rec.received()
+        rec.publish()
+    return result
+
+
+adelete_one.__doc__ = delete_one.__doc__
+
+
+@dataclass(frozen=True)
+class ReplaceOp:
+    """
+    A `bulk_save` operation that replaces the object in the database.
+    """
+
+    obj: MongoclassInstance
+    upsert: bool = False
+
+
+@dataclass(frozen=True)
+class UpdateOp:
+    """
+    A `bulk_save` operation that applies an update document to the object.
+    """
+
+    obj: MongoclassInstance
+    update: Dict[str, Any]
+    upsert: bool = False
+
+
+@dataclass(frozen=True)
+class DeleteOp:
+    """
+    A `bulk_save` operation that deletes the object from the database.
+    """
+
+    obj: MongoclassInstance
+
+
+BulkOp = Union[ReplaceOp, UpdateOp, DeleteOp]
+
+
+class _BulkSave:
+    """
+    Groups `bulk_save` operations per collection and merges their results.
+    """
+
+    def __init__(self, ops: Iterable[BulkOp], ordered: bool) -> None:
+        self.ordered = ordered
+        self.groups: List[Tuple[Any, List[int], List[Any]]] = []
+        self.replaced: List[Tuple[MongoclassInstance, Mapping[str, Any]]] = []
+        self.objs: List[MongoclassInstance] = []
+        for index, op in enumerate(ops):
+            self.objs.append(op.obj)
+            indexes, requests = self._group(get_collection(op.obj))
+            indexes.append(index)
+            filter = {"_id": get_id(op.obj)}
+            if isinstance(op, ReplaceOp):
+                document = to_document(op.obj)
+                requests.append(ReplaceOne(filter, document, upsert=op.upsert))
+                self.replaced.append((op.obj, document))
+            elif isinstance(op, UpdateOp):
+                requests.append(UpdateOne(filter, op.update, upsert=op.upsert))
+            elif isinstance(op, DeleteOp):
+                requests.append(DeleteOne(filter))
+            else:
+                raise TypeError(f"Unsupported bulk operation: {op!r}")
+
+        self.acknowledged = True
+        self.details: Dict[str, Any] = {
+            "writeErrors": [],
+            "writeConcernErrors": [],
+            "nInserted": 0,
+            "nUpserted": 0,
+            "nMatched": 0,
+            "nModified": 0,
+            "nRemoved": 0,
+            "upserted": [],
+        }
+
+    def _group(self, collection: Any) -> Tuple[List[int], List[Any]]:
+        # Collections compare equal whatever their options, but a bulk_write
+        # encodes and writes with the options of its collection.
+        for other, indexes, requests in self.groups:
+            if (
+                other == collection
+                and other.codec_options == collection.codec_options
+                and getattr(other, "write_concern", None)
+                == getattr(collection, "write_concern", None)
+            ):
+                return indexes, requests
+        group: Tuple[Any, List[int], List[Any]] = (collection, [], [])
+        self.groups.append(group)
+        return group[1], group[2]
+
+    @property
+    def stopped(self) -> bool:
+        return self.ordered and bool(self.details["writeErrors"])
+
+    def merge(self, indexes: List[int], details: Mapping[str, Any]) -> None:
+        for key in ("nInserted", "nUpserted", "nMatched", "nModified", "nRemoved"):
+            self.details[key] += details.get(key, 0)
+        for upsert in details.get("upserted", []):
+            self.details["upserted"].append({**upsert, "index": indexes[upsert["index"]]})
+        for error in details.get("writeErrors", []):
+            self.details["writeErrors"].append({**error, "index": indexes[error["index"]]})
+        self.details["writeConcernErrors"].extend(details.get("writeConcernErrors", []))
+
+    def invalidate(self) -> None:
+        for obj in self.objs:
+            _invalidate(obj)
+
+    def result(self) -> BulkWriteResult:
+        if self.details["writeErrors"] or self.details["writeConcernErrors"]:
+            self.details["writeErrors"].sort(key=lambda error: error["index"])
+            raise BulkWriteError(self.details)
+        self.details["upserted"].sort(key=lambda upsert: upsert["index"])
+        for obj, document in self.replaced:
+            _take_snapshot(obj, document)
+        return BulkWriteResult(self.details, self.acknowledged)
+
+
+def bulk_save(ops: Iterable[BulkOp], /, ordered: bool = True) -> BulkWriteResult:
+    """
+    Performs replace, update and delete operations on mongoclass instances
+    with one `bulk_write` call per collection. Collections with different
+    codec options or write concerns are written separately.
+
+    Operations on the same collection keep their relative order. If `ordered`
+    is True, collections after the first failing one are not written.
+
+    Parameters:
+        ops: A list of `ReplaceOp`, `UpdateOp` and `DeleteOp` objects.
+        ordered: If True, stop at the first failed operation.
+
+    Raises:
+        BulkWriteError: If any operation failed. Error and upsert indexes refer
+            to positions in `ops`.
+
+    Returns:
+        A pymongo `BulkWriteResult` object merged across all collections.
+    """
+    bulk = _BulkSave(ops, ordered)
+    try:
+        for collection, indexes, requests in bulk.groups:
+            try:
+                result = collection.bulk_write(requests, ordered=ordered)
+            except BulkWriteError as exc:
+                bulk.merge(indexes, exc.details)
+                if bulk.stopped:
+                    break
+            else:
+                bulk.acknowledged = bulk.acknowledged and result.acknowledged
+                if result.acknowledged:
+                    bulk.merge(indexes, result.bulk_api_result)
+    finally:
+        bulk.invalidate()
+    return bulk.result()
+
+
+async def abulk_save(
+    ops: Iterable[BulkOp], /, ordered: bool = True
+) -> BulkWriteResult:
+    bulk = _BulkSave(ops, ordered)
+    try:
+        for collection, indexes, requests in bulk.groups:
+            try:
+                result = await collection.bulk_write(requests, ordered=ordered)
+            except BulkWriteError as exc:
+                bulk.merge(indexes, exc.details)
+                if bulk.stopped:
+                    break
+            else:
+                bulk.acknowledged = bulk.acknowledged and result.acknowledged
+                if result.acknowledged:
+                    bulk.merge(indexes, result.bulk_api_result)
+    finally:
+        bulk.invalidate()
+    return bulk.result()
+
+
+abulk_save.__doc__ = bulk_save.__doc__
+
+
+# The update operators merged by `WriteBuffer`.
+_MERGED_OPERATORS = ("$set", "$inc")
+
+
+def _paths_overlap(a: str, b: str) -> bool:
+    return a == b or a.startswith(b + ".") or b.startswith(a + ".")
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _merge_updates(
+    first: Mapping[str, Any], second: Mapping[str, Any]
+) -> Optional[Dict[str, Dict[str, Any]]]:
+    """
+    Returns an update equivalent to `first` followed by `second`, or None if
+    they cannot be merged.
+
+    Only `$set` and `$inc` are merged. A path may not be changed by both, or
+    overlap another path, since the server rejects such updates.
+    """
+    operators = {*first, *second}
+    if not operators.issubset(_MERGED_OPERATORS):
+        return None
+    merged = {op: dict(first.get(op, {})) for op in operators}
+    for op, changes in second.items():
+        for path, value in changes.items():
+            for other_op, other_changes in merged.items():
+                for other_path in other_changes:
+                    if _paths_overlap(path, other_path) and (
+                        other_op != op or other_path != path
+                    ):
+                        return None
+            if op == "$inc" and path in merged[op]:
+                if not (_is_number(value) and _is_number(merged[op][path])):
+                    return None
+                merged[op][path] += value
+            else:
+                merged[op][path] = value
+    return merged
+
+
+class _BufferedWrite:
+    """
+    An insert or an update queued by a `WriteBuffer`, with the futures of
+    the callers whose operations it includes.
+    """
+
+    __slots__ = ("id", "document", "update", "objs", "futures")
+
+    def __init__(
+        self,
+        id: Any,
+        obj: MongoclassInstance,
+        future: "asyncio.Future[Any]",
+        document: Optional[Dict[str, Any]] = None,
+        update: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        self.id = id
+        self.document = document
+        self.update = update
+        self.objs = [obj]
+        self.futures = [future]
+
+    def request(self) -> Union["InsertOne[Dict[str, Any]]", UpdateOne]:
+        if self.document is not None:
+            return InsertOne(self.document)
+        assert self.update is not None
+        return UpdateOne({"_id": self.id}, self.update)
+
+
+def _write_error(error: Mapping[str, Any]) -> WriteError:
+    if error.get("code") == 11000:
+        return DuplicateKeyError(error.get("errmsg", ""), 11000, error)
+    return WriteError(error.get("errmsg", ""), error.get("code"), error)
+
+
+class WriteBuffer:
+    """
+    Queues the inserts and updates of the instances of a mongoclass and
+    writes them with `bulk_write`, to reduce the round trips of many small
+    writes.
+
+    The queued operations are written when `max_size` of them are queued or
+    `window` seconds after the first one, one batch at a time and in the
+    order they were made. Repeated `$set` and `$inc` updates of the same
+    `_id` are merged into one. When `max_pending` operations are queued or
+    being written, further calls wait for them.
+
+    Each call returns its own result or raises its own error once its batch
+    is written. The `matched_count` of merged updates is shared, and the
+    `modified_count` of an update is only exact if all or none of the updates
+    in its batch modified their document.
+
+    A buffer belongs to one event loop. Call `close`, or use it as an async
+    context manager, to write the remaining operations on shutdown.
+
+    Parameters:
+        cls: A mongoclass type with an asynchronous collection.
+        max_size: The number of queued operations that are written at once.
+        window: The seconds an operation waits for others to be queued.
+        max_pending: The maximum number of operations queued or being
+            written.
+
+    Raises:
+        DeveloperError: If a limit is not positive.
+    """
+
+    def __init__(
+        self,
+        cls: Type[MongoclassInstance],
+        /,
+        max_size: int = 1000,
+        window: float = 0.01,
+        max_pending: int = 10_000,
+    ) -> None:
+        if max_size < 1 or max_pending < 1 or window < 0:
+            raise DeveloperError("The limits of a write buffer must be positive.")
+        self.cls = cls
+        self.max_size = max_size
+        self.window = window
+        self.max_pending = max_pending
+        self._queue: List[_BufferedWrite] = []
+        # The queued update of each `_id` that later updates are merged into.
+        self._updates: Dict[Hashable, _BufferedWrite] = {}
+        self._batches: Deque[List[_BufferedWrite]] = deque()
+        # The batch being written, which is no longer in `_batches`.
+        self._writing: List[_BufferedWrite] = []
+        self._handle: Optional[asyncio.Handle] = None
+        self._writer: Optional["asyncio.Task[None]"] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._closed = False
+
+    async def insert_one(self, obj: MongoclassInstance, /) -> InsertOneResult:
+        """
+        Queues the insert of an object, see `ainsert_one`.
+        """
+        self._check(obj)
+        document = to_document(obj)
+        future = await self._reserve()
+        # Updates queued earlier must not be merged past the insert.
+        self._updates.pop(id_key(document["_id"]), None)
+        self._enqueue(_BufferedWrite(document["_id"], obj, future, document=document))
+        result: InsertOneResult = await future
+        return result
+
+    async def update_one(
+        self, obj: MongoclassInstance, update: Dict[str, Any], /
+    ) -> UpdateResult:
+        """
+        Queues an update of an object, see `aupdate_one`.
+        """
+        self._check(obj)
+        id = get_id(obj)
+        key = id_key(id)
+        future = await self._reserve()
+        queued = self._updates.get(key)
+        merged = None
+        if queued is not None:
+            assert queued.update is not None
+            merged = _merge_updates(queued.update, update)
+        if queued is not None and merged is not None:
+            queued.update = merged
+            queued.objs.append(obj)
+            queued.futures.append(future)
+        else:
+            write = _BufferedWrite(id, obj, future, update=dict(update))
+            self._updates[key] = write
+            self._enqueue(write)
+        result: UpdateResult = await future
+        return result
+
+    async def flush(self) -> None:
+        """
+        Writes the queued operations and waits until they are written.
+        """
+        futures = [
+            future
+            for batch in (self._writing, *self._batches, self._queue)
+            for write in batch
+            for future in write.futures
+        ]
+        self._dispatch()
+        if futures:
+            await asyncio.wait(futures)
+
+    async def close(self) -> None:
+        """
+        Writes the queued operations. Later operations raise a
+        `DeveloperError`.
+        """
+        self._closed = True
+        await self.flush()
+
+    async def __aenter__(self) -> "WriteBuffer":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.close()
+
+    def _check(self, obj: MongoclassInstance) -> None:
+        if self._closed:
+            raise DeveloperError("The write buffer is closed.")
+        if type(obj) is not self.cls:
+            raise TypeError(f"Object must be an instance of {self.cls.__qualname__}.")
+        if not _is_async(get_collection(self.cls)):
+            raise TypeError("WriteBuffer requires an asynchronous collection.")
+
+    async def _reserve(self) -> "asyncio.Future[Any]":
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        await self._slots.acquire()
+        return asyncio.get_running_loop().create_future()
+
+    def _enqueue(self, write: _BufferedWrite) -> None:
+        self._queue.append(write)
+        if len(self._queue) >= self.max_size:
+            self._dispatch()
+        elif self._handle is None:
+            loop = asyncio.get_running_loop()
+            self._handle = loop.call_later(self.window, self._dispatch)
+
+    def _dispatch(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if self._queue:
+            self._batches.append(self._queue)
+            self._queue = []
+            self._updates = {}
+        if self._batches and self._writer is None:
+            loop = asyncio.get_running_loop()
+            self._writer = loop.create_task(self._write_batches())
+
+    async def _write_batches(self) -> None:
+        try:
+            while self._batches:
+                self._writing = self._batches.popleft()
+                await self._write(self._writing)
+        except BaseException:
+            while self._batches:
+                for write in self._batches.popleft():
+                    self._settle(write, None)
+            raise
+        finally:
+            self._writing = []
+            self._writer = None
+
+    async def _write(self, batch: List[_BufferedWrite]) -> None:
+        collection = cast("AsyncIOMotorCollection[Any]", get_collection(self.cls))
+        rec = _Recorder(self.cls, "write_buffer") if _listeners else None
+        start = 0
+        # Written in order, and resumed after the operation that failed.
+        while start < len(batch):
+            writes = batch[start:]
+            error = None
+            try:
+                result = await collection.bulk_write(
+                    [write.request() for write in writes], ordered=True
+                )
+            except BulkWriteError as exc:
+                details = exc.details
+                if details["writeErrors"]:
+                    error = details["writeErrors"][0]
+            except Exception as exc:
+                for write in writes:
+                    self._settle(write, exc)
+                return
+            except BaseException:
+                for write in writes:
+                    self._settle(write, None)
+                raise
+            else:
+                if not result.acknowledged:
+                    for write in writes:
+                        self._settle_unacknowledged(write)
+                    break
+                details = result.bulk_api_result
+
+            written = writes if error is None else writes[: error["index"]]
+            concern_errors = details.get("writeConcernErrors")
+            if concern_errors:
+                concern = concern_errors[0]
+                concern_error = WriteConcernError(
+                    concern.get("errmsg", ""), concern.get("code"), concern
+                )
+                for write in written:
+                    self._settle(write, concern_error)
+            else:
+                await self._settle_written(collection, written, details)
+            if error is None:
+                break
+            self._settle(writes[error["index"]], _write_error(error))
+            start += error["index"] + 1
+
+        if rec is not None:
+            rec.received()
+            rec.publish()
+
+    async def _settle_written(
+        self,
+        collection: Any,
+        writes: List[_BufferedWrite],
+        details: Mapping[str, Any],
+    ) -> None:
+        updates = [write for write in writes if write.update is not None]
+        matched = {id_key(write.id) for write in updates}
+        if details.get("nMatched", 0) < len(updates):
+            # Finds the updates that matched a document.
+            cursor = collection.find(
+                {"_id": {"$in": [write.id for write in updates]}}, {"_id": 1}
+            )
+            found = await cursor.to_list(None)
+            matched = {id_key(document["_id"]) for document in found}
+        modified = details.get("nModified", 0) > 0
+
+        for write in writes:
+            if write.document is not None:
+                for obj in write.objs:
+                    set_id(obj, write.id)
+                    _take_snapshot(obj, write.document)
+                self._settle(write, InsertOneResult(write.id, True))
+                continue
+            n = int(id_key(write.id) in matched)
+            for obj in write.objs:
+                _invalidate(obj)
+            self._settle(
+                write, UpdateResult({"n": n, "nModified": n if modified else 0}, True)
+            )
+
+    def _settle_unacknowledged(self, write: _BufferedWrite) -> None:
+        if write.document is not None:
+            self._settle(write, InsertOneResult(write.id, False))
+        else:
+            for obj in write.objs:
+                _invalidate(obj)
+            self._settle(write, UpdateResult({}, False))
+
+    def _settle(self, write: _BufferedWrite, outcome: Any) -> None:
+        """
+        Resolves the futures of a write with a result or an exception, or
+        cancels them if the outcome is None.
+        """
+        assert self._slots is not None
+        for future in write.futures:
+            if not future.done():
+                if outcome is None:
+                    future.cancel()
+                elif isinstance(outcome, BaseException):
+                    future.set_exception(outcome)
+                else:
+                    # Callers must not share results.
+                    future.set_result(copy.copy(outcome))
+            self._slots.release()
+        if write.update is not None and isinstance(outcome, BaseException):
+            for obj in write.objs:
+                _invalidate(obj)
+
+
+def find_one(
+    cls: Type[T],
+    /,
+    filter: Optional[Dict[str, Any]] = None,
+    only: Optional[Iterable[str]] = None,
+    exclude: Optional[Iterable[str]] = None,
+    trusted: bool = False,
+) -> Optional[T]:
+    """
+    Return a single instance that matches the query or None.
+
+    Only the fields declared by the class are fetched, deferred fields are
+    left out. Fields that were not fetched are loaded on first access.
+
+    If the class has a cache, lookups by `_id` alone are served from it. If
+    the class has a `batch_window`, concurrent `afind_one` lookups by `_id`
+    alone are sent as a single query.
+
+    Parameters:
+        cls: A mongoclass type.
+        filter: A dictionary specifying the query to be performed.
+        only: The names of the fields to fetch.
+        exclude: The names of the fields not to fetch.
+        trusted: If True, the document is structured without validation,
+            see `from_document`.
+
+    Returns:
+        A mongoclass instance or None.
+    """
+    rec = _Recorder(cls, "find_one") if _listeners else None
+    projection, loaded = _get_projection(cls, only, exclude)
+    config = cls.__mongoclass_config__
+    cache = config.cache
+    id = _get_lookup_id(filter, loaded)
+    key = None if cache is None or id is MISSING else id_key(id)
+    if cache is not None and key is not None:
+        data, version = cache.get(key)
+        if data is not None:
+            cached = _decode_cached(config, data)
+            obj = _structure(cls, cached, loaded, trusted)
+            if rec is not None:
+                rec.converted(cached)
+                rec.publish()
+            return obj
+
+    collection = cast("Collection[Any]", config.read_collection)
+    if _plan_guard is not None:
+        cursor = collection.find(filter=filter, limit=1)
+        _check_plan(cls, "find_one", filter, None, cursor.explain())
+    document = collection.find_one(filter=filter, projection=projection)
+    if rec is not None:
+        rec.received(document)
+    if document is None:
+        if rec is not None:
+            rec.publish()
+        return None
+    if cache is not None and key is not None:
+        cache.set(key, _encode_cached(config, document), version)
+    obj = _structure(cls, document, loaded, trusted)
+    if rec is not None:
+        rec.converted()
+        rec.publish()
+    return obj
+
+
+async def afind_one(
+    cls: Type[T],
+    /,
+    filter: Optional[Dict[str, Any]] = None,
+    only: Optional[Iterable[str]] = None,
+    exclude: Optional[Iterable[str]] = None,
+    trusted: bool = False,
+) -> Optional[T]:
+    rec = _Recorder(cls, "afind_one") if _listeners else None
+    projection, loaded = _get_projection(cls, only, exclude)
+    config = cls.__mongoclass_config__
+    cache = config.cache
+    id = _get_lookup_id(filter, loaded)
+    key = None if cache is None or id is MISSING else id_key(id)
+    if cache is not None and key is not None:
+        data, version = cache.get(key)
+        if data is not None:
+            cached = _decode_cached(config, data)
+            obj = _structure(cls, cached, loaded, trusted)
+            if rec is not None:
+                rec.converted(cached)
+                rec.publish()
+            return obj
+
+    if id is not MISSING and config.batch_window is not None:
+        document = await _get_loader(cls).load(id)
+    else:
+        collection = cast("AsyncIOMotorCollection[Any]", config.read_collection)
+        if _plan_guard is not None:
+            cursor = collection.find(filter=filter, limit=1)
+            _check_plan(cls, "afind_one", filter, None, await cursor.explain())
+        document = await collection.find_one(filter=filter, projection=projection)
+    if rec is not None:
+        rec.received(document)
+    if document is None:
+        if rec is not None:
+            rec.publish()
+        return None
+    if cache is not None and key is not None:
+        cache.set(key, _encode_cached(config, document), version)
+    obj = _structure(cls, document, loaded, trusted)
+    if rec is not None:
+        rec.converted()
+        rec.publish()
+    return obj
+
+
+afind_one.__doc__ = find_one.__doc__
+
+
+# The batch loaders of each event loop, by class.
+_loaders: "weakref.WeakKeyDictionary[Any, weakref.WeakKeyDictionary[Any, BatchLoader]]"
+_loaders = weakref.WeakKeyDictionary()
+
+
+def _get_loader(cls: Type[MongoclassInstance]) -> BatchLoader:
+    loop = asyncio.get_running_loop()
+    loaders = _loaders.setdefault(loop, weakref.WeakKeyDictionary())
+    loader = loaders.get(cls)
+    if loader is None:
+        config = cls.__mongoclass_config__
+        assert config.batch_window is not None
+        collection = cast("AsyncIOMotorCollection[Any]", config.read_collection)
+        projection = config.projection
+
+        def fetch(ids: List[Any]) -> Awaitable[List[Any]]:
+            cursor = collection.find({"_id": {"$in": ids}}, projection)
+            return cursor.to_list(None)
+
+        loader = loaders[cls] = BatchLoader(fetch, config.batch_window)
+    return loader
+
+
+def _match_ids(
+    cls: Type[T],
+    ids: List[Any],
+    documents: Iterable[Mapping[str, Any]],
+    loaded: Optional[FrozenSet[str]],
+    trusted: bool,
+) -> List[Optional[T]]:
+    return [
+        None if document is None else _structure(cls, document, loaded, trusted)
+        for document in match_ids(ids, documents)
+    ]
+
+
+def find_by_ids(
+    cls: Type[T],
+    ids: Iterable[Any],
+    /,
+    only: Optional[Iterable[str]] = None,
+    exclude: Optional[Iterable[str]] = None,
+    trusted: bool = False,
+) -> List[Optional[T]]:
+    """
+    Returns the instances with the given ids using a single `$in` query.
+
+    Parameters:
+        cls: A mongoclass type.
+        ids: The ids of the instances.
+        only: The names of the fields to fetch.
+        exclude: The names of the fields not to fetch.
+        trusted: If True, the documents are structured without validation,
+            see `from_document`.
+
+    Returns:
+        A list with the instance of each id, in the order of `ids`, and None
+        for the ids that were not found.
+    """
+    ids = list(ids)
+    projection, loaded = _get_projection(cls, only, exclude)
+    collection = cast("Collection[Any]", cls.__mongoclass_config__.read_collection)
+    rec = _Recorder(cls, "find_by_ids") if _listeners else None
+    documents = list(collection.find({"_id": {"$in": unique_ids(ids)}}, projection))
+    if rec is not None:
+        rec.received(*documents)
+    objs = _match_ids(cls, ids, documents, loaded, trusted)
+    if rec is not None:
+        rec.converted()
+        rec.publish()
+    return objs
+
+
+async def afind_by_ids(
+    cls: Type[T],
+    ids: Iterable[Any],
+    /,
+    only: Optional[Iterable[str]] = None,
+    exclude: Optional[Iterable[str]] = None,
+    trusted: bool = False,
+) -> List[Optional[T]]:
+    ids = list(ids)
+    projection, loaded = _get_projection(cls, only, exclude)
+    config = cls.__mongoclass_config__
+    collection = cast("AsyncIOMotorCollection[Any]", config.read_collection)
+    rec = _Recorder(cls, "afind_by_ids") if _listeners else None
+    cursor = collection.find({"_id": {"$in": unique_ids(ids)}}, projection)
+    documents = await cursor.to_list(None)
+    if rec is not None:
+        rec.received(*documents)
+    objs = _match_ids(cls, ids, documents, loaded, trusted)
+    if rec is not None:
+        rec.converted()
+        rec.publish()
+    return objs
+
+
+afind_by_ids.__doc__ = find_by_ids.__doc__
+
+
+# The fields that were requested by `find`, set on the cursors since Motor
+# cursors cannot be hashed.
+_CURSOR_FIELDS_ATTR = "__mongoclass_fields__"
+
+
+def _cursor_fields(cursor: Any) -> Optional[FrozenSet[str]]:
+    return getattr(cursor, _CURSOR_FIELDS_ATTR, None)
+
+
+def find(
+    cls: Type[MongoclassInstance],
+    /,
+    filter: Optional[Dict[str, Any]] = None,
+    skip: int = 0,
+    limit: int = 0,
+    sort: Optional[List[Tuple[str, Literal[-1, 1]]]] = None,
+    only: Optional[Iterable[str]] = None,
+    exclude: Optional[Iterable[str]] = None,
+    lazy: bool = False,
+) -> Union[Cursor, AsyncIOMotorCursor]:
+    """
+    Performs a query on the collection associated with the mongoclass.
+
+    Only the fields declared by the class are fetched, deferred fields are
+    left out. Fields that were not fetched are loaded on first access of the
+    objects returned by `iter_objects`.
+
+    Parameters:
+        cls: A mongoclass.
+        filter: A query document that selects which documents to include in the result set.
+        skip: The number of documents to omit from the start of the result set.
+        limit: The maximum number of results to return.
+        sort: A list of (key, direction) pairs.
+        only: The names of the fields to fetch.
+        exclude: The names of the fields not to fetch.
+        lazy: If True, the cursor returns `RawBSONDocument` objects and
+            `iter_objects` only decodes sub-documents and arrays when their
+            field is first accessed. Instances of classes that track changes
+            keep the raw documents as their snapshots.
+
+    Returns:
+        A MongoDB cursor.
+    """
+    projection, loaded = _get_projection(cls, only, exclude)
+    collection = get_collection(cls)
+    if lazy:
+        collection = collection.with_options(
+            codec_options=collection.codec_options.with_options(
+                document_class=RawBSONDocument
+            )
+        )
+    cursor = collection.find(
+        filter=filter, projection=projection, skip=skip, limit=limit, sort=sort
+    )
+    if loaded is not None:
+        setattr(cursor, _CURSOR_FIELDS_ATTR, loaded)
+    if _plan_guard is not None:
+        if _is_async(collection):
+            # Checked by aiter_objects and aiter_batches, which can await.
+            setattr(cursor, _GUARDED_QUERY_ATTR, (cls, filter, sort))
+        else:
+            explanation = cast("Cursor[Any]", cursor).explain()
+            _check_plan(cls, "find", filter, sort, explanation)
+    return cursor
+
+
+# The plan guard mode, see `set_plan_guard`.
+_plan_guard: Optional[str] = None
+
+# The query of each Motor cursor returned by `find` while the guard is on,
+# set on the cursors like their fields.
+_GUARDED_QUERY_ATTR = "__mongoclass_query__"
+
+
+def set_plan_guard(mode: Optional[Literal["warn", "raise"]], /) -> None:
+    """
+    Checks the plan of the queries made by `find` and `find_one` and their
+    async versions, for use in development and tests.
+
+    Each query is explained first, which costs a round trip. If its plan
+    scans the whole collection or sorts in memory, a `QueryPlanWarning` is
+    issued or a `QueryPlanError` is raised that names the index to declare.
+    The queries of Motor cursors are checked when `aiter_objects` or
+    `aiter_batches` starts iterating them.
+
+    Parameters:
+        mode: `"warn"`, `"raise"` or None to turn the guard off.
+
+    Raises:
+        DeveloperError: If the mode is not valid.
+    """
+    global _plan_guard
+    if mode not in ("warn", "raise", None):
+        raise DeveloperError(f"Invalid plan guard mode {mode!r}.")
+    _plan_guard = mode
+
+
+def _describe_plan(
+    cls: Type[MongoclassInstance],
+    filter: Optional[Mapping[str, Any]],
+    sort: Optional[Any],
+    explanation: Mapping[str, Any],
+) -> "QueryPlan":
+    from ._plans import Suggester, parse_plan
+
+    config = cls.__mongoclass_config__
+    suggester = Suggester(
+        cls.__name__,
+        config.collection.name,
+        {db_field: name for name, db_field in config.db_fields.items()},
+        [
+            (index.document["name"], list(index.document["key"].items()))
+            for index in config.indexes
+        ],
+        filter,
+        sort,
+    )
+    return parse_plan(explanation, suggester)
+
+
+def _check_plan(
+    cls: Type[MongoclassInstance],
+    operation: str,
+    filter: Optional[Mapping[str, Any]],
+    sort: Optional[Any],
+    explanation: Mapping[str, Any],
+) -> None:
+    plan = _describe_plan(cls, filter, sort, explanation)
+    if plan.ok:
+        return
+    message = f"{operation}({cls.__name__}, {filter!r}): {plan.suggestion}"
+    if _plan_guard == "raise":
+        raise QueryPlanError(message, plan)
+    warnings.warn(message, QueryPlanWarning, stacklevel=3)
+
+
+async def _acheck_cursor(cursor: Any) -> None:
+    query = getattr(cursor, _GUARDED_QUERY_ATTR, None)
+    if query is None:
+        return
+    delattr(cursor, _GUARDED_QUERY_ATTR)
+    if _plan_guard is not None:
+        cls, filter, sort = query
+        _check_plan(cls, "find", filter, sort, await cursor.explain())
+
+
+def explain(
+    cls: Type[MongoclassInstance],
+    /,
+    filter: Optional[Dict[str, Any]] = None,
+    skip: int = 0,
+    limit: int = 0,
+    sort: Optional[List[Tuple[str, Literal[-1, 1]]]] = None,
+) -> "QueryPlan":
+    """
+    Returns the plan the server chooses for a query made by `find`, or by
+    `find_one` with `limit=1`.
+
+    If the plan scans the whole collection or sorts in memory, its
+    `suggestion` names the index to declare, or the declared index that
+    does not exist yet.
+
+    Parameters:
+        cls: A mongoclass type.
+        filter: A dictionary specifying the query to be performed.
+        skip: The number of documents to omit from the start of the result set.
+        limit: The maximum number of results to return.
+        sort: A list of (key, direction) pairs.
+
+    Returns:
+        A `QueryPlan` object.
+    """
+    collection = cast("Collection[Any]", get_collection(cls))
+    if _is_async(collection):
+        raise TypeError("Use aexplain() with asynchronous collections.")
+    cursor = collection.find(filter=filter, skip=skip, limit=limit, sort=sort)
+    return _describe_plan(cls, filter, sort, cursor.explain())
+
+
+async def aexplain(
+    cls: Type[MongoclassInstance],
+    /,
+    filter: Optional[Dict[str, Any]] = None,
+    skip: int = 0,
+    limit: int = 0,
+    sort: Optional[List[Tuple[str, Literal[-1, 1]]]] = None,
+) -> "QueryPlan":
+    collection = get_collection(cls)
+    cursor = collection.find(filter=filter, skip=skip, limit=limit, sort=sort)
+    return _describe_plan(cls, filter, sort, await cursor.explain())
+
+
+aexplain.__doc__ = explain.__doc__
+
+
+def iter_objects(
+    cls: Type[T], cursor: "Cursor[Any]", trusted: bool = False
+) -> Iterable[T]:
+    loaded = _cursor_fields(cursor)
+    if _listeners:
+        yield from _iter_recorded(cls, cursor, loaded, trusted)
+        return
+    for document in cursor:
+        yield _structure(cls, document, loaded, trusted)
+
+
+def _iter_recorded(
+    cls: Type[T], cursor: "Cursor[Any]", loaded: Optional[FrozenSet[str]], trusted: bool
+) -> Iterator[T]:
+    rec = _Recorder(cls, "iter_objects")
+    try:
+        for document in cursor:
+            rec.received(document)
+            obj = _structure(cls, document, loaded, trusted)
+            rec.converted()
+            yield obj
+            rec.resume()
+    finally:
+        rec.publish()
+
+
+async def aiter_objects(
+    cls: Type[T],
+    cursor: "AsyncIOMotorCursor[Any]",
+    trusted: bool = False,
+    batch_size: Optional[int] = None,
+    prefetch: int = 1,
+    executor: Optional[Executor] = None,
+) -> AsyncIterator[T]:
+    """
+    Yields the instances of the documents returned by a Motor cursor.
+
+    Parameters:
+        cls: A mongoclass type.
+        cursor: A Motor cursor returned by `find`.
+        trusted: If True, the documents are structured without validation,
+            see `from_document`.
+        batch_size: If set, the documents are read and structured in batches
+            of this size, see `aiter_batches`.
+        prefetch: The number of batches read ahead of the one being consumed.
+        executor: An executor, such as a `ThreadPoolExecutor`, in which the
+            batches are structured instead of on the event loop.
+
+    Returns:
+        An asynchronous iterator of mongoclass instances.
+    """
+    if batch_size is None:
+        if _plan_guard is not None:
+            await _acheck_cursor(cursor)
+        loaded = _cursor_fields(cursor)
+        rec = _Recorder(cls, "aiter_objects") if _listeners else None
+        if rec is None:
+            async for document in cursor:
+                yield _structure(cls, document, loaded, trusted)
+            return
+        try:
+            async for document in cursor:
+                rec.received(document)
+                obj = _structure(cls, document, loaded, trusted)
+                rec.converted()
+                yield obj
+                rec.resume()
+        finally:
+            rec.publish()
+        return
+
+    batches = aiter_batches(
+        cls,
+        cursor,
+        batch_size=batch_size,
+        prefetch=prefetch,
+        executor=executor,
+        trusted=trusted,
+    )
+    async for objs in batches:
+        for obj in objs:
+            yield obj
+
+
+def _structure_batch(
+    cls: Type[T],
+    documents: List[Mapping[str, Any]],
+    loaded: Optional[FrozenSet[str]],
+    trusted: bool,
+) -> List[T]:
+    return [_structure(cls, document, loaded, trusted) for document in documents]
+
+
+async def aiter_batches(
+    cls: Type[T],
+    cursor: "AsyncIOMotorCursor[Any]",
+    /,
+    batch_size: int = 100,
+    prefetch: int = 1,
+    executor: Optional[Executor] = None,
+    trusted: bool = False,
+) -> AsyncIterator[List[T]]:
+    """
+    Yields the instances of the documents returned by a Motor cursor in lists.
+
+    The next batches are read from the cursor while the current one is being
+    consumed. If an executor is given, each batch is structured in it so that
+    large documents do not block the event loop.
+
+    Parameters:
+        cls: A mongoclass type.
+        cursor: A Motor cursor returned by `find`.
+        batch_size: The maximum number of instances in a list.
+        prefetch: The number of batches read ahead of the one being consumed.
+        executor: An executor, such as a `ThreadPoolExecutor`, in which the
+            batches are structured instead of on the event loop.
+        trusted: If True, the documents are structured without validation,
+            see `from_document`.
+
+    Raises:
+        DeveloperError: If `batch_size` or `prefetch` is less than 1.
+
+    Returns:
+        An asynchronous iterator of lists of mongoclass instances.
+    """
+    if batch_size < 1 or prefetch < 1:
+        raise DeveloperError("The batch size and prefetch must be positive.")
+    if _plan_guard is not None:
+        await _acheck_cursor(cursor)
+
+    loop = asyncio.get_running_loop()
+    loaded = _cursor_fields(cursor)
+    # Holds lists of documents, or futures of lists of instances when an
+    # executor is used, then None or the exception that ended the cursor.
+    queue: "asyncio.Queue[Any]" = asyncio.Queue(maxsize=prefetch)
+
+    async def produce() -> None:
+        try:
+            while True:
+                documents = await cursor.to_list(batch_size)
+                if not documents:
+                    break
+                if executor is None:
+                    await queue.put(documents)
+                else:
+                    await queue.put(
+                        loop.run_in_executor(
+                            executor, _structure_batch, cls, documents, loaded, trusted
+                        )
+                    )
+        except Exception as exc:
+            await queue.put(exc)
+        else:
+            await queue.put(None)
+
+    producer = loop.create_task(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            if executor is None:
+                yield _structure_batch(cls, item, loaded, trusted)
+            else:
+                yield await item
+    finally:
+        producer.cancel()
+
+
+@dataclass(frozen=True)
+class Page(Generic[T]):
+    """
+    A page of instances returned by `paginate`.
+
+    Attributes:
+        objects: The instances on the page.
+        next: The token of the next page, or None if this is the last page.
+    """
+
+    objects: List[T]
+    next: Optional[str]
+
+
+def _get_sort_keys(
+    cls: Type[MongoclassInstance], sort: Optional[List[Tuple[str, Literal[-1, 1]]]]
+) -> List[Tuple[str, int]]:
+    """
+    Returns the sort keys in database field names, ending with `_id`.
+    """
+    db_fields = cls.__mongoclass_config__.db_fields
+    keys: List[Tuple[str, int]] = []
+    for key, direction in sort or ():
+        name, dot, rest = key.partition(".")
+        keys.append((db_fields.get(name, name) + dot + rest, direction))
+    if all(key != "_id" for key, _ in keys):
+        keys.append(("_id", keys[-1][1] if keys else 1))
+    return keys
+
+
+def _get_path(document: Mapping[str, Any], path: str) -> Any:
+    value: Any = document
+    for name in path.split("."):
+        value = value.get(name) if isinstance(value, Mapping) else None
+    return value
+
+
+def _encode_token(
+    keys: List[Tuple[str, int]], document: Mapping[str, Any], codec_options: Any
+) -> str:
+    token = {
+        "keys": [list(key) for key in keys],
+        "values": [_get_path(document, key) for key, _ in keys],
+    }
+    return base64.urlsafe_b64encode(encode(token, codec_options=codec_options)).decode()
+
+
+def _decode_token(
+    token: str, keys: List[Tuple[str, int]], codec_options: Any
+) -> List[Any]:
+    try:
+        data = decode(base64.urlsafe_b64decode(token), codec_options=codec_options)
+    except (binascii.Error, BSONError, ValueError):
+        raise ValueError("Invalid pagination token.") from None
+    if [tuple(key) for key in data.get("keys", ())] != keys:
+        raise ValueError("The pagination token belongs to a different sort.")
+    return list(data["values"])
+
+
+def _seek_filter(
+    filter: Optional[Mapping[str, Any]],
+    keys: List[Tuple[str, int]],
+    values: List[Any],
+) -> Dict[str, Any]:
+    """
+    Returns the filter that selects the documents after the given values of
+    the sort keys.
+    """
+    clauses = []
+    for i, (key, direction) in enumerate(keys):
+        clause = {previous: value for (previous, _), value in zip(keys, values[:i])}
+        clause[key] = {"$gt" if direction == 1 else "$lt": values[i]}
+        clauses.append(clause)
+    seek = clauses[0] if len(clauses) == 1 else {"$or": clauses}
+    if filter:
+        return {"$and": [filter, seek]}
+    return seek
+
+
+def _prepare_page(
+    cls: Type[MongoclassInstance],
+    filter: Optional[Dict[str, Any]],
+    sort: Optional[List[Tuple[str, Literal[-1, 1]]]],
+    limit: int,
+    after: Optional[str],
+) -> Tuple[
+    Optional[Dict[str, Any]], List[Tuple[str, int]], Optional[FrozenSet[str]]
+]:
+    """
+    Returns the filter, the sort keys and the fields to fetch for a page.
+    """
+    if limit < 1:
+        raise DeveloperError("The page limit must be positive.")
+    keys = _get_sort_keys(cls, sort)
+    config = cls.__mongoclass_config__
+    names = {db_field: name for name, db_field in config.db_fields.items()}
+    deferred: Set[str] = set()
+    for key, _ in keys:
+        name = names.get(key.partition(".")[0])
+        if name is None:
+            raise DeveloperError(f"Class {cls} has no field for sort key {key!r}.")
+        if name in config.deferred:
+            deferred.add(name)
+    # The token is made of the values of the sort keys in the last document,
+    # so they must be fetched.
+    only = None
+    if deferred:
+        only = frozenset(config.db_fields).difference(config.deferred) | deferred
+    if after is not None:
+        codec_options = get_collection(cls).codec_options
+        values = _decode_token(after, keys, codec_options)
+        filter = _seek_filter(filter, keys, values)
+    return filter, keys, only
+
+
+def _make_page(
+    cls: Type[T],
+    documents: List[Mapping[str, Any]],
+    keys: List[Tuple[str, int]],
+    limit: int,
+    loaded: Optional[FrozenSet[str]],
+    trusted: bool,
+) -> "Page[T]":
+    next = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        codec_options = get_collection(cls).codec_options
+        next = _encode_token(keys, documents[-1], codec_options)
+    return Page(_structure_batch(cls, documents, loaded, trusted), next)
+
+
+def paginate(
+    cls: Type[T],
+    /,
+    filter: Optional[Dict[str, Any]] = None,
+    sort: Optional[List[Tuple[str, Literal[-1, 1]]]] = None,
+    limit: int = 100,
+    after: Optional[str] = None,
+    trusted: bool = False,
+) -> "Page[T]":
+    """
+    Returns a page of the instances matching a filter.
+
+    Unlike `skip`, the next page is selected with a range query on the sort
+    keys, so deep pages are as fast as the first one when an index covers
+    the sort. `_id` is appended to the sort keys to break ties. The values
+    of the sort keys should not be null or of mixed types. Deferred fields
+    used as sort keys are fetched.
+
+    Parameters:
+        cls: A mongoclass type.
+        filter: A query document that selects which documents to include.
+        sort: A list of (key, direction) pairs, where a key is the name of
+            a field of the class or a database field.
+        limit: The maximum number of instances on a page.
+        after: The `next` token of the previous page.
+        trusted: If True, the documents are structured without validation,
+            see `from_document`.
+
+    Raises:
+        DeveloperError: If `limit` is less than 1 or a sort key is not a
+            field of the class.
+        ValueError: If the token is invalid or was returned for another sort.
+
+    Returns:
+        A `Page` object.
+    """
+    if _is_async(get_collection(cls)):
+        raise TypeError("Use apaginate() with asynchronous collections.")
+    query, keys, only = _prepare_page(cls, filter, sort, limit, after)
+    rec = _Recorder(cls, "paginate") if _listeners else None
+    # Classes that track changes keep the raw documents as their snapshots.
+    lazy = cls.__mongoclass_config__.track_changes
+    cursor = cast(
+        "Cursor[Any]",
+        find(
+            cls,
+            query,
+            limit=limit + 1,
+            sort=cast(Any, keys),
+            only=only,
+            lazy=lazy,
+        ),
+    )
+    documents = list(cursor)
+    if rec is not None:
+        rec.received(*documents)
+    page = _make_page(cls, documents, keys, limit, _cursor_fields(cursor), trusted)
+    if rec is not None:
+        rec.converted()
+        rec.publish()
+    return page
+
+
+async def apaginate(
+    cls: Type[T],
+    /,
+    filter: Optional[Dict[str, Any]] = None,
+    sort: Optional[List[Tuple[str, Literal[-1, 1]]]] = None,
+    limit: int = 100,
+    after: Optional[str] = None,
+    trusted: bool = False,
+) -> "Page[T]":
+    query, keys, only = _prepare_page(cls, filter, sort, limit, after)
+    rec = _Recorder(cls, "apaginate") if _listeners else None
+    lazy = cls.__mongoclass_config__.track_changes
+    cursor = cast(
+        "AsyncIOMotorCursor[Any]",
+        find(
+            cls,
+            query,
+            limit=limit + 1,
+            sort=cast(Any, keys),
+            only=only,
+            lazy=lazy,
+        ),
+    )
+    if _plan_guard is not None:
+        await _acheck_cursor(cursor)
+    documents = await cursor.to_list(None)
+    if rec is not None:
+        rec.received(*documents)
+    page = _make_page(cls, documents, keys, limit, _cursor_fields(cursor), trusted)
+    if rec is not None:
+        rec.converted()
+        rec.publish()
+    return page
+
+
+apaginate.__doc__ = paginate.__doc__
+
+
+def lookup(
+    cls: Type[MongoclassInstance],
+    /,
+    local_field: str,
+    foreign_field: str,
+    as_field: str,
+) -> Dict[str, Any]:
+    """
+    Returns a `$lookup` stage that joins the documents of a mongoclass.
+
+    Parameters:
+        cls: The mongoclass whose documents are joined.
+        local_field: The field of the input documents to match.
+        foreign_field: The name of the field of `cls` to match, which is
+            translated to its database field.
+        as_field: The field in which the matched documents are stored,
+            usually a field of the result class typed as a list of `cls`.
+
+    Returns:
+        A pipeline stage.
+    """
+    config = cls.__mongoclass_config__
+    return {
+        "$lookup": {
+            "from": config.collection.name,
+            "localField": local_field,
+            "foreignField": config.db_fields.get(foreign_field, foreign_field),
+            "as": as_field,
+        }
+    }
+
+
+def _get_structurer(
+    cls: Type[MongoclassInstance], result_cls: Optional[Type[Any]], trusted: bool
+) -> Callable[[Mapping[str, Any]], Any]:
+    if result_cls is None:
+        result_cls = cls
+    if is_mongoclass(result_cls):
+        return functools.partial(
+            _structure, cast(Type[MongoclassInstance], result_cls), trusted=trusted
+        )
+    # The lru_cache arguments must be typed as hashable.
+    hooks = _get_result_hooks(cls, cast(type, result_cls))
+    return hooks.trusted_structure if trusted else hooks.structure
+
+
+@functools.lru_cache(maxsize=128)
+def _get_result_hooks(
+    cls: Type[MongoclassInstance], result_cls: Type[Any]
+) -> ClassHooks:
+    # Mongoclass fields, such as the output of `$lookup`, are structured by
+    # the hooks of their class.
+    return ClassHooks(
+        result_cls,
+        None,
+        {field.name: field.name for field in fields(result_cls)},
+        lookup=True,
+        owner=cls.__mongoclass_config__.hooks,
+    )
+
+
+def _aggregate_options(
+    allow_disk_use: bool, batch_size: Optional[int]
+) -> Dict[str, Any]:
+    options: Dict[str, Any] = {}
+    if allow_disk_use:
+        options["allowDiskUse"] = True
+    if batch_size is not None:
+        options["batchSize"] = batch_size
+    return options
+
+
+def aggregate(
+    cls: Type[MongoclassInstance],
+    pipeline: List[Dict[str, Any]],
+    /,
+    result_cls: Optional[Type[Any]] = None,
+    allow_disk_use: bool = False,
+    batch_size: Optional[int] = None,
+    trusted: bool = False,
+) -> Iterator[Any]:
+    """
+    Runs an aggregation pipeline on the collection associated with the
+    mongoclass and yields the results as instances.
+
+    The results are structured one at a time as the cursor returns them.
+    Fields of the result class typed as mongoclasses, or lists of them, are
+    structured by the hooks of their class, see `lookup`.
+
+    Parameters:
+        cls: A mongoclass type.
+        pipeline: A list of aggregation pipeline stages.
+        result_cls: A mongoclass or dataclass type of the results. Defaults
+            to `cls`.
+        allow_disk_use: If True, stages may write temporary files.
+        batch_size: The number of documents returned per batch.
+        trusted: If True, mongoclass results are structured without
+            validation, see `from_document`.
+
+    Returns:
+        An iterator of instances of the result class.
+    """
+    collection = cast("Collection[Any]", get_collection(cls))
+    if _is_async(collection):
+        raise TypeError("Use aaggregate() with asynchronous collections.")
+    structure = _get_structurer(cls, result_cls, trusted)
+    cursor = collection.aggregate(
+        pipeline, **_aggregate_options(allow_disk_use, batch_size)
+    )
+    return _iter_aggregate(cls, cursor, structure)
+
+
+def _iter_aggregate(
+    cls: Type[MongoclassInstance],
+    cursor: Iterable[Mapping[str, Any]],
+    structure: Callable[[Mapping[str, Any]], Any],
+) -> Iterator[Any]:
+    if not _listeners:
+        for document in cursor:
+            yield structure(document)
+        return
+
+    rec = _Recorder(cls, "aggregate")
+    try:
+        for document in cursor:
+            rec.received(document)
+            obj = structure(document)
+            rec.converted()
+            yield obj
+            rec.resume()
+    finally:
+        rec.publish()
+
+
+async def aaggregate(
+    cls: Type[MongoclassInstance],
+    pipeline: List[Dict[str, Any]],
+    /,
+    result_cls: Optional[Type[Any]] = None,
+    allow_disk_use: bool = False,
+    batch_size: Optional[int] = None,
+    trusted: bool = False,
+) -> AsyncIterator[Any]:
+    structure = _get_structurer(cls, result_cls, trusted)
+    collection = cast("AsyncIOMotorCollection[Any]", get_collection(cls))
+    cursor = collection.aggregate(
+        pipeline, **_aggregate_options(allow_disk_use, batch_size)
+    )
+    if not _listeners:
+        async for document in cursor:
+            yield structure(document)
+        return
+
+    rec = _Recorder(cls, "aaggregate")
+    try:
+        async for document in cursor:
+            rec.received(document)
+            obj = structure(document)
+            rec.converted()
+            yield obj
+            rec.resume()
+    finally:
+        rec.publish()
+
+
+aaggregate.__doc__ = aggregate.__doc__
+
+
+@dataclass(frozen=True)
+class ChangeEvent(Generic[T]):
+    """
+    A change to the collection of a mongoclass, returned by `watch`.
+
+    Attributes:
+        operation: The type of the change, such as `"insert"`, `"update"`,
+            `"replace"`, `"delete"` or `"invalidate"`.
+        id: The `_id` of the changed document, if any.
+        obj: The document after the change, if it was returned.
+        updated_fields: The database fields set by an update.
+        removed_fields: The database fields removed by an update.
+        resume_token: The token to pass as `resume_after` to continue after
+            this change.
+    """
+
+    operation: str
+    id: Any
+    obj: Optional[T]
+    updated_fields: Dict[str, Any]
+    removed_fields: List[str]
+    resume_token: Mapping[str, Any]
+
+
+def _to_change_event(
+    cls: Type[T], change: Mapping[str, Any], trusted: bool
+) -> "ChangeEvent[T]":
+    document = change.get("fullDocument")
+    update = change.get("updateDescription") or {}
+    return ChangeEvent(
+        operation=change["operationType"],
+        id=change.get("documentKey", {}).get("_id"),
+        obj=None if document is None else _structure(cls, document, None, trusted),
+        updated_fields=dict(update.get("updatedFields", {})),
+        removed_fields=list(update.get("removedFields", [])),
+        resume_token=change["_id"],
+    )
+
+
+def watch(
+    cls: Type[T],
+    /,
+    pipeline: Optional[List[Dict[str, Any]]] = None,
+    full_document: Optional[str] = "updateLookup",
+    resume_after: Optional[Mapping[str, Any]] = None,
+    trusted: bool = False,
+) -> Iterator["ChangeEvent[T]"]:
+    """
+    Yields the changes to the collection associated with the mongoclass.
+
+    Change streams require a replica set or a sharded cluster, a single node
+    replica set is enough.
+
+    Parameters:
+        cls: A mongoclass type.
+        pipeline: Aggregation stages that filter or modify the change events.
+        full_document: `"updateLookup"` returns the current document with
+            updates, None only returns the changed fields.
+        resume_after: The `resume_token` of the change to continue after.
+        trusted: If True, the documents are structured without validation,
+            see `from_document`.
+
+    Returns:
+        An iterator of `ChangeEvent` objects that waits for new changes.
+    """
+    collection = get_collection(cls)
+    if _is_async(collection):
+        raise TypeError("Use awatch() with asynchronous collections.")
+    stream = collection.watch(
+        pipeline, full_document=full_document, resume_after=resume_after
+    )
+    with stream:
+        for change in stream:
+            yield _to_change_event(cls, change, trusted)
+
+
+async def awatch(
+    cls: Type[T],
+    /,
+    pipeline: Optional[List[Dict[str, Any]]] = None,
+    full_document: Optional[str] = "updateLookup",
+    resume_after: Optional[Mapping[str, Any]] = None,
+    trusted: bool = False,
+) -> AsyncIterator["ChangeEvent[T]"]:
+    collection = cast("AsyncIOMotorCollection[Any]", get_collection(cls))
+    stream = collection.watch(
+        pipeline, full_document=full_document, resume_after=resume_after
+    )
+    async with stream:
+        async for change in stream:
+            yield _to_change_event(cls, change, trusted)
+
+
+awatch.__doc__ = watch.__doc__
+
+
+def _import_class(path: str) -> Type[Any]:
+    module_name, _, qualname = path.partition(":")
+    obj: Any = importlib.import_module(module_name)
+    for name in qualname.split("."):
+        obj = getattr(obj, name)
+    return cast(Type[Any], obj)
+
+
+def _structure_raw_batch(
+    path: str,
+    data: bytes,
+    *,
+    loaded: Optional[FrozenSet[str]],
+    trusted: bool,
+    reduce: Optional[Callable[[List[Any]], Any]],
+) -> Any:
+    """
+    Structures a raw batch of documents in a worker process of `find_parallel`.
+    """
+    cls = _import_class(path)
+    codec_options = get_collection(cls).codec_options
+    objs = [
+        _structure(cls, document, loaded, trusted)
+        for document in decode_all(data, codec_options)
+    ]
+    return objs if reduce is None else reduce(objs)
+
+
+def find_parallel(
+    cls: Type[MongoclassInstance],
+    /,
+    filter: Optional[Dict[str, Any]] = None,
+    skip: int = 0,
+    limit: int = 0,
+    sort: Optional[List[Tuple[str, Literal[-1, 1]]]] = None,
+    only: Optional[Iterable[str]] = None,
+    exclude: Optional[Iterable[str]] = None,
+    batch_size: int = 1000,
+    executor: Optional[Executor] = None,
+    max_in_flight: Optional[int] = None,
+    ordered: bool = True,
+    reduce: Optional[Callable[[List[Any]], Any]] = None,
+    trusted: bool = False,
+) -> Iterator[Any]:
+    """
+    Performs a query and structures the documents in worker processes.
+
+    The documents are read from the server as raw BSON batches which are sent
+    to the workers undecoded. Each worker imports the class by name, so it
+    must be defined at the top level of a module. Instances are pickled back
+    to the calling process; pass `reduce` to return a smaller result from
+    each batch instead.
+
+    Parameters:
+        cls: A mongoclass type.
+        filter: A query document that selects which documents to include in the result set.
+        skip: The number of documents to omit from the start of the result set.
+        limit: The maximum number of results to return.
+        sort: A list of (key, direction) pairs.
+        only: The names of the fields to fetch.
+        exclude: The names of the fields not to fetch.
+        batch_size: The number of documents in each batch.
+        executor: The executor of the workers. Defaults to a new
+            `ProcessPoolExecutor` that is shut down when the iteration ends.
+        max_in_flight: The maximum number of batches read but not yet
+            consumed. Defaults to twice the number of CPUs.
+        ordered: If False, the results are yielded as soon as their batch is
+            structured rather than in the order of the cursor.
+        reduce: A picklable function that is called in the worker with the
+            list of instances of each batch.
+        trusted: If True, the documents are structured without validation,
+            see `from_document`.
+
+    Raises:
+        DeveloperError: If the class cannot be imported by the workers.
+        DeveloperError: If `batch_size` or `max_in_flight` is less than 1.
+
+    Returns:
+        An iterator of mongoclass instances, or of the results of `reduce`.
+    """
+    path = f"{cls.__module__}:{cls.__qualname__}"
+    if "<locals>" in cls.__qualname__:
+        raise DeveloperError(
+            f"Class {cls} must be defined at the top level of a module."
+        )
+
+    if max_in_flight is None:
+        max_in_flight = 2 * (os.cpu_count() or 1)
+
+    if batch_size < 1 or max_in_flight < 1:
+        raise DeveloperError("The batch size and max_in_flight must be positive.")
+
+    projection, loaded = _get_projection(cls, only, exclude)
+    collection = get_collection(cls)
+    if _is_async(collection):
+        raise TypeError("find_parallel() requires a synchronous collection.")
+
+    cursor = cast("Collection[Any]", collection).find_raw_batches(
+        filter=filter,
+        projection=projection,
+        skip=skip,
+        limit=limit,
+        sort=sort,
+        batch_size=batch_size,
+    )
+    structure = functools.partial(
+        _structure_raw_batch, path, loaded=loaded, trusted=trusted, reduce=reduce
+    )
+    return _iter_parallel(
+        cursor, structure, executor, max_in_flight, ordered, reduce is None
+    )
+
+
+def _iter_parallel(
+    cursor: Iterable[bytes],
+    structure: Callable[[bytes], Any],
+    executor: Optional[Executor],
+    max_in_flight: int,
+    ordered: bool,
+    flatten: bool,
+) -> Iterator[Any]:
+    pool = ProcessPoolExecutor() if executor is None else executor
+    pending: Deque["Future[Any]"] = deque()
+    try:
+        for data in cursor:
+            pending.append(pool.submit(structure, data))
+            while len(pending) >= max_in_flight:
+                yield from _next_results(pending, ordered, flatten)
+
+        while pending:
+            yield from _next_results(pending, ordered, flatten)
+    finally:
+        cursor.close()  # type: ignore[attr-defined]
+        for future in pending:
+            future.cancel()
+        if executor is None:
+            pool.shutdown(wait=False)
+
+
+def _next_results(
+    pending: Deque["Future[Any]"], ordered: bool, flatten: bool
+) -> Iterator[Any]:
+    """
+    Removes a finished batch from `pending` and yields its results.
+    """
+    if ordered:
+        future = pending.popleft()
+    else:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        future = next(iter(done))
+        pending.remove(future)
+
+    if flatten:
+        yield from future.result()
+    else:
+        yield future.result()
+
+
+def _prepare_columns(
+    cls: Type[MongoclassInstance], fields: Iterable[str], batch_size: int
+) -> Tuple[Dict[str, int], List[Column], List[str]]:
+    config = cls.__mongoclass_config__
+    names = list(dict.fromkeys(fields))
+    if not names:
+        raise DeveloperError("At least one field is required.")
+    for name in names:
+        if name not in config.db_fields:
+            raise DeveloperError(f"Class {cls} has no field {name!r}.")
+    if batch_size < 1:
+        raise DeveloperError("The batch size must be positive.")
+
+    db_fields = [config.db_fields[name] for name in names]
+    projection = {db_field: 1 for db_field in db_fields}
+    projection.setdefault("_id", 0)
+    columns = make_columns(
+        cls,
+        names,
+        config.hooks.fallback.structure,
+        config.collection.codec_options,
+    )
+    return projection, columns, db_fields
+
+
+def find_columns(
+    cls: Type[MongoclassInstance],
+    /,
+    filter: Optional[Dict[str, Any]] = None,
+    fields: Iterable[str] = (),
+    sort: Optional[List[Tuple[str, Literal[-1, 1]]]] = None,
+    limit: int = 0,
+    batch_size: int = 10_000,
+) -> Iterator[ColumnBatch]:
+    """
+    Performs a query and yields the values of a few fields in columns.
+
+    Only the given fields are fetched. The documents are read as raw BSON
+    batches and their fields are copied into the columns without creating a
+    dictionary or an instance per document, which suits reading a few fields
+    of many documents for analysis.
+
+    Parameters:
+        cls: A mongoclass type.
+        filter: A query document that selects which documents to include in the result set.
+        fields: The names of the fields to fetch.
+        sort: A list of (key, direction) pairs.
+        limit: The maximum number of results to return.
+        batch_size: The maximum number of rows in each batch.
+
+    Raises:
+        DeveloperError: If no field is given or a field does not exist.
+        DeveloperError: If `batch_size` is less than 1.
+
+    Returns:
+        An iterator of `ColumnBatch` objects.
+    """
+    projection, columns, db_fields = _prepare_columns(cls, fields, batch_size)
+    collection = cast("Collection[Any]", get_collection(cls))
+    if _is_async(collection):
+        raise TypeError("Use afind_columns() with asynchronous collections.")
+
+    cursor = collection.find_raw_batches(
+        filter=filter,
+        projection=projection,
+        sort=sort,
+        limit=limit,
+        batch_size=batch_size,
+    )
+    try:
+        for data in cursor:
+            if data:
+                yield scan(data, columns, db_fields)
+    finally:
+        cursor.close()
+
+
+async def afind_columns(
+    cls: Type[MongoclassInstance],
+    /,
+    filter: Optional[Dict[str, Any]] = None,
+    fields: Iterable[str] = (),
+    sort: Optional[List[Tuple[str, Literal[-1, 1]]]] = None,
+    limit: int = 0,
+    batch_size: int = 10_000,
+) -> AsyncIterator[ColumnBatch]:
+    projection, columns, db_fields = _prepare_columns(cls, fields, batch_size)
+    collection = cast("AsyncIOMotorCollection[Any]", get_collection(cls))
+    cursor = collection.find_raw_batches(
+        filter=filter,
+        projection=projection,
+        sort=sort,
+        limit=limit,
+        batch_size=batch_size,
+    )
+    try:
+        async for data in cursor:
+            if data:
+                yield scan(data, columns, db_fields)
+    finally:
+        await cursor.close()
+
+
+afind_columns.__doc__ = find_columns.__doc__
+
+
+# The formats of `dump` and `load`, by file extension.
+_DUMP_FORMATS = {"bson": "bson", "jsonl": "jsonl", "ndjson": "jsonl"}
+
+_INT32 = struct.Struct("<i")
+
+
+def _dump_format(path: "Union[str, os.PathLike[str]]", format: Optional[str]) -> str:
+    if format is None:
+        name = os.fspath(path)
+        if name.endswith(".gz"):
+            name = name[:-3]
+        format = _DUMP_FORMATS.get(os.path.splitext(name)[1].lstrip("."))
+    if format not in ("bson", "jsonl"):
+        raise DeveloperError(
+            f"Cannot tell the format of {os.fspath(path)!r}, "
+            "pass format='bson' or format='jsonl'."
+        )
+    return format
+
+
+def _open_dump(
+    path: "Union[str, os.PathLike[str]]", mode: str, format: str
+) -> IO[Any]:
+    """
+    Opens a dump file, compressed with gzip if its name ends with `.gz`.
+    """
+    if format == "bson":
+        mode, encoding = mode + "b", None
+    else:
+        mode, encoding = mode + "t", "utf-8"
+    if os.fspath(path).endswith(".gz"):
+        return cast(IO[Any], gzip.open(path, mode, encoding=encoding))
+    return open(path, mode, encoding=encoding)
+
+
+def _encode_dump_batch(data: bytes, format: str) -> Tuple[Any, int]:
+    """
+    Returns a raw batch in the format of the dump, and its number of documents.
+    """
+    if format == "jsonl":
+        documents = decode_all(data)
+        lines = "".join(json_util.dumps(document) + "\n" for document in documents)
+        return lines, len(documents)
+
+    count = 0
+    position = 0
+    while position < len(data):
+        position += _INT32.unpack_from(data, position)[0]
+        count += 1
+    return data, count
+
+
+def _iter_records(f: IO[Any], format: str) -> Iterator[Mapping[str, Any]]:
+    if format == "jsonl":
+        for line in f:
+            if line.strip():
+                yield json_util.loads(line)
+        return
+
+    while True:
+        header = f.read(4)
+        if not header:
+            return
+        size = _INT32.unpack(header)[0] - 4 if len(header) == 4 else -1
+        body = f.read(size) if size > 0 else b""
+        if size <= 0 or len(body) != size:
+            raise ValueError("The BSON dump is truncated.")
+        yield RawBSONDocument(header + body)
+
+
+def _read_load_batch(
+    cls: Type[MongoclassInstance],
+    records: Iterator[Mapping[str, Any]],
+    batch_size: int,
+    validate: bool,
+    offset: int,
+    results: Dict[str, Any],
+) -> List[Mapping[str, Any]]:
+    """
+    Reads the next batch of documents, `offset` is the position of the first
+    one in the file and `results` the result of the batches inserted so far.
+    """
+    batch = list(islice(records, batch_size))
+    if not validate:
+        return batch
+
+    config = cls.__mongoclass_config__
+    codec_options = config.collection.codec_options
+    documents: List[Mapping[str, Any]] = []
+    for index, record in enumerate(batch, offset):
+        try:
+            if isinstance(record, RawBSONDocument):
+                record = decode(record.raw, codec_options=codec_options)
+            obj = _structure(cls, record, None, False)
+        except Exception as exc:
+            raise LoadError(
+                f"Document {index} of the file is not valid: {exc}", index, results
+            ) from exc
+        documents.append(config.hooks.unstructure(obj))
+    return documents
+
+
+def _merge_load_errors(
+    results: Dict[str, Any], details: Mapping[str, Any], offset: int
+) -> None:
+    """
+    Adds the result of a failed batch, with the index of each write error
+    relative to the start of the file.
+    """
+    results["nInserted"] += details.get("nInserted", 0)
+    for error in details.get("writeErrors", ()):
+        results["writeErrors"].append(dict(error, index=error["index"] + offset))
+    results["writeConcernErrors"].extend(details.get("writeConcernErrors", ()))
+
+
+def _load_results() -> Dict[str, Any]:
+    return {
+        "nInserted": 0,
+        "nUpserted": 0,
+        "nMatched": 0,
+        "nModified": 0,
+        "nRemoved": 0,
+        "upserted": [],
+        "writeErrors": [],
+        "writeConcernErrors": [],
+    }
+
+
+def dump(
+    cls: Type[MongoclassInstance],
+    path: "Union[str, os.PathLike[str]]",
+    /,
+    filter: Optional[Dict[str, Any]] = None,
+    format: Optional[Literal["bson", "jsonl"]] = None,
+    batch_size: int = 1000,
+) -> int:
+    """
+    Writes the documents of the collection associated with the mongoclass to
+    a file.
+
+    The documents are read as raw BSON batches and written one batch at a
+    time, so memory does not grow with the size of the collection. BSON dumps
+    hold the documents as sent by the server, in the format of `mongodump`.
+    JSONL dumps hold one Extended JSON document per line.
+
+    Parameters:
+        cls: A mongoclass type.
+        path: The file to write. Names ending with `.gz` are compressed with
+            gzip.
+        filter: A query document that selects which documents to write.
+        format: `"bson"` or `"jsonl"`. Defaults to the extension of `path`,
+            `.bson`, `.jsonl` or `.ndjson`.
+        batch_size: The number of documents read from the server at a time.
+
+    Raises:
+        DeveloperError: If the format is not given and `path` does not have
+            a known extension.
+
+    Returns:
+        The number of documents written.
+    """
+    fmt = _dump_format(path, format)
+    collection = cast("Collection[Any]", get_collection(cls))
+    if _is_async(collection):
+        raise TypeError("Use adump() with asynchronous collections.")
+
+    count = 0
+    cursor = collection.find_raw_batches(filter, batch_size=batch_size)
+    try:
+        with _open_dump(path, "w", fmt) as f:
+            for data in cursor:
+                encoded, batch_count = _encode_dump_batch(data, fmt)
+                f.write(encoded)
+                count += batch_count
+    finally:
+        cursor.close()
+    return count
+
+
+async def adump(
+    cls: Type[MongoclassInstance],
+    path: "Union[str, os.PathLike[str]]",
+    /,
+    filter: Optional[Dict[str, Any]] = None,
+    format: Optional[Literal["bson", "jsonl"]] = None,
+    batch_size: int = 1000,
+) -> int:
+    fmt = _dump_format(path, format)
+    loop = asyncio.get_running_loop()
+    count = 0
+    collection = cast("AsyncIOMotorCollection[Any]", get_collection(cls))
+    cursor = collection.find_raw_batches(filter, batch_size=batch_size)
+    try:
+        with _open_dump(path, "w", fmt) as f:
+            async for data in cursor:
+                encoded, batch_count = _encode_dump_batch(data, fmt)
+                # Keeps the event loop free while the file is written.
+                await loop.run_in_executor(None, f.write, encoded)
+                count += batch_count
+    finally:
+        await cursor.close()
+    return count
+
+
+adump.__doc__ = dump.__doc__
+
+
+def load(
+    cls: Type[MongoclassInstance],
+    path: "Union[str, os.PathLike[str]]",
+    /,
+    batch_size: int = 1000,
+    validate: bool = False,
+    format: Optional[Literal["bson", "jsonl"]] = None,
+) -> int:
+    """
+    Inserts the documents of a file written by `dump` into the collection
+    associated with the mongoclass.
+
+    The file is streamed and the documents are inserted in unordered batches,
+    so memory does not grow with the size of the file. A failed insert does
+    not stop the load; the errors are raised once every batch was sent.
+
+    Parameters:
+        cls: A mongoclass type.
+        path: The file to read. Names ending with `.gz` are decompressed with
+            gzip.
+        batch_size: The number of documents per `insert_many`.
+        validate: If True, each document is structured into an instance and
+            converted back before being inserted, so that an invalid document
+            stops the load and the others are stored the way the mongoclass
+            writes them. Otherwise the documents are inserted unchanged.
+        format: `"bson"` or `"jsonl"`. Defaults to the extension of `path`,
+            `.bson`, `.jsonl` or `.ndjson`.
+
+    Raises:
+        DeveloperError: If the format is not given and `path` does not have
+            a known extension.
+        DeveloperError: If `batch_size` is less than 1.
+        ValueError: If a BSON dump is truncated.
+        LoadError: If `validate` is True and a document is not valid.
+        BulkWriteError: If any of the documents could not be inserted. The
+            index of each write error is the position of the document in the
+            file.
+
+    Returns:
+        The number of documents inserted.
+    """
+    fmt = _dump_format(path, format)
+    if batch_size < 1:
+        raise DeveloperError("The batch size must be positive.")
+    collection = cast("Collection[Any]", get_collection(cls))
+    if _is_async(collection):
+        raise TypeError("Use aload() with asynchronous collections.")
+
+    results = _load_results()
+    offset = 0
+    with _open_dump(path, "r", fmt) as f:
+        records = _iter_records(f, fmt)
+        while True:
+            batch = _read_load_batch(
+                cls, records, batch_size, validate, offset, results
+            )
+            if not batch:
+                break
+            try:
+                collection.insert_many(batch, ordered=False)
+            except BulkWriteError as exc:
+                _merge_load_errors(results, exc.details, offset)
+            else:
+                results["nInserted"] += len(batch)
+            offset += len(batch)
+
+    if results["writeErrors"] or results["writeConcernErrors"]:
+        raise BulkWriteError(results)
+    return cast(int, results["nInserted"])
+
+
+async def aload(
+    cls: Type[MongoclassInstance],
+    path: "Union[str, os.PathLike[str]]",
+    /,
+    batch_size: int = 1000,
+    validate: bool = False,
+    format: Optional[Literal["bson", "jsonl"]] = None,
+) -> int:
+    fmt = _dump_format(path, format)
+    if batch_size < 1:
+        raise DeveloperError("The batch size must be positive.")
+    collection = cast("AsyncIOMotorCollection[Any]", get_collection(cls))
+    loop = asyncio.get_running_loop()
+
+    results = _load_results()
+    offset = 0
+    with _open_dump(path, "r", fmt) as f:
+        records = _iter_records(f, fmt)
+        while True:
+            # Keeps the event loop free while the file is read.
+            batch = await loop.run_in_executor(
+                None,
+                _read_load_batch,
+                cls,
+                records,
+                batch_size,
+                validate,
+                offset,
+                results,
+            )
+            if not batch:
+                break
+            try:
+                await collection.insert_many(batch, ordered=False)
+            except BulkWriteError as exc:
+                _merge_load_errors(results, exc.details, offset)
+            else:
+                results["nInserted"] += len(batch)
+            offset += len(batch)
+
+    if results["writeErrors"] or results["writeConcernErrors"]:
+        raise BulkWriteError(results)
+    return cast(int, results["nInserted"])
+
+
+aload.__doc__ = load.__doc__
+
+
+def create_indexes(cls: Type[MongoclassInstance], /) -> List[str]:
+    """
+    Creates the indexes specified by the mongoclass.
+
+    Parameters:
+        cls: A mongoclass.
+
+    Returns:
+        A list of index names.
+    """
+    collection = get_collection(cls)
+    return collection.create_indexes(list(cls.__mongoclass_config__.indexes))
+
+
+async def acreate_indexes(cls: Type[MongoclassInstance], /) -> List[str]:
+    collection = get_collection(cls)
+    return await collection.create_indexes(list(cls.__mongoclass_config__.indexes))
 
 
 acreate_indexes.__doc__ = create_indexes.__doc__
+
+
+@dataclass(frozen=True)
+class IndexReport:
+    """
+    The outcome of `ensure_indexes` for a collection.
+
+    Attributes:
+        created: The names of the declared indexes that were created.
+        existing: The names of the declared indexes that already existed.
+        extra: The names of the indexes that exist but are not declared.
+    """
+
+    created: List[str]
+    existing: List[str]
+    extra: List[str]
+
+
+def _index_spec(document: Mapping[str, Any]) -> Tuple[Any, ...]:
+    """
+    Returns what identifies an index, ignoring server defaults such as `v`.
+    """
+    document = _normalize_index(document)
+    options = tuple(
+        (name, _freeze(document[name]))
+        for name in _INDEX_OPTIONS
+        if document.get(name) is not None and document[name] is not False
+    )
+    return document["name"], _freeze(document["key"]), options
+
+
+def _normalize_index(document: Mapping[str, Any]) -> Dict[str, Any]:
+    """
+    Returns an index document in the form listed by the server, which keys
+    the fields of a text index as `_fts` and `_ftsx` and fills in the default
+    options of text indexes and collations.
+    """
+    document = dict(document)
+    key: Dict[str, Any] = {}
+    weights = dict(document.get("weights") or {})
+    for name, value in document["key"].items():
+        if value == "text" and name != "_fts":
+            weights.setdefault(name, 1)
+            key.setdefault("_fts", "text")
+            key.setdefault("_ftsx", 1)
+        else:
+            key[name] = value
+    document["key"] = key
+    if "_fts" in key:
+        document["weights"] = dict(sorted(weights.items()))
+        for name, default in _TEXT_INDEX_DEFAULTS.items():
+            document.setdefault(name, default)
+
+    collation = document.get("collation")
+    if collation is not None:
+        collation = {
+            name: value
+            for name, value in collation.items()
+            if name != "version" and _COLLATION_DEFAULTS.get(name) != value
+        }
+        # The server does not list the simple collation.
+        simple = collation == {"locale": "simple"}
+        document["collation"] = None if simple else collation
+    return document
+
+
+# The options of text indexes that the server lists when they are not set.
+_TEXT_INDEX_DEFAULTS = {"default_language": "english", "language_override": "language"}
+
+# The options of collations that the server lists when they are not set. A
+# locale may have other defaults, which are then sent again.
+_COLLATION_DEFAULTS = {
+    "caseLevel": False,
+    "caseFirst": "off",
+    "strength": 3,
+    "numericOrdering": False,
+    "alternate": "non-ignorable",
+    "maxVariable": "punct",
+    "normalization": False,
+    "backwards": False,
+}
+
+
+def _freeze(value: Any) -> Hashable:
+    """
+    Returns a hashable copy of a BSON value, in which numbers of any type
+    compare equal, as they do on the server.
+    """
+    if isinstance(value, Mapping):
+        return tuple((key, _freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, (int, float)):
+        return float(value)
+    return cast(Hashable, value)
+
+
+# The index options compared by `ensure_indexes`.
+_INDEX_OPTIONS = (
+    "unique",
+    "sparse",
+    "expireAfterSeconds",
+    "partialFilterExpression",
+    "collation",
+    "hidden",
+    "weights",
+    "default_language",
+    "language_override",
+)
+
+
+def _diff_indexes(
+    declared: Iterable[IndexModel], current: Iterable[Mapping[str, Any]]
+) -> Tuple[List[IndexModel], List[str], List[str]]:
+    """
+    Returns the declared indexes that are missing or differ, the names of the
+    declared indexes that exist, and the names of the undeclared ones.
+    """
+    current_specs = {_index_spec(document) for document in current}
+    current_names = {document["name"] for document in current}
+    missing, existing, names = [], [], {"_id_"}
+    for index in declared:
+        document = index.document
+        names.add(document["name"])
+        if _index_spec(document) in current_specs:
+            existing.append(document["name"])
+        else:
+            missing.append(index)
+    extra = [name for name in sorted(current_names) if name not in names]
+    return missing, existing, extra
+
+
+def ensure_indexes(cls: Type[MongoclassInstance], /) -> IndexReport:
+    """
+    Creates the indexes specified by the mongoclass that do not exist yet.
+
+    Unlike `create_indexes`, nothing is sent when every index exists. An index
+    whose name exists with other keys or options is sent again, so the server
+    reports the conflict. Text indexes and collations are compared with the
+    defaults the server fills in.
+
+    Parameters:
+        cls: A mongoclass.
+
+    Returns:
+        An `IndexReport` object.
+    """
+    collection = cast("Collection[Any]", get_collection(cls))
+    if _is_async(collection):
+        raise TypeError("Use aensure_indexes() with asynchronous collections.")
+    current = list(collection.list_indexes())
+    missing, existing, extra = _diff_indexes(
+        cls.__mongoclass_config__.indexes, current
+    )
+    created = collection.create_indexes(missing) if missing else []
+    return IndexReport(created, existing, extra)
+
+
+async def aensure_indexes(cls: Type[MongoclassInstance], /) -> IndexReport:
+    collection = cast("AsyncIOMotorCollection[Any]", get_collection(cls))
+    current = await collection.list_indexes().to_list(None)
+    missing, existing, extra = _diff_indexes(
+        cls.__mongoclass_config__.indexes, current
+    )
+    created = await collection.create_indexes(missing) if missing else []
+    return IndexReport(created, existing, extra)
+
+
+aensure_indexes.__doc__ = ensure_indexes.__doc__
+
+
+def ensure_all_indexes(
+    classes: Optional[Iterable[Type[MongoclassInstance]]] = None,
+    /,
+    max_workers: Optional[int] = None,
+) -> Dict[Type[MongoclassInstance], IndexReport]:
+    """
+    Runs `ensure_indexes` for many mongoclasses concurrently.
+
+    Parameters:
+        classes: The mongoclasses, defaults to every mongoclass with a
+            synchronous collection, see `get_mongoclasses`.
+        max_workers: The maximum number of threads.
+
+    Returns:
+        The `IndexReport` of each class.
+    """
+    if classes is None:
+        classes = [
+            cls for cls in get_mongoclasses() if not _is_async(get_collection(cls))
+        ]
+    classes = list(classes)
+    if not classes:
+        return {}
+    with ThreadPoolExecutor(max_workers) as executor:
+        reports = executor.map(ensure_indexes, classes)
+        return dict(zip(classes, reports))
+
+
+async def aensure_all_indexes(
+    classes: Optional[Iterable[Type[MongoclassInstance]]] = None,
+    /,
+) -> Dict[Type[MongoclassInstance], IndexReport]:
+    """
+    Runs `aensure_indexes` for many mongoclasses concurrently.
+
+    Parameters:
+        classes: The mongoclasses, defaults to every mongoclass with an
+            asynchronous collection, see `get_mongoclasses`.
+
+    Returns:
+        The `IndexReport` of each class.
+    """
+    if classes is None:
+        classes = [cls for cls in get_mongoclasses() if _is_async(get_collection(cls))]
+    classes = list(classes)
+    reports = await asyncio.gather(*(aensure_indexes(cls) for cls in classes))
+    return dict(zip(classes, reports))
+
+
+def __getattr__(name: str) -> Any:
+    # The query plan module is only imported when it is used.
+    if name == "QueryPlan":
+        from ._plans import QueryPlan
+
+        return QueryPlan
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
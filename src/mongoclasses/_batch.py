@@ -0,0 +1,130 @@
+"""
+Coalesces concurrent lookups by `_id` into a single `$in` query.
+"""
+
+import asyncio
+import copy
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Hashable,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from bson import encode
+
+# The number of ids after which a batch is sent without waiting for the window.
+MAX_BATCH_SIZE = 1000
+
+
+def id_key(id: Any) -> Hashable:
+    """
+    Returns a key that matches an `_id` to the `_id` of the returned document,
+    also used to key the document cache.
+    """
+    try:
+        hash(id)
+    except TypeError:
+        return encode({"_id": id})
+    # True == 1 in Python but not in MongoDB.
+    return (type(id) is bool, id)
+
+
+def unique_ids(ids: Iterable[Any]) -> List[Any]:
+    """
+    Returns the ids without duplicates, in order.
+    """
+    return list({id_key(id): id for id in ids}.values())
+
+
+def match_ids(
+    ids: Iterable[Any], documents: Iterable[Mapping[str, Any]]
+) -> List[Optional[Mapping[str, Any]]]:
+    """
+    Returns the document of each id or None. An id requested more than once
+    gets a copy of the document each time after the first, so that the
+    callers do not share values.
+    """
+    found = {id_key(document["_id"]): document for document in documents}
+    matched = []
+    seen = set()
+    for id in ids:
+        key = id_key(id)
+        document = found.get(key)
+        if document is not None and key in seen:
+            document = copy.deepcopy(document)
+        seen.add(key)
+        matched.append(document)
+    return matched
+
+
+class BatchLoader:
+    """
+    Gathers the ids requested within `window` seconds and fetches them with
+    one call to `fetch`, which returns the documents that were found.
+
+    A loader belongs to one event loop.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[List[Any]], Awaitable[List[Any]]],
+        window: float,
+        max_size: int = MAX_BATCH_SIZE,
+    ) -> None:
+        self.fetch = fetch
+        self.window = window
+        self.max_size = max_size
+        self.pending: List[Tuple[Any, "asyncio.Future[Any]"]] = []
+        self.handle: Optional[asyncio.Handle] = None
+        # Running batches, referenced so they are not garbage collected.
+        self.tasks: Set["asyncio.Task[None]"] = set()
+
+    def load(self, id: Any) -> "asyncio.Future[Any]":
+        """
+        Returns a future of the document with the given id or None.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((id, future))
+        if len(self.pending) >= self.max_size:
+            self.dispatch()
+        elif self.handle is None:
+            if self.window > 0:
+                self.handle = loop.call_later(self.window, self.dispatch)
+            else:
+                self.handle = loop.call_soon(self.dispatch)
+        return future
+
+    def dispatch(self) -> None:
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        batch, self.pending = self.pending, []
+        task = asyncio.get_running_loop().create_task(self.run(batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run(self, batch: List[Tuple[Any, "asyncio.Future[Any]"]]) -> None:
+        ids = [id for id, _ in batch]
+        try:
+            documents = await self.fetch(unique_ids(ids))
+        except Exception as exc:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        except BaseException:
+            for _, future in batch:
+                future.cancel()
+            raise
+
+        for (_, future), document in zip(batch, match_ids(ids, documents)):
+            if not future.done():
+                future.set_result(document)
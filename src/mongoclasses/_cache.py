@@ -0,0 +1,128 @@
+"""
+An in-memory cache of documents keyed by `_id`.
+
+Documents are stored as encoded BSON so that every lookup returns a new
+instance, and changes made to one instance are never seen by another.
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+import threading
+import time
+from typing import Callable, Hashable, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class CacheStats:
+    """
+    Counters of a mongoclass document cache.
+
+    Attributes:
+        hits: The lookups that were served from the cache.
+        misses: The lookups that went to the database.
+        evictions: The entries dropped because the cache was full or expired.
+        invalidations: The entries dropped or refreshed by writes.
+        size: The number of entries in the cache.
+    """
+
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+    size: int = 0
+
+
+class DocumentCache:
+    """
+    A thread safe LRU cache of encoded documents with an optional TTL.
+
+    The lock is never held across an `await`, so the cache is also safe to
+    share between coroutines.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: Optional[float] = None,
+        timer: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[Hashable, Tuple[bytes, float]]" = OrderedDict()
+        # Incremented by every write so that a lookup which raced with a write
+        # does not store the document it read before the write.
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable) -> Tuple[Optional[bytes], int]:
+        """
+        Returns the cached document, or None, and the version to pass to `set`.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                data, expires = entry
+                if expires >= self.timer():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return data, self.version
+                del self.entries[key]
+                self.evictions += 1
+            self.misses += 1
+            return None, self.version
+
+    def set(self, key: Hashable, data: bytes, version: int) -> None:
+        """
+        Caches a document read from the database, unless a write happened
+        since `get` returned `version`.
+        """
+        with self.lock:
+            if version == self.version:
+                self._store(key, data)
+
+    def refresh(self, key: Hashable, data: bytes) -> None:
+        """
+        Replaces the cached document after it was written.
+        """
+        with self.lock:
+            self.version += 1
+            if key in self.entries:
+                self.invalidations += 1
+            self._store(key, data)
+
+    def evict(self, key: Hashable) -> None:
+        """
+        Drops the cached document after it was written.
+        """
+        with self.lock:
+            self.version += 1
+            if self.entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.version += 1
+            self.entries.clear()
+
+    def stats(self) -> CacheStats:
+        with self.lock:
+            return CacheStats(
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                invalidations=self.invalidations,
+                size=len(self.entries),
+            )
+
+    def _store(self, key: Hashable, data: bytes) -> None:
+        expires = float("inf") if self.ttl is None else self.timer() + self.ttl
+        self.entries[key] = (data, expires)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
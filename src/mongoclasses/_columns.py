@@ -0,0 +1,255 @@
+"""
+Reads fields of raw BSON batches into columns, without decoding the
+documents into dictionaries or instances.
+"""
+
+import array
+from dataclasses import dataclass, fields
+from datetime import datetime, timedelta, timezone
+import struct
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union, cast
+
+from bson import decode
+from bson.codec_options import CodecOptions
+from typing_extensions import get_type_hints
+
+from ._hooks import _optional_arg, _strip_annotated
+
+# The BSON element types.
+DOUBLE = 0x01
+STRING = 0x02
+DOCUMENT = 0x03
+ARRAY = 0x04
+BINARY = 0x05
+UNDEFINED = 0x06
+OBJECT_ID = 0x07
+BOOLEAN = 0x08
+DATETIME = 0x09
+NULL = 0x0A
+REGEX = 0x0B
+DB_POINTER = 0x0C
+CODE = 0x0D
+SYMBOL = 0x0E
+CODE_WITH_SCOPE = 0x0F
+INT32 = 0x10
+TIMESTAMP = 0x11
+INT64 = 0x12
+DECIMAL128 = 0x13
+MIN_KEY = 0xFF
+MAX_KEY = 0x7F
+
+# The size of the values that do not start with their length.
+FIXED_SIZES = {
+    DOUBLE: 8,
+    UNDEFINED: 0,
+    OBJECT_ID: 12,
+    BOOLEAN: 1,
+    DATETIME: 8,
+    NULL: 0,
+    INT32: 4,
+    TIMESTAMP: 8,
+    INT64: 8,
+    DECIMAL128: 16,
+    MIN_KEY: 0,
+    MAX_KEY: 0,
+}
+
+# The array type codes of the columns stored in `array.array` buffers.
+TYPE_CODES: Dict[Any, str] = {bool: "b", int: "q", float: "d", datetime: "q"}
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+_INT32 = struct.Struct("<i")
+_INT64 = struct.Struct("<q")
+_DOUBLE = struct.Struct("<d")
+
+
+@dataclass
+class ColumnBatch:
+    """
+    A batch of rows returned by `find_columns`.
+
+    Attributes:
+        length: The number of rows.
+        columns: The values of each field, by attribute name. `bool`, `int`
+            and `float` fields are `array.array` buffers of type `b`, `q` and
+            `d`, `datetime` fields are `q` buffers of milliseconds since the
+            Unix epoch, and the other fields are lists.
+        nulls: The null mask of each field, a bytearray holding 1 for the
+            rows where the field is null or missing. These rows hold 0 in the
+            buffers and None in the lists.
+    """
+
+    length: int
+    columns: Dict[str, Union["array.array[Any]", List[Any]]]
+    nulls: Dict[str, bytearray]
+
+    def __len__(self) -> int:
+        return self.length
+
+
+class Column:
+    """
+    Collects the values of one field.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        type_: Any,
+        structure: Callable[[Any, Any], Any],
+        codec_options: "CodecOptions[Any]",
+    ) -> None:
+        self.name = name
+        self.type = type_
+        self.structure = structure
+        self.codec_options = codec_options
+        self.type_code = TYPE_CODES.get(type_)
+        self.values: Union["array.array[Any]", List[Any]] = []
+        self.nulls = bytearray()
+        self.reset()
+
+    def reset(self) -> None:
+        if self.type_code is None:
+            self.values = []
+        else:
+            self.values = array.array(self.type_code)
+        self.nulls = bytearray()
+
+    def append_null(self) -> None:
+        self.values.append(None if self.type_code is None else 0)
+        self.nulls.append(1)
+
+    def append(self, data: bytes, kind: int, start: int, value: int, end: int) -> None:
+        """
+        Appends the element of `data` between `start` and `end`, whose value
+        starts at `value`.
+        """
+        if kind == NULL or kind == UNDEFINED:
+            self.append_null()
+            return
+
+        type_ = self.type
+        values = self.values
+        if type_ is int and kind == INT64:
+            values.append(_INT64.unpack_from(data, value)[0])
+        elif type_ is int and kind == INT32:
+            values.append(_INT32.unpack_from(data, value)[0])
+        elif type_ is float and kind == DOUBLE:
+            values.append(_DOUBLE.unpack_from(data, value)[0])
+        elif type_ is bool and kind == BOOLEAN:
+            values.append(data[value])
+        elif type_ is datetime and kind == DATETIME:
+            values.append(_INT64.unpack_from(data, value)[0])
+        elif type_ is str and kind == STRING:
+            size = _INT32.unpack_from(data, value)[0]
+            values.append(data[value + 4 : value + 3 + size].decode())
+        else:
+            # Other types, and values stored with an unexpected BSON type,
+            # are decoded and structured like `from_document` does.
+            element = data[start:end]
+            document = _INT32.pack(len(element) + 5) + element + b"\x00"
+            decoded = next(iter(decode(document, self.codec_options).values()))
+            structured = self.structure(decoded, type_)
+            if type_ is datetime:
+                structured = _to_milliseconds(structured)
+            values.append(structured)
+        self.nulls.append(0)
+
+
+def _to_milliseconds(value: datetime) -> int:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return (value - EPOCH) // timedelta(milliseconds=1)
+
+
+def make_columns(
+    cls: Any,
+    names: List[str],
+    structure: Callable[[Any, Any], Any],
+    codec_options: "CodecOptions[Any]",
+) -> List[Column]:
+    try:
+        hints = get_type_hints(cls, include_extras=True)
+    except Exception:
+        hints = {}
+    types = {
+        field.name: _strip_annotated(hints.get(field.name, field.type))
+        for field in fields(cls)
+    }
+    columns = []
+    for name in names:
+        type_ = types[name]
+        # Null values are recorded in the mask.
+        type_ = _optional_arg(type_) or type_
+        columns.append(Column(name, type_, structure, codec_options))
+    return columns
+
+
+def value_size(data: bytes, kind: int, value: int) -> int:
+    """
+    Returns the size of the value of an element.
+    """
+    size = FIXED_SIZES.get(kind)
+    if size is not None:
+        return size
+    if kind in (STRING, CODE, SYMBOL):
+        return 4 + cast(int, _INT32.unpack_from(data, value)[0])
+    if kind in (DOCUMENT, ARRAY, CODE_WITH_SCOPE):
+        return cast(int, _INT32.unpack_from(data, value)[0])
+    if kind == BINARY:
+        return 5 + cast(int, _INT32.unpack_from(data, value)[0])
+    if kind == REGEX:
+        pattern_end = data.index(b"\x00", value)
+        return data.index(b"\x00", pattern_end + 1) + 1 - value
+    if kind == DB_POINTER:
+        return 4 + cast(int, _INT32.unpack_from(data, value)[0]) + 12
+    raise ValueError(f"Unknown BSON type {kind:#04x}.")
+
+
+def scan(
+    data: bytes, columns: List[Column], db_fields: List[str]
+) -> ColumnBatch:
+    """
+    Reads the top level fields of the concatenated BSON documents in `data`
+    into the columns.
+    """
+    keys: List[Tuple[bytes, Column]] = [
+        (db_field.encode() + b"\x00", column)
+        for db_field, column in zip(db_fields, columns)
+    ]
+    for column in columns:
+        column.reset()
+
+    rows = 0
+    position = 0
+    total = len(data)
+    while position < total:
+        document_end = position + _INT32.unpack_from(data, position)[0]
+        rows += 1
+        index = position + 4
+        # The terminating null byte of the document.
+        while index < document_end - 1:
+            kind = data[index]
+            target: Optional[Column] = None
+            for key, candidate in keys:
+                if data.startswith(key, index + 1):
+                    target = candidate
+                    value = index + 1 + len(key)
+                    break
+            else:
+                value = data.index(b"\x00", index + 1) + 1
+            end = value + value_size(data, kind, value)
+            if target is not None and len(target.nulls) < rows:
+                target.append(data, kind, index, value, end)
+            index = end
+        for column in columns:
+            if len(column.nulls) < rows:
+                column.append_null()
+        position = document_end
+
+    return ColumnBatch(
+        length=rows,
+        columns={column.name: column.values for column in columns},
+        nulls={column.name: column.nulls for column in columns},
+    )
@@ -0,0 +1,459 @@
+"""
+Specialized unstructure and structure functions for mongoclasses.
+
+The functions are generated per class and call the hooks of nested fields
+directly, so converting an instance does not go through cattrs dispatch. Types
+that are not handled here are converted by the converter of the class, or by a
+BSON converter shared by the classes that do not have one yet.
+"""
+
+from collections import abc
+from dataclasses import MISSING, fields, is_dataclass
+from datetime import datetime
+from enum import Enum
+import functools
+import sys
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+)
+
+from bson import Decimal128, Int64, ObjectId
+import cattrs
+from cattrs.gen import make_dict_structure_fn, override
+from cattrs.preconf import validate_datetime
+from cattrs.preconf.bson import make_converter
+from typing_extensions import Annotated, get_args, get_origin, get_type_hints
+
+if sys.version_info >= (3, 10):
+    from types import UnionType
+
+    _UNION_ORIGINS: Tuple[Any, ...] = (Union, UnionType)
+else:
+    _UNION_ORIGINS = (Union,)
+
+# Types that BSON encodes natively and cattrs passes through when unstructuring.
+_NATIVE_TYPES = (str, int, float, bool, bytes, ObjectId, datetime, Int64, Decimal128)
+
+# Types that cattrs structures by calling the type on the value.
+_CALL_TYPES = (str, int, float, bool, bytes)
+
+_LIST_ORIGINS = (list, abc.Sequence, abc.MutableSequence)
+_SET_ORIGINS = (set, abc.Set, abc.MutableSet)
+_DICT_ORIGINS = (dict, abc.Mapping, abc.MutableMapping)
+
+
+class ClassHooks:
+    """
+    The unstructure and structure functions of a dataclass.
+
+    The functions are generated the first time either one is called, or when
+    `compile` is called.
+    """
+
+    def __init__(
+        self,
+        cls: Type[Any],
+        converter: Optional[cattrs.Converter],
+        db_fields: Dict[str, str],
+        nested: Optional[Dict[Type[Any], "ClassHooks"]] = None,
+        passthrough: FrozenSet[Type[Any]] = frozenset(),
+        lookup: bool = False,
+        owner: Optional["ClassHooks"] = None,
+    ) -> None:
+        self.cls = cls
+        self._converter = converter
+        self.db_fields = db_fields
+        # Hooks of the plain dataclasses nested in the class.
+        self.nested = {} if nested is None else nested
+        # Types that the BSON codecs of the collection encode and decode.
+        self.passthrough = passthrough
+        # Nested mongoclasses are converted with their own hooks, as in the
+        # documents that `$lookup` embeds, rather than stored by attribute.
+        self.lookup = lookup
+        # The hooks whose converter is used, for nested and result classes.
+        self.owner = owner
+        self.slow_structure: Optional[Callable[[Any, Type[Any]], Any]] = None
+
+    @property
+    def converter(self) -> cattrs.Converter:
+        """
+        The converter of the class, on which hooks can be registered. A class
+        that was not given one gets its own BSON converter, created on first
+        use.
+        """
+        if self._converter is None and self.owner is not None:
+            return self.owner.converter
+        if self._converter is None:
+            self.register(make_converter())
+        assert self._converter is not None
+        return self._converter
+
+    @property
+    def fallback(self) -> cattrs.Converter:
+        """
+        The converter of the types that the hooks do not handle: the converter
+        of the class once it has one, and the shared BSON converter until then.
+        """
+        if self._converter is None and self.owner is not None:
+            return self.owner.fallback
+        if self._converter is None and self.passthrough:
+            # The types of the codecs only pass through for this class.
+            self.register(make_converter())
+        if self._converter is None:
+            return _shared_converter()
+        return self._converter
+
+    def register(self, converter: cattrs.Converter) -> None:
+        """
+        Registers the class and the types of the codecs on the converter, and
+        uses it for the types that the hooks do not handle.
+        """
+        if self.passthrough:
+            # The hooks the converter had, for the values that were not
+            # decoded by a codec, such as the ones stored before it was added.
+            fallback = converter.copy()
+            for type_ in self.passthrough:
+                converter.register_unstructure_hook(type_, _pass_through)
+                converter.register_structure_hook(
+                    type_, functools.partial(_structure_decoded, fallback.structure)
+                )
+        converter.register_unstructure_hook(self.cls, self._unstructure_hook)
+        converter.register_structure_hook(self.cls, self._structure_hook)
+        self._converter = converter
+        self.slow_structure = None
+
+    def _unstructure_hook(self, obj: Any) -> Dict[str, Any]:
+        return self.unstructure(obj)
+
+    def _structure_hook(self, data: Any, _: Type[Any]) -> Any:
+        return self.structure(data)
+
+    def unstructure(self, obj: Any) -> Dict[str, Any]:
+        self.compile()
+        return self.unstructure(obj)
+
+    def structure(self, data: Any) -> Any:
+        self.compile()
+        return self.structure(data)
+
+    def trusted_structure(self, data: Any) -> Any:
+        self.compile()
+        return self.trusted_structure(data)
+
+    def compile(self) -> None:
+        compiler = _Compiler(self)
+        # The instance attributes shadow the bootstrap methods above.
+        unstructure = compiler.make_unstructure_fn()
+        structure = compiler.make_structure_fn()
+        trusted = compiler.make_trusted_structure_fn()
+        self.unstructure = unstructure  # type: ignore[method-assign, assignment]
+        self.structure = structure  # type: ignore[method-assign, assignment]
+        self.trusted_structure = trusted  # type: ignore[method-assign, assignment]
+
+    def structure_slowly(self, data: Any) -> Any:
+        """
+        Structures the data with the converter, which raises detailed errors.
+        """
+        if self.slow_structure is None:
+            overrides: Dict[str, Any] = {
+                name: override(rename=db_field)
+                for name, db_field in self.db_fields.items()
+                if name != db_field
+            }
+            self.slow_structure = make_dict_structure_fn(
+                self.cls, self.fallback, **overrides
+            )
+        return self.slow_structure(data, self.cls)
+
+
+@functools.lru_cache(maxsize=None)
+def _shared_converter() -> cattrs.Converter:
+    # No hooks are registered on it, so it converts the same way for every
+    # class.
+    return make_converter()
+
+
+class _Compiler:
+    def __init__(self, hooks: ClassHooks) -> None:
+        self.hooks = hooks
+        self.namespace: Dict[str, Any] = {}
+        self.hooks_name: Optional[str] = None
+        try:
+            hints = get_type_hints(hooks.cls, include_extras=True)
+        except Exception:
+            hints = {}
+        self.types = {
+            field.name: _strip_annotated(hints.get(field.name, field.type))
+            for field in fields(hooks.cls)
+        }
+
+    def bind(self, value: Any) -> str:
+        name = f"__v{len(self.namespace)}"
+        self.namespace[name] = value
+        return name
+
+    def fallback(self) -> str:
+        if self.hooks_name is None:
+            self.hooks_name = self.bind(self.hooks)
+        return f"{self.hooks_name}.fallback"
+
+    def field_types(self) -> List[Tuple[Any, Any]]:
+        return [
+            (field, self.types[field.name])
+            for field in fields(self.hooks.cls)
+            if field.init
+        ]
+
+    def nested_hooks(self, cls: Type[Any]) -> ClassHooks:
+        config = getattr(cls, "__mongoclass_config__", None)
+        if self.hooks.lookup and config is not None:
+            return config.hooks  # type: ignore[no-any-return]
+
+        # Nested dataclasses, mongoclasses included, are stored with their
+        # attribute names, the db_field renames only apply to the top level.
+        nested = self.hooks.nested
+        if cls not in nested:
+            nested[cls] = ClassHooks(
+                cls,
+                None,
+                {field.name: field.name for field in fields(cls)},
+                nested,
+                self.hooks.passthrough,
+                self.hooks.lookup,
+                self.hooks,
+            )
+        return nested[cls]
+
+    def make_unstructure_fn(self) -> Callable[[Any], Dict[str, Any]]:
+        items = [
+            f"{self.hooks.db_fields[field.name]!r}: "
+            + self.unstructure_expr(type_, f"o.{field.name}", 0)
+            for field, type_ in self.field_types()
+        ]
+        lines = ["def unstructure(o):", f"    return {{{', '.join(items)}}}"]
+        return self.build(lines, "unstructure")
+
+    def make_trusted_structure_fn(self) -> Callable[[Any], Any]:
+        """
+        Generates a function that builds instances without calling `__init__`
+        and without coercing BSON native values. If the document is missing a
+        key it falls back to the regular structure function.
+        """
+        cls = self.hooks.cls
+        has_dict = "__dict__" in dir(cls)
+        values = []
+        for field in fields(cls):
+            if field.init:
+                key = repr(self.hooks.db_fields[field.name])
+                type_ = self.types[field.name]
+                value = self.structure_expr(type_, f"d[{key}]", 0, trusted=True)
+            elif field.default is not MISSING:
+                value = self.bind(field.default)
+            elif field.default_factory is not MISSING:
+                value = f"{self.bind(field.default_factory)}()"
+            else:
+                continue
+            values.append((field.name, value))
+
+        lines = ["def trusted_structure(d):", "    try:"]
+        if has_dict:
+            items = ", ".join(f"{name!r}: {value}" for name, value in values)
+            lines.append(f"        __values = {{{items}}}")
+        else:
+            for index, (name, value) in enumerate(values):
+                lines.append(f"        __f{index} = {value}")
+            lines.append("        pass")
+        lines.append("    except Exception:")
+        lines.append(f"        return {self.bind(self.hooks)}.structure(d)")
+        lines.append(f"    o = {self.bind(object.__new__)}({self.bind(cls)})")
+        if has_dict:
+            lines.append("    o.__dict__.update(__values)")
+        else:
+            setattr_ = self.bind(object.__setattr__)
+            for index, (name, _) in enumerate(values):
+                lines.append(f"    {setattr_}(o, {name!r}, __f{index})")
+        lines.append("    return o")
+        return self.build(lines, "trusted_structure")
+
+    def make_structure_fn(self) -> Callable[[Any], Any]:
+        lines = ["def structure(d):", "    try:"]
+        arguments = []
+        for index, (field, type_) in enumerate(self.field_types()):
+            local = f"__f{index}"
+            key = repr(self.hooks.db_fields[field.name])
+            value = self.structure_expr(type_, local, 0)
+            if field.default is MISSING and field.default_factory is MISSING:
+                lines.append(f"        {local} = d[{key}]")
+                lines.append(f"        {local} = {value}")
+            else:
+                if field.default is not MISSING:
+                    default = self.bind(field.default)
+                else:
+                    default = f"{self.bind(field.default_factory)}()"
+                lines.append(f"        if {key} in d:")
+                lines.append(f"            {local} = d[{key}]")
+                lines.append(f"            {local} = {value}")
+                lines.append("        else:")
+                lines.append(f"            {local} = {default}")
+            arguments.append(f"{field.name}={local}")
+
+        # Only the conversion of the values falls back to the slow path, the
+        # errors raised by the constructor propagate.
+        lines.append("        pass")
+        lines.append("    except Exception:")
+        lines.append(f"        return {self.bind(self.hooks.structure_slowly)}(d)")
+        cls = self.bind(self.hooks.cls)
+        lines.append(f"    return {cls}({', '.join(arguments)})")
+        return self.build(lines, "structure")
+
+    def build(self, lines: List[str], name: str) -> Callable[..., Any]:
+        source = "\n".join(lines)
+        filename = f"<mongoclasses {name} {self.hooks.cls.__qualname__}>"
+        exec(compile(source, filename, "exec"), self.namespace)
+        function: Callable[..., Any] = self.namespace.pop(name)
+        function.__qualname__ = f"{name}_{self.hooks.cls.__name__}"
+        return function
+
+    def unstructure_expr(self, type_: Any, expr: str, depth: int) -> str:
+        type_ = _strip_annotated(type_)
+        if type_ is Any or type_ in _NATIVE_TYPES or type_ in self.hooks.passthrough:
+            return expr
+        if _is_enum(type_):
+            return f"{expr}.value"
+        if is_dataclass(type_) and isinstance(type_, type):
+            return f"{self.bind(self.nested_hooks(type_))}.unstructure({expr})"
+
+        origin, args = get_origin(type_), get_args(type_)
+        optional = _optional_arg(type_)
+        if optional is not None:
+            inner = self.unstructure_expr(optional, expr, depth)
+            if inner == expr:
+                return expr
+            return f"(None if {expr} is None else {inner})"
+
+        item = f"__i{depth}"
+        if (
+            (origin in _LIST_ORIGINS or origin in _SET_ORIGINS or origin is frozenset)
+            and len(args) == 1
+        ) or (origin is tuple and len(args) == 2 and args[1] is Ellipsis):
+            inner = self.unstructure_expr(args[0], item, depth + 1)
+            if inner == item:
+                return f"list({expr})"
+            return f"[{inner} for {item} in {expr}]"
+
+        if origin in _DICT_ORIGINS and len(args) == 2 and args[0] is str:
+            key = f"__k{depth}"
+            inner = self.unstructure_expr(args[1], item, depth + 1)
+            if inner == item:
+                return f"dict({expr})"
+            return f"{{{key}: {inner} for {key}, {item} in {expr}.items()}}"
+
+        # The converter is looked up when called, so the converter of the
+        # class and the hooks registered on it apply once there are some.
+        return f"{self.fallback()}.unstructure({expr}, {self.bind(type_)})"
+
+    def structure_expr(
+        self, type_: Any, expr: str, depth: int, trusted: bool = False
+    ) -> str:
+        type_ = _strip_annotated(type_)
+        if type_ is Any or (trusted and type_ in _NATIVE_TYPES):
+            return expr
+        if type_ in self.hooks.passthrough:
+            # Values decoded by the codecs already have the type.
+            bound = self.bind(type_)
+            fallback = f"{self.fallback()}.structure({expr}, {bound})"
+            return f"({expr} if type({expr}) is {bound} else {fallback})"
+        if type_ in _CALL_TYPES:
+            return f"{type_.__name__}({expr})"
+        if type_ is ObjectId:
+            return f"{self.bind(ObjectId)}({expr})"
+        if type_ is datetime:
+            return f"{self.bind(validate_datetime)}({expr}, None)"
+        if _is_enum(type_):
+            return f"{self.bind(type_)}({expr})"
+        if is_dataclass(type_) and isinstance(type_, type):
+            hooks = self.bind(self.nested_hooks(type_))
+            if trusted:
+                return f"{hooks}.trusted_structure({expr})"
+            return f"{hooks}.structure({expr})"
+
+        origin, args = get_origin(type_), get_args(type_)
+        optional = _optional_arg(type_)
+        if optional is not None and trusted and _is_passthrough(optional):
+            return expr
+        if optional is not None and not _is_passthrough(optional):
+            inner = self.structure_expr(optional, expr, depth, trusted)
+            return f"(None if {expr} is None else {inner})"
+
+        item = f"__i{depth}"
+        if origin is tuple and len(args) == 2 and args[1] is Ellipsis:
+            inner = self.structure_expr(args[0], item, depth + 1, trusted)
+            if inner == item:
+                return f"tuple({expr})"
+            return f"tuple([{inner} for {item} in {expr}])"
+        if len(args) == 1 and origin in _LIST_ORIGINS:
+            inner = self.structure_expr(args[0], item, depth + 1, trusted)
+            if trusted and inner == item:
+                return expr
+            return f"[{inner} for {item} in {expr}]"
+        if len(args) == 1 and origin in _SET_ORIGINS:
+            inner = self.structure_expr(args[0], item, depth + 1, trusted)
+            return f"{{{inner} for {item} in {expr}}}"
+        if len(args) == 1 and origin is frozenset:
+            inner = self.structure_expr(args[0], item, depth + 1, trusted)
+            return f"frozenset([{inner} for {item} in {expr}])"
+        if origin in _DICT_ORIGINS and len(args) == 2 and args[0] is str:
+            key = f"__k{depth}"
+            inner = self.structure_expr(args[1], item, depth + 1, trusted)
+            if trusted and inner == item:
+                return expr
+            return f"{{{key}: {inner} for {key}, {item} in {expr}.items()}}"
+
+        return f"{self.fallback()}.structure({expr}, {self.bind(type_)})"
+
+
+def _pass_through(value: Any) -> Any:
+    return value
+
+
+def _structure_decoded(
+    fallback: Callable[[Any, Any], Any], value: Any, type_: Type[Any]
+) -> Any:
+    if type(value) is type_:
+        return value
+    return fallback(value, type_)
+
+
+def _strip_annotated(type_: Any) -> Any:
+    if get_origin(type_) is Annotated:
+        return type_.__origin__
+    return type_
+
+
+def _is_enum(type_: Any) -> bool:
+    return isinstance(type_, type) and issubclass(type_, Enum)
+
+
+def _is_passthrough(type_: Any) -> bool:
+    # cattrs passes unions of BSON native types through unchanged.
+    return type_ in _NATIVE_TYPES
+
+
+def _optional_arg(type_: Any) -> Any:
+    """
+    Returns X if the type is Optional[X], otherwise None.
+    """
+    if get_origin(type_) not in _UNION_ORIGINS:
+        return None
+    args = [arg for arg in get_args(type_) if arg is not type(None)]
+    if len(args) != 1 or len(get_args(type_)) != 2:
+        return None
+    return args[0]
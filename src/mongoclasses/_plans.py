@@ -0,0 +1,239 @@
+"""
+Summarizes the winning plan of an explained query and suggests the index that
+would avoid a collection scan or an in-memory sort.
+"""
+
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+# The stages that read a collection through an index.
+INDEX_STAGES = ("IXSCAN", "IDHACK", "EXPRESS_IXSCAN", "EXPRESS_CLUSTERED_IXSCAN")
+
+# The stages that sort documents in memory.
+SORT_STAGES = ("SORT", "SORT_KEY_GENERATOR")
+
+# The operators after which a field can still be used to sort with an index.
+EQUALITY_OPERATORS = ("$eq", "$in")
+
+
+@dataclass(frozen=True)
+class QueryPlan:
+    """
+    The winning plan of a query.
+
+    Attributes:
+        stages: The names of the stages from the root of the plan to the
+            leaves, e.g. `["LIMIT", "FETCH", "IXSCAN"]`.
+        indexes: The names of the indexes the plan reads.
+        collection_scan: True if the plan reads the whole collection.
+        in_memory_sort: True if the plan sorts the documents in memory.
+        suggestion: If the plan scans the collection or sorts in memory, how
+            to fix it, otherwise None.
+        winning_plan: The winning plan returned by the server.
+    """
+
+    stages: List[str]
+    indexes: List[str]
+    collection_scan: bool
+    in_memory_sort: bool
+    suggestion: Optional[str]
+    winning_plan: Dict[str, Any]
+
+    @property
+    def ok(self) -> bool:
+        return not self.collection_scan and not self.in_memory_sort
+
+
+def walk(plan: Mapping[str, Any]) -> Iterable[Mapping[str, Any]]:
+    """
+    Yields the stages of a plan, depth first.
+    """
+    # Servers using the slot based engine nest the plan one level deeper.
+    plan = plan.get("queryPlan", plan)
+    yield plan
+    if "inputStage" in plan:
+        yield from walk(plan["inputStage"])
+    for stage in plan.get("inputStages", ()):
+        yield from walk(stage)
+
+
+def winning_plan(explanation: Mapping[str, Any]) -> Dict[str, Any]:
+    plan = explanation.get("queryPlanner", {}).get("winningPlan", {})
+    if "shards" in plan:
+        # The plans of a sharded collection are listed per shard.
+        plan = plan["shards"][0].get("winningPlan", {})
+    return dict(plan)
+
+
+def parse_plan(explanation: Mapping[str, Any], suggest: "Suggester") -> QueryPlan:
+    plan = winning_plan(explanation)
+    stages = [stage.get("stage", "") for stage in walk(plan)]
+    indexes = [
+        stage.get("indexName", "_id_")
+        for stage in walk(plan)
+        if stage.get("stage") in INDEX_STAGES
+    ]
+    collection_scan = "COLLSCAN" in stages
+    in_memory_sort = any(stage in SORT_STAGES for stage in stages)
+    suggestion = None
+    if collection_scan or in_memory_sort:
+        suggestion = suggest(collection_scan, in_memory_sort)
+    return QueryPlan(
+        stages=stages,
+        indexes=indexes,
+        collection_scan=collection_scan,
+        in_memory_sort=in_memory_sort,
+        suggestion=suggestion,
+        winning_plan=plan,
+    )
+
+
+class Suggester:
+    """
+    Describes the index a query needs, following the equality, sort, range
+    order, and whether a declared index would serve it.
+    """
+
+    def __init__(
+        self,
+        cls_name: str,
+        collection_name: str,
+        field_names: Mapping[str, str],
+        declared: Sequence[Tuple[str, List[Tuple[str, Any]]]],
+        filter: Optional[Mapping[str, Any]],
+        sort: Optional[Sequence[Tuple[str, Any]]],
+    ) -> None:
+        self.cls_name = cls_name
+        self.collection_name = collection_name
+        # The attribute name of each database field.
+        self.field_names = field_names
+        # The name and keys of each declared index.
+        self.declared = declared
+        self.equality, self.range = split_filter(filter or {})
+        self.sort = [(key, direction) for key, direction in sort or ()]
+
+    def keys(self) -> List[Tuple[str, Any]]:
+        keys: List[Tuple[str, Any]] = [(field, 1) for field in self.equality]
+        keys.extend(key for key in self.sort if key[0] not in self.equality)
+        seen = {field for field, _ in keys}
+        keys.extend((field, 1) for field in self.range if field not in seen)
+        return keys
+
+    def __call__(self, collection_scan: bool, in_memory_sort: bool) -> str:
+        problem = (
+            "scans the whole collection" if collection_scan else "sorts in memory"
+        )
+        keys = self.keys()
+        message = f"The query on {self.collection_name!r} {problem}."
+        if not keys:
+            return message
+
+        for name, declared_keys in self.declared:
+            if declared_keys and declared_keys[0][0] == keys[0][0]:
+                return (
+                    f"{message} The index {name!r} is declared on "
+                    f"{self.cls_name} but the server did not use it, run "
+                    "ensure_indexes() to create it."
+                )
+
+        fields = ", ".join(
+            f"{self.cls_name}.{self.field_names.get(field, field)}"
+            for field, _ in keys
+        )
+        return (
+            f"{message} Declare an index on {fields}, e.g. "
+            f"IndexModel({keys!r})."
+        )
+
+
+def split_filter(filter: Mapping[str, Any]) -> Tuple[List[str], List[str]]:
+    """
+    Returns the fields a filter compares for equality and the other fields it
+    tests, in order.
+    """
+    equality: List[str] = []
+    other: List[str] = []
+    for key, condition in filter.items():
+        if key == "$and":
+            for clause in condition:
+                clause_equality, clause_other = split_filter(clause)
+                equality.extend(clause_equality)
+                other.extend(clause_other)
+        elif key.startswith("$"):
+            continue
+        elif (
+            isinstance(condition, Mapping)
+            and condition
+            and all(operator.startswith("$") for operator in condition)
+        ):
+            if all(operator in EQUALITY_OPERATORS for operator in condition):
+                equality.append(key)
+            else:
+                other.append(key)
+        else:
+            equality.append(key)
+    return (
+        list(dict.fromkeys(equality)),
+        [field for field in dict.fromkeys(other) if field not in equality],
+    )
+
+
+def plan_stages(
+    filter: Optional[Mapping[str, Any]],
+    sort: Optional[Sequence[Tuple[str, Any]]],
+    limit: int,
+    indexes: Sequence[Tuple[str, List[Tuple[str, Any]]]],
+) -> Dict[str, Any]:
+    """
+    Returns the winning plan a server would likely choose, for databases that
+    do not have a query planner.
+    """
+    equality, other = split_filter(filter or {})
+    filtered = equality + other
+    sort_keys = [(key, direction) for key, direction in sort or ()]
+
+    chosen: Optional[Tuple[str, List[Tuple[str, Any]]]] = None
+    for name, keys in indexes:
+        if keys[0][0] in filtered:
+            chosen = (name, keys)
+            break
+    if chosen is None and sort_keys:
+        for name, keys in indexes:
+            if _sorts(keys, [], sort_keys):
+                chosen = (name, keys)
+                break
+
+    stage: Dict[str, Any]
+    if chosen is None:
+        stage = {"stage": "COLLSCAN", "direction": "forward"}
+    else:
+        stage = {
+            "stage": "FETCH",
+            "inputStage": {
+                "stage": "IXSCAN",
+                "indexName": chosen[0],
+                "keyPattern": dict(chosen[1]),
+            },
+        }
+    if sort_keys and (chosen is None or not _sorts(chosen[1], equality, sort_keys)):
+        stage = {"stage": "SORT", "sortPattern": dict(sort_keys), "inputStage": stage}
+    if limit:
+        stage = {"stage": "LIMIT", "limitAmount": abs(limit), "inputStage": stage}
+    return stage
+
+
+def _sorts(
+    index: List[Tuple[str, Any]], equality: List[str], sort: List[Tuple[str, Any]]
+) -> bool:
+    """
+    Returns True if reading the index returns documents in the sort order.
+    """
+    keys = list(index)
+    while keys and keys[0][0] in equality and keys[0][0] not in dict(sort):
+        keys.pop(0)
+    prefix = keys[: len(sort)]
+    if [field for field, _ in prefix] != [field for field, _ in sort]:
+        return False
+    same = all(a == b for (_, a), (_, b) in zip(prefix, sort))
+    reverse = all(a == -b for (_, a), (_, b) in zip(prefix, sort))
+    return same or reverse
@@ -0,0 +1,1878 @@
+"""
+In-memory databases that stand in for pymongo and Motor databases.
+
+`MemoryDatabase` and `AsyncMemoryDatabase` can be passed as `db=` to
+`mongoclass` to run without a MongoDB server, for example in unit tests and
+benchmarks. They implement the subset of the collection API that mongoclasses
+uses. Queries support equality and the common comparison, element, array and
+logical operators. Updates support the common field and array operators.
+Unique indexes are enforced. Aggregations support the `$match`, `$sort`,
+`$skip`, `$limit`, `$project`, `$unwind`, `$lookup`, `$addFields` and `$count`
+stages. Change streams report inserts, updates, replaces, deletes and drops,
+and can be resumed while the change is among the last `CHANGE_LOG_SIZE`.
+
+Documents are stored as BSON and decoded on every read, so the instances
+returned never share state with the stored documents.
+"""
+
+import asyncio
+from collections import OrderedDict, deque
+import datetime
+from decimal import Decimal
+import re
+import threading
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Hashable,
+    Iterator,
+    List,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+    cast,
+)
+
+from bson import Decimal128, Int64, ObjectId, decode, encode
+from bson.codec_options import DEFAULT_CODEC_OPTIONS, CodecOptions
+from bson.raw_bson import RawBSONDocument
+from bson.regex import Regex
+from pymongo import DeleteOne, InsertOne, ReplaceOne, UpdateOne
+from pymongo.errors import (
+    BulkWriteError,
+    DuplicateKeyError,
+    OperationFailure,
+    WriteError,
+)
+from pymongo.operations import IndexModel
+from pymongo.results import (
+    BulkWriteResult,
+    DeleteResult,
+    InsertManyResult,
+    InsertOneResult,
+    UpdateResult,
+)
+
+from ._plans import plan_stages
+
+__all__ = [
+    "MemoryClient",
+    "MemoryDatabase",
+    "MemoryCollection",
+    "MemoryCursor",
+    "AsyncMemoryClient",
+    "AsyncMemoryDatabase",
+    "AsyncMemoryCollection",
+    "AsyncMemoryCursor",
+    "MemoryChangeStream",
+    "AsyncMemoryChangeStream",
+]
+
+# The number of changes of a collection kept to resume change streams.
+CHANGE_LOG_SIZE = 10_000
+
+# The type registry of collections without type codecs.
+_NO_CODECS = DEFAULT_CODEC_OPTIONS.type_registry
+
+# The limits reported by the `hello` command of a MongoDB server.
+HELLO = {
+    "isWritablePrimary": True,
+    "maxBsonObjectSize": 16 * 1024 * 1024,
+    "maxMessageSizeBytes": 48000000,
+    "maxWriteBatchSize": 100000,
+    "ok": 1.0,
+}
+
+_MISSING: Any = object()
+
+
+# Values
+
+
+def _rank(value: Any) -> int:
+    """
+    Returns the position of the type of a value in the BSON comparison order.
+    """
+    if value is _MISSING or value is None:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float, Decimal128)):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, Mapping):
+        return 4
+    if isinstance(value, (list, tuple)):
+        return 5
+    if isinstance(value, bytes):
+        return 6
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, datetime.datetime):
+        return 9
+    return 10
+
+
+def _number(value: Any) -> Any:
+    if isinstance(value, Decimal128):
+        return value.to_decimal()
+    if isinstance(value, Decimal):
+        return value
+    return value
+
+
+def _sort_key(value: Any) -> Any:
+    rank = _rank(value)
+    if rank == 1:
+        return (rank, 0)
+    if rank == 2:
+        return (rank, _number(value))
+    if rank == 4:
+        return (rank, tuple((k, _sort_key(v)) for k, v in value.items()))
+    if rank == 5:
+        return (rank, tuple(_sort_key(v) for v in value))
+    if rank == 9 and value.tzinfo is not None:
+        return (rank, value.replace(tzinfo=None) - value.utcoffset())
+    if rank == 10:
+        return (rank, repr(value))
+    return (rank, value)
+
+
+def _equal(a: Any, b: Any) -> bool:
+    return bool(_sort_key(a) == _sort_key(b))
+
+
+def _index_value(value: Any) -> Hashable:
+    """
+    Returns a hashable value that is equal for values MongoDB considers equal.
+    """
+    key = _sort_key(value)
+    try:
+        hash(key)
+    except TypeError:
+        return (key[0], repr(key))
+    return cast(Hashable, key)
+
+
+# Paths
+
+
+def _lookup(document: Any, path: str) -> Any:
+    """
+    Returns the value at a dotted path, without traversing arrays of
+    documents, or _MISSING.
+    """
+    value = document
+    for part in path.split("."):
+        if isinstance(value, Mapping):
+            value = value.get(part, _MISSING)
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return _MISSING
+        if value is _MISSING:
+            return _MISSING
+    return value
+
+
+def _resolve(value: Any, parts: Sequence[str]) -> List[Any]:
+    """
+    Returns the values at a path, traversing arrays of documents the way
+    MongoDB queries do.
+    """
+    if not parts:
+        return [value]
+
+    head, rest = parts[0], parts[1:]
+    if isinstance(value, Mapping):
+        return _resolve(value[head], rest) if head in value else [_MISSING]
+
+    if isinstance(value, list):
+        values = []
+        if head.isdigit() and int(head) < len(value):
+            values.extend(_resolve(value[int(head)], rest))
+        for item in value:
+            if isinstance(item, Mapping) and head in item:
+                values.extend(_resolve(item[head], rest))
+        return values or [_MISSING]
+
+    return [_MISSING]
+
+
+def _set_path(document: MutableMapping[str, Any], path: str, value: Any) -> None:
+    parts = path.split(".")
+    target: Any = document
+    for part in parts[:-1]:
+        if isinstance(target, list):
+            index = _array_index(target, part, path)
+            if target[index] is None:
+                target[index] = {}
+            target = target[index]
+        elif isinstance(target, MutableMapping):
+            target = target.setdefault(part, {})
+        else:
+            break
+        if not isinstance(target, (MutableMapping, list)):
+            raise WriteError(
+                f"Cannot create field {part!r} in element of path {path!r}", 28, {}
+            )
+
+    last = parts[-1]
+    if isinstance(target, list):
+        target[_array_index(target, last, path)] = value
+    else:
+        target[last] = value
+
+
+def _array_index(array: List[Any], part: str, path: str) -> int:
+    if not part.isdigit():
+        raise WriteError(f"Cannot create field {part!r} in path {path!r}", 28, {})
+    index = int(part)
+    array.extend([None] * (index + 1 - len(array)))
+    return index
+
+
+def _unset_path(document: MutableMapping[str, Any], path: str) -> None:
+    parent_path, _, last = path.rpartition(".")
+    parent = _lookup(document, parent_path) if parent_path else document
+    if isinstance(parent, MutableMapping):
+        parent.pop(last, None)
+    elif isinstance(parent, list) and last.isdigit() and int(last) < len(parent):
+        parent[int(last)] = None
+
+
+# Queries
+
+
+def _match(document: Mapping[str, Any], filter: Optional[Mapping[str, Any]]) -> bool:
+    if not filter:
+        return True
+
+    for key, condition in filter.items():
+        if key == "$and":
+            if not all(_match(document, f) for f in condition):
+                return False
+        elif key == "$or":
+            if not any(_match(document, f) for f in condition):
+                return False
+        elif key == "$nor":
+            if any(_match(document, f) for f in condition):
+                return False
+        elif key.startswith("$"):
+            raise OperationFailure(f"unknown top level operator: {key}", 2)
+        elif not _match_values(_resolve(document, key.split(".")), condition):
+            return False
+    return True
+
+
+def _is_operator_document(condition: Any) -> bool:
+    return (
+        isinstance(condition, Mapping)
+        and bool(condition)
+        and all(key.startswith("$") for key in condition)
+    )
+
+
+def _expand(values: List[Any]) -> Iterator[Any]:
+    """
+    Yields the values and the elements of the values that are arrays.
+    """
+    for value in values:
+        yield value
+        if isinstance(value, list):
+            yield from value
+
+
+def _match_values(values: List[Any], condition: Any) -> bool:
+    if not _is_operator_document(condition):
+        return _match_equal(values, condition)
+
+    options = condition.get("$options", "")
+    for operator, argument in condition.items():
+        if operator == "$options":
+            continue
+        if not _match_operator(values, operator, argument, options):
+            return False
+    return True
+
+
+def _match_equal(values: List[Any], argument: Any) -> bool:
+    if isinstance(argument, (Regex, re.Pattern)):
+        return _match_regex(values, argument, "")
+    if argument is None:
+        return any(value is _MISSING or value is None for value in _expand(values))
+    return any(_equal(value, argument) for value in _expand(values))
+
+
+def _match_regex(values: List[Any], pattern: Any, options: str) -> bool:
+    if isinstance(pattern, Regex):
+        pattern = pattern.try_compile()
+    if not isinstance(pattern, re.Pattern):
+        flags = 0
+        for option, flag in (("i", re.I), ("m", re.M), ("s", re.S), ("x", re.X)):
+            if option in options:
+                flags |= flag
+        pattern = re.compile(pattern, flags)
+    return any(
+        isinstance(value, str) and pattern.search(value) is not None
+        for value in _expand(values)
+    )
+
+
+def _compare(values: List[Any], argument: Any, test: Callable[[Any, Any], bool]) -> bool:
+    rank = _rank(argument)
+    key = _sort_key(argument)
+    return any(
+        _rank(value) == rank and value is not _MISSING and test(_sort_key(value), key)
+        for value in _expand(values)
+    )
+
+
+def _match_operator(
+    values: List[Any], operator: str, argument: Any, options: str
+) -> bool:
+    if operator == "$eq":
+        return _match_equal(values, argument)
+    if operator == "$ne":
+        return not _match_equal(values, argument)
+    if operator == "$gt":
+        return _compare(values, argument, lambda a, b: a > b)
+    if operator == "$gte":
+        return _compare(values, argument, lambda a, b: a >= b)
+    if operator == "$lt":
+        return _compare(values, argument, lambda a, b: a < b)
+    if operator == "$lte":
+        return _compare(values, argument, lambda a, b: a <= b)
+    if operator == "$in":
+        return any(_match_equal(values, item) for item in argument)
+    if operator == "$nin":
+        return not any(_match_equal(values, item) for item in argument)
+    if operator == "$exists":
+        return any(value is not _MISSING for value in values) == bool(argument)
+    if operator == "$not":
+        return not _match_values(values, argument)
+    if operator == "$regex":
+        return _match_regex(values, argument, options)
+    if operator == "$size":
+        return any(
+            isinstance(value, list) and len(value) == argument for value in values
+        )
+    if operator == "$all":
+        return all(_match_equal(values, item) for item in argument)
+    if operator == "$elemMatch":
+        for value in values:
+            if not isinstance(value, list):
+                continue
+            for item in value:
+                if _is_operator_document(argument):
+                    if _match_values([item], argument):
+                        return True
+                elif isinstance(item, Mapping) and _match(item, argument):
+                    return True
+        return False
+    raise OperationFailure(f"unknown operator: {operator}", 2)
+
+
+def _project(
+    document: Mapping[str, Any], projection: Optional[Mapping[str, Any]]
+) -> Dict[str, Any]:
+    if not projection:
+        return dict(document)
+
+    fields = {key: value for key, value in projection.items() if key != "_id"}
+    include_id = bool(projection.get("_id", True))
+    if any(fields.values()) or (not fields and include_id):
+        result: Dict[str, Any] = {}
+        if include_id and "_id" in document:
+            result["_id"] = document["_id"]
+        for path in fields:
+            value = _lookup(document, path)
+            if value is not _MISSING:
+                _set_path(result, path, value)
+        return result
+
+    result = decode(encode(document))
+    if not include_id:
+        result.pop("_id", None)
+    for path in fields:
+        _unset_path(result, path)
+    return result
+
+
+def _sort(
+    documents: List[Dict[str, Any]], sort: Optional[Sequence[Tuple[str, int]]]
+) -> List[Dict[str, Any]]:
+    if isinstance(sort, Mapping):
+        sort = list(sort.items())
+    for key, direction in reversed(list(sort or [])):
+        documents.sort(
+            key=lambda document: _sort_key(_lookup(document, key)),
+            reverse=direction == -1,
+        )
+    return documents
+
+
+# Updates
+
+
+def _apply_update(
+    document: Dict[str, Any], update: Mapping[str, Any], inserting: bool
+) -> None:
+    if not isinstance(update, Mapping):
+        raise OperationFailure("Update pipelines are not supported.", 2)
+
+    for operator, fields in update.items():
+        if operator == "$setOnInsert" and not inserting:
+            continue
+        for path, argument in fields.items():
+            _apply_operator(document, operator, path, argument)
+
+
+def _apply_operator(
+    document: Dict[str, Any], operator: str, path: str, argument: Any
+) -> None:
+    current = _lookup(document, path)
+    if operator in ("$set", "$setOnInsert"):
+        _set_path(document, path, argument)
+    elif operator == "$unset":
+        _unset_path(document, path)
+    elif operator in ("$inc", "$mul"):
+        if current is not _MISSING and _rank(current) != 2:
+            raise WriteError(f"Cannot apply {operator} to a non-numeric value", 14, {})
+        if current is _MISSING:
+            current = 0
+        if isinstance(current, Decimal128) or isinstance(argument, Decimal128):
+            a, b = _number(current), _number(argument)
+            result: Any = Decimal128(a + b if operator == "$inc" else a * b)
+        else:
+            result = current + argument if operator == "$inc" else current * argument
+        _set_path(document, path, result)
+    elif operator in ("$min", "$max"):
+        if current is _MISSING:
+            _set_path(document, path, argument)
+        else:
+            lower = _sort_key(argument) < _sort_key(current)
+            if lower == (operator == "$min") and not _equal(argument, current):
+                _set_path(document, path, argument)
+    elif operator == "$rename":
+        if current is not _MISSING:
+            _unset_path(document, path)
+            _set_path(document, argument, current)
+    elif operator == "$currentDate":
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        _set_path(document, path, now)
+    elif operator in ("$push", "$addToSet"):
+        array = _array_at(document, path, current, operator)
+        items = argument["$each"] if _is_each(argument) else [argument]
+        for item in items:
+            if operator == "$push" or not any(_equal(item, v) for v in array):
+                array.append(item)
+    elif operator == "$pull":
+        array = _array_at(document, path, current, operator)
+        if _is_operator_document(argument):
+            array[:] = [item for item in array if not _match_values([item], argument)]
+        elif isinstance(argument, Mapping):
+            array[:] = [
+                item
+                for item in array
+                if not (isinstance(item, Mapping) and _match(item, argument))
+            ]
+        else:
+            array[:] = [item for item in array if not _equal(item, argument)]
+    elif operator == "$pullAll":
+        array = _array_at(document, path, current, operator)
+        array[:] = [item for item in array if not any(_equal(item, v) for v in argument)]
+    elif operator == "$pop":
+        array = _array_at(document, path, current, operator)
+        if array:
+            array.pop(0 if argument == -1 else -1)
+    else:
+        raise WriteError(f"Unknown modifier: {operator}", 9, {})
+
+
+def _is_each(argument: Any) -> bool:
+    return isinstance(argument, Mapping) and "$each" in argument
+
+
+def _array_at(
+    document: Dict[str, Any], path: str, current: Any, operator: str
+) -> List[Any]:
+    if current is _MISSING:
+        current = []
+        _set_path(document, path, current)
+    if not isinstance(current, list):
+        raise WriteError(f"Cannot apply {operator} to a non-array value", 2, {})
+    return current
+
+
+def _upsert_document(filter: Optional[Mapping[str, Any]]) -> Dict[str, Any]:
+    """
+    Returns the document an upsert starts from: the equality conditions of the
+    filter.
+    """
+    document: Dict[str, Any] = {}
+    for key, condition in (filter or {}).items():
+        if key.startswith("$"):
+            continue
+        if _is_operator_document(condition):
+            if "$eq" not in condition:
+                continue
+            condition = condition["$eq"]
+        _set_path(document, key, condition)
+    return document
+
+
+# Storage
+
+
+class _Index:
+    def __init__(self, document: Mapping[str, Any]) -> None:
+        self.name: str = document["name"]
+        self.keys: List[Tuple[str, Any]] = list(document["key"].items())
+        self.unique: bool = bool(document.get("unique", False))
+        self.sparse: bool = bool(document.get("sparse", False))
+        self.partial: Optional[Mapping[str, Any]] = document.get(
+            "partialFilterExpression"
+        )
+        self.document = dict(document)
+        self.entries: Dict[Hashable, Hashable] = {}
+
+    def key(self, document: Mapping[str, Any]) -> Optional[Hashable]:
+        """
+        Returns the index key of a document or None if it is not indexed.
+        """
+        values = [_lookup(document, path) for path, _ in self.keys]
+        if self.sparse and all(value is _MISSING for value in values):
+            return None
+        if self.partial is not None and not _match(document, self.partial):
+            return None
+        return tuple(
+            _index_value(None if value is _MISSING else value) for value in values
+        )
+
+
+class _Store:
+    """
+    The documents and indexes of a collection.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.RLock()
+        self.documents: "OrderedDict[Hashable, Tuple[Dict[str, Any], bytes]]" = (
+            OrderedDict()
+        )
+        self.indexes: Dict[str, _Index] = {}
+        self.add_index({"key": {"_id": 1}, "name": "_id_", "unique": True})
+        # The recent changes, recorded once the collection is first watched.
+        self.changes: Optional[Deque[Dict[str, Any]]] = None
+        self.change_count = 0
+        self.changed = threading.Condition(self.lock)
+        self.dropped = False
+
+    def add_index(self, document: Mapping[str, Any]) -> str:
+        index = _Index(document)
+        existing = self.indexes.get(index.name)
+        if existing is not None:
+            if existing.keys != index.keys or existing.unique != index.unique:
+                raise OperationFailure(
+                    f"An index with name {index.name!r} already exists with "
+                    "different options",
+                    85,
+                )
+            return index.name
+
+        for id_key, (stored, _) in self.documents.items():
+            key = index.key(stored)
+            if key is None:
+                continue
+            if index.unique and key in index.entries:
+                raise OperationFailure(
+                    f"E11000 duplicate key error, index: {index.name}", 11000
+                )
+            index.entries[key] = id_key
+        self.indexes[index.name] = index
+        return index.name
+
+    def write(
+        self,
+        document: Dict[str, Any],
+        previous: Optional[Dict[str, Any]] = None,
+        update: bool = False,
+    ) -> None:
+        """
+        Stores a new or changed document after checking the unique indexes.
+
+        `update` tells change streams whether a changed document was updated
+        or replaced.
+        """
+        id_key = _index_value(document["_id"])
+        if previous is not None and _index_value(previous["_id"]) != id_key:
+            raise WriteError(
+                "Performing an update on the path '_id' would modify the "
+                "immutable field '_id'",
+                66,
+                {},
+            )
+
+        data = encode(document)
+        keys = {}
+        for index in self.indexes.values():
+            key = index.key(document)
+            owner = None if key is None else index.entries.get(key)
+            if index.unique and owner is not None and (
+                previous is None or owner != id_key
+            ):
+                message = (
+                    f"E11000 duplicate key error index: {index.name} "
+                    f"dup key: {index.document['key']}"
+                )
+                raise DuplicateKeyError(
+                    message, 11000, {"errmsg": message, "code": 11000}
+                )
+            keys[index.name] = key
+
+        for index in self.indexes.values():
+            if previous is not None:
+                old = index.key(previous)
+                if old is not None and index.entries.get(old) == id_key:
+                    del index.entries[old]
+            if keys[index.name] is not None:
+                index.entries[keys[index.name]] = id_key
+        self.documents[id_key] = (decode(data), data)
+
+        if self.changes is not None:
+            if previous is None:
+                self.record("insert", document["_id"], data)
+            elif update:
+                self.record(
+                    "update", document["_id"], None, _describe_update(previous, document)
+                )
+            else:
+                self.record("replace", document["_id"], data)
+
+    def delete(self, document: Mapping[str, Any]) -> None:
+        id_key = _index_value(document["_id"])
+        for index in self.indexes.values():
+            key = index.key(document)
+            if key is not None and index.entries.get(key) == id_key:
+                del index.entries[key]
+        del self.documents[id_key]
+        if self.changes is not None:
+            self.record("delete", document["_id"])
+
+    def watch(self) -> int:
+        """
+        Starts recording changes and returns the position of the next one.
+        """
+        if self.changes is None:
+            self.changes = deque(maxlen=CHANGE_LOG_SIZE)
+        return self.change_count
+
+    def record(
+        self,
+        operation: str,
+        id: Any = _MISSING,
+        document: Optional[bytes] = None,
+        update: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        assert self.changes is not None
+        change: Dict[str, Any] = {"operationType": operation}
+        if id is not _MISSING:
+            change["documentKey"] = {"_id": id}
+        if document is not None:
+            change["fullDocument"] = document
+        if update is not None:
+            change["updateDescription"] = update
+        self.changes.append(change)
+        self.change_count += 1
+        self.changed.notify_all()
+
+    def drop(self) -> None:
+        with self.lock:
+            self.dropped = True
+            if self.changes is not None:
+                self.record("drop")
+                self.record("invalidate")
+
+    def find(
+        self, filter: Optional[Mapping[str, Any]], limit: int = 0
+    ) -> List[Dict[str, Any]]:
+        """
+        Returns the stored documents that match the filter, in natural order.
+        """
+        id = (filter or {}).get("_id", _MISSING)
+        if (
+            id is not _MISSING
+            and not _is_operator_document(id)
+            and not isinstance(id, (Regex, re.Pattern))
+        ):
+            entry = self.documents.get(_index_value(id))
+            candidates = [] if entry is None else [entry[0]]
+        else:
+            candidates = [document for document, _ in self.documents.values()]
+
+        matches = []
+        for document in candidates:
+            if _match(document, filter):
+                matches.append(document)
+                if len(matches) == limit:
+                    break
+        return matches
+
+
+def _describe_update(
+    previous: Mapping[str, Any], document: Mapping[str, Any]
+) -> Dict[str, Any]:
+    """
+    Returns the `updateDescription` of a change stream event, comparing the
+    top level fields.
+    """
+    updated = {
+        key: value
+        for key, value in document.items()
+        if key not in previous or encode({"": value}) != encode({"": previous[key]})
+    }
+    removed = [key for key in previous if key not in document]
+    return {"updatedFields": updated, "removedFields": removed, "truncatedArrays": []}
+
+
+# Aggregation
+
+
+def _aggregate(
+    collection: "MemoryCollection",
+    pipeline: Sequence[Mapping[str, Any]],
+    documents: Optional[List[Dict[str, Any]]] = None,
+) -> List[Dict[str, Any]]:
+    if documents is None:
+        documents = _read_all(collection)
+    for stage in pipeline:
+        if len(stage) != 1:
+            raise OperationFailure(
+                "A pipeline stage specification object must contain exactly "
+                "one field.",
+                40323,
+            )
+        name, argument = next(iter(stage.items()))
+        if name == "$match":
+            documents = [document for document in documents if _match(document, argument)]
+        elif name == "$sort":
+            documents = _sort(documents, list(argument.items()))
+        elif name == "$skip":
+            documents = documents[argument:]
+        elif name == "$limit":
+            documents = documents[:argument]
+        elif name == "$project":
+            documents = [_project(document, argument) for document in documents]
+        elif name == "$unwind":
+            documents = list(_unwind(documents, argument))
+        elif name == "$lookup":
+            documents = _join(collection, documents, argument)
+        elif name in ("$addFields", "$set"):
+            for document in documents:
+                for path, expression in argument.items():
+                    _set_path(document, path, _evaluate(document, expression))
+        elif name == "$count":
+            documents = [{argument: len(documents)}] if documents else []
+        else:
+            raise OperationFailure(
+                f"Unrecognized pipeline stage name: '{name}'", 40324
+            )
+    return documents
+
+
+def _read_all(collection: "MemoryCollection") -> List[Dict[str, Any]]:
+    """
+    Returns copies of the stored documents, in natural order.
+    """
+    with collection._store.lock:
+        data = [raw for _, raw in collection._store.documents.values()]
+    return [decode(raw) for raw in data]
+
+
+def _evaluate(document: Mapping[str, Any], expression: Any) -> Any:
+    """
+    Returns the value of a field path such as `"$name"` or a literal.
+    """
+    if isinstance(expression, str) and expression.startswith("$"):
+        value = _lookup(document, expression[1:])
+        return None if value is _MISSING else value
+    if isinstance(expression, Mapping) and "$literal" in expression:
+        return expression["$literal"]
+    return expression
+
+
+def _unwind(
+    documents: List[Dict[str, Any]], argument: Union[str, Mapping[str, Any]]
+) -> Iterator[Dict[str, Any]]:
+    if isinstance(argument, str):
+        argument = {"path": argument}
+    path = argument["path"][1:]
+    preserve = argument.get("preserveNullAndEmptyArrays", False)
+    for document in documents:
+        value = _lookup(document, path)
+        if isinstance(value, list) and value:
+            for item in value:
+                unwound = decode(encode(document))
+                _set_path(unwound, path, item)
+                yield unwound
+        elif isinstance(value, list) or value is _MISSING or value is None:
+            if preserve:
+                if isinstance(value, list):
+                    _unset_path(document, path)
+                yield document
+        else:
+            yield document
+
+
+def _join(
+    collection: "MemoryCollection",
+    documents: List[Dict[str, Any]],
+    argument: Mapping[str, Any],
+) -> List[Dict[str, Any]]:
+    if "pipeline" in argument:
+        raise OperationFailure("$lookup with a pipeline is not supported", 2)
+    foreign = _read_all(collection.database[argument["from"]])
+    for document in documents:
+        values = _resolve(document, argument["localField"].split("."))
+        keys = [None if value is _MISSING else value for value in _expand(values)]
+        _set_path(
+            document,
+            argument["as"],
+            [
+                other
+                for other in foreign
+                if _match(other, {argument["foreignField"]: {"$in": keys}})
+            ],
+        )
+    return documents
+
+
+# Synchronous API
+
+
+class MemoryCursor:
+    """
+    A cursor over the documents of a `MemoryCollection`.
+
+    The documents are selected when the cursor is first iterated.
+    """
+
+    def __init__(
+        self,
+        collection: "MemoryCollection",
+        filter: Optional[Mapping[str, Any]] = None,
+        projection: Optional[Mapping[str, Any]] = None,
+        skip: int = 0,
+        limit: int = 0,
+        sort: Optional[Sequence[Tuple[str, int]]] = None,
+        batch_size: int = 0,
+    ) -> None:
+        self.collection = collection
+        self._filter = filter
+        self._projection = projection
+        self._skip = skip
+        self._limit = limit
+        self._sort = sort
+        self._batch_size = batch_size
+        self._documents: Optional[Iterator[bytes]] = None
+        self.alive = True
+
+    def _check(self) -> None:
+        if self._documents is not None:
+            from pymongo.errors import InvalidOperation
+
+            raise InvalidOperation("cannot set options after executing query")
+
+    def sort(self, key_or_list: Any, direction: int = 1) -> "MemoryCursor":
+        self._check()
+        if isinstance(key_or_list, str):
+            key_or_list = [(key_or_list, direction)]
+        self._sort = key_or_list
+        return self
+
+    def skip(self, skip: int) -> "MemoryCursor":
+        self._check()
+        self._skip = skip
+        return self
+
+    def limit(self, limit: int) -> "MemoryCursor":
+        self._check()
+        self._limit = limit
+        return self
+
+    def batch_size(self, batch_size: int) -> "MemoryCursor":
+        self._batch_size = batch_size
+        return self
+
+    def explain(self) -> Dict[str, Any]:
+        """
+        Returns the plan a MongoDB server would likely choose for the query,
+        given the indexes of the collection.
+        """
+        sort = self._sort
+        if isinstance(sort, Mapping):
+            sort = list(sort.items())
+        with self.collection._store.lock:
+            indexes = [
+                (index.name, index.keys)
+                for index in self.collection._store.indexes.values()
+            ]
+        plan = plan_stages(self._filter, sort, self._limit, indexes)
+        return {"queryPlanner": {"winningPlan": plan}, "ok": 1.0}
+
+    def _execute(self) -> Iterator[bytes]:
+        with self.collection._store.lock:
+            documents = self.collection._store.find(self._filter)
+            documents = _sort(list(documents), self._sort)[self._skip :]
+            if self._limit:
+                documents = documents[: abs(self._limit)]
+            return iter(
+                [encode(_project(document, self._projection)) for document in documents]
+            )
+
+    def __iter__(self) -> "MemoryCursor":
+        return self
+
+    def __next__(self) -> Any:
+        if self._documents is None:
+            self._documents = self._execute()
+        try:
+            data = next(self._documents)
+        except StopIteration:
+            self.alive = False
+            raise
+        return decode(data, self.collection.codec_options)
+
+    next = __next__
+
+    def to_list(self, length: Optional[int] = None) -> List[Any]:
+        documents = []
+        for document in self:
+            documents.append(document)
+            if length is not None and len(documents) >= length:
+                break
+        return documents
+
+    def close(self) -> None:
+        self._documents = iter(())
+        self.alive = False
+
+    def __enter__(self) -> "MemoryCursor":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+class MemoryRawBatchCursor(MemoryCursor):
+    """
+    A cursor that returns the documents as batches of concatenated BSON.
+    """
+
+    def __next__(self) -> bytes:
+        if self._documents is None:
+            self._documents = self._execute()
+        batch = []
+        for data in self._documents:
+            batch.append(data)
+            if len(batch) == (self._batch_size or 101):
+                break
+        if not batch:
+            self.alive = False
+            raise StopIteration
+        return b"".join(batch)
+
+    next = __next__
+
+
+class MemoryCollection:
+    """
+    An in-memory collection with the interface of a pymongo `Collection`.
+    """
+
+    def __init__(
+        self,
+        database: "MemoryDatabase",
+        name: str,
+        codec_options: Optional["CodecOptions[Any]"] = None,
+        _store: Optional[_Store] = None,
+    ) -> None:
+        self.database = database
+        self.name = name
+        self.full_name = f"{database.name}.{name}"
+        self.codec_options: "CodecOptions[Any]" = (
+            codec_options or database.codec_options
+        )
+        self._current = _Store() if _store is None else _store
+
+    @property
+    def _store(self) -> _Store:
+        """
+        The store of the collection, which is replaced once it is dropped.
+        """
+        if self._current.dropped:
+            self._current = self.database[self.name]._current
+        return self._current
+
+    def __getitem__(self, name: str) -> "MemoryCollection":
+        return self.database[f"{self.name}.{name}"]
+
+    def __getattr__(self, name: str) -> "MemoryCollection":
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, MemoryCollection):
+            return self.database == other.database and self.name == other.name
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash((self.database, self.name))
+
+    def __repr__(self) -> str:
+        return f"MemoryCollection({self.database!r}, {self.name!r})"
+
+    def with_options(
+        self, codec_options: Optional["CodecOptions[Any]"] = None, **kwargs: Any
+    ) -> "MemoryCollection":
+        return MemoryCollection(
+            self.database,
+            self.name,
+            codec_options or self.codec_options,
+            _store=self._store,
+        )
+
+    def _decode(self, document: Mapping[str, Any]) -> Any:
+        return decode(encode(document), self.codec_options)
+
+    def _prepare(self, document: Any) -> Dict[str, Any]:
+        if isinstance(document, RawBSONDocument):
+            return decode(document.raw)
+        return decode(encode(document, codec_options=self.codec_options))
+
+    def _encode_values(self, document: Any) -> Any:
+        """
+        Converts the values of a filter or update that the type codecs of the
+        collection encode, the way the server would receive them.
+        """
+        if document is None or self.codec_options.type_registry == _NO_CODECS:
+            return document
+        return decode(encode(document, codec_options=self.codec_options))
+
+    # Writes
+
+    def insert_one(self, document: Any, **kwargs: Any) -> InsertOneResult:
+        prepared = self._prepare(document)
+        if "_id" not in prepared:
+            prepared = {"_id": ObjectId(), **prepared}
+            if isinstance(document, MutableMapping):
+                document["_id"] = prepared["_id"]
+        with self._store.lock:
+            self._store.write(prepared)
+        if isinstance(document, Mapping) and "_id" in document:
+            # The id as given, before the type codecs encoded it.
+            return InsertOneResult(document["_id"], True)
+        return InsertOneResult(prepared["_id"], True)
+
+    def insert_many(
+        self, documents: Any, ordered: bool = True, **kwargs: Any
+    ) -> InsertManyResult:
+        inserted_ids: List[Any] = []
+        self._bulk_write(
+            [InsertOne(document) for document in documents], ordered, inserted_ids
+        )
+        return InsertManyResult(inserted_ids, True)
+
+    def replace_one(
+        self,
+        filter: Mapping[str, Any],
+        replacement: Any,
+        upsert: bool = False,
+        **kwargs: Any,
+    ) -> UpdateResult:
+        return UpdateResult(self._replace(filter, replacement, upsert), True)
+
+    def update_one(
+        self,
+        filter: Mapping[str, Any],
+        update: Mapping[str, Any],
+        upsert: bool = False,
+        **kwargs: Any,
+    ) -> UpdateResult:
+        return UpdateResult(self._update(filter, update, upsert, multi=False), True)
+
+    def update_many(
+        self,
+        filter: Mapping[str, Any],
+        update: Mapping[str, Any],
+        upsert: bool = False,
+        **kwargs: Any,
+    ) -> UpdateResult:
+        return UpdateResult(self._update(filter, update, upsert, multi=True), True)
+
+    def delete_one(self, filter: Mapping[str, Any], **kwargs: Any) -> DeleteResult:
+        return DeleteResult({"n": self._delete(filter, limit=1)}, True)
+
+    def delete_many(self, filter: Mapping[str, Any], **kwargs: Any) -> DeleteResult:
+        return DeleteResult({"n": self._delete(filter, limit=0)}, True)
+
+    def bulk_write(
+        self, requests: Sequence[Any], ordered: bool = True, **kwargs: Any
+    ) -> BulkWriteResult:
+        return BulkWriteResult(self._bulk_write(requests, ordered, []), True)
+
+    def _bulk_write(
+        self, requests: Sequence[Any], ordered: bool, inserted_ids: List[Any]
+    ) -> Dict[str, Any]:
+        details: Dict[str, Any] = {
+            "writeErrors": [],
+            "writeConcernErrors": [],
+            "nInserted": 0,
+            "nUpserted": 0,
+            "nMatched": 0,
+            "nModified": 0,
+            "nRemoved": 0,
+            "upserted": [],
+        }
+        for index, request in enumerate(requests):
+            try:
+                self._bulk_request(request, index, details, inserted_ids)
+            except (WriteError, OperationFailure) as exc:
+                details["writeErrors"].append(
+                    {
+                        "index": index,
+                        "code": exc.code,
+                        "errmsg": str(exc),
+                        "op": getattr(request, "_doc", None),
+                    }
+                )
+                if ordered:
+                    break
+        if details["writeErrors"]:
+            raise BulkWriteError(details)
+        return details
+
+    def _bulk_request(
+        self,
+        request: Any,
+        index: int,
+        details: Dict[str, Any],
+        inserted_ids: List[Any],
+    ) -> None:
+        # pymongo does not expose the contents of its operation classes.
+        if isinstance(request, InsertOne):
+            result = self.insert_one(request._doc)
+            inserted_ids.append(result.inserted_id)
+            details["nInserted"] += 1
+        elif isinstance(request, DeleteOne):
+            details["nRemoved"] += self._delete(request._filter, limit=1)
+        else:
+            if isinstance(request, ReplaceOne):
+                raw = self._replace(
+                    request._filter, request._doc, bool(request._upsert)
+                )
+            elif isinstance(request, UpdateOne):
+                raw = self._update(
+                    request._filter,
+                    cast(Mapping[str, Any], request._doc),
+                    bool(request._upsert),
+                    multi=False,
+                )
+            else:
+                raise TypeError(f"Unsupported bulk operation: {request!r}")
+            if "upserted" in raw:
+                details["nUpserted"] += 1
+                details["upserted"].append({"index": index, "_id": raw["upserted"]})
+            else:
+                details["nMatched"] += raw["n"]
+                details["nModified"] += raw["nModified"]
+
+    def _replace(
+        self, filter: Mapping[str, Any], replacement: Any, upsert: bool
+    ) -> Dict[str, Any]:
+        replacement = self._prepare(replacement)
+        if any(key.startswith("$") for key in replacement):
+            raise ValueError("replacement can not include $ operators")
+        filter = self._encode_values(filter)
+
+        with self._store.lock:
+            matches = self._store.find(filter, limit=1)
+            if matches:
+                previous = matches[0]
+                document = {"_id": previous["_id"], **replacement}
+                self._store.write(document, previous)
+                return {"n": 1, "nModified": int(document != previous)}
+
+            if not upsert:
+                return {"n": 0, "nModified": 0}
+
+            document = replacement
+            if "_id" not in document:
+                document = {"_id": _upsert_document(filter).get("_id", ObjectId()), **document}
+            self._store.write(document)
+            return {"n": 1, "nModified": 0, "upserted": document["_id"]}
+
+    def _update(
+        self,
+        filter: Mapping[str, Any],
+        update: Mapping[str, Any],
+        upsert: bool,
+        multi: bool,
+    ) -> Dict[str, Any]:
+        if not update or not all(key.startswith("$") for key in update):
+            raise ValueError("update only works with $ operators")
+        filter = self._encode_values(filter)
+        update = self._encode_values(update)
+
+        with self._store.lock:
+            matches = self._store.find(filter, limit=0 if multi else 1)
+            modified = 0
+            for previous in matches:
+                document = decode(encode(previous))
+                _apply_update(document, update, inserting=False)
+                if encode(document) != encode(previous):
+                    self._store.write(document, previous, update=True)
+                    modified += 1
+            if matches or not upsert:
+                return {"n": len(matches), "nModified": modified}
+
+            document = _upsert_document(filter)
+            _apply_update(document, update, inserting=True)
+            if "_id" not in document:
+                document = {"_id": ObjectId(), **document}
+            self._store.write(document)
+            return {"n": 1, "nModified": 0, "upserted": document["_id"]}
+
+    def _delete(self, filter: Mapping[str, Any], limit: int) -> int:
+        filter = self._encode_values(filter)
+        with self._store.lock:
+            matches = self._store.find(filter, limit=limit)
+            for document in matches:
+                self._store.delete(document)
+            return len(matches)
+
+    # Reads
+
+    def find(
+        self,
+        filter: Optional[Mapping[str, Any]] = None,
+        projection: Optional[Mapping[str, Any]] = None,
+        skip: int = 0,
+        limit: int = 0,
+        sort: Optional[Sequence[Tuple[str, int]]] = None,
+        batch_size: int = 0,
+        **kwargs: Any,
+    ) -> MemoryCursor:
+        filter = self._encode_values(filter)
+        return MemoryCursor(self, filter, projection, skip, limit, sort, batch_size)
+
+    def find_raw_batches(
+        self,
+        filter: Optional[Mapping[str, Any]] = None,
+        projection: Optional[Mapping[str, Any]] = None,
+        skip: int = 0,
+        limit: int = 0,
+        sort: Optional[Sequence[Tuple[str, int]]] = None,
+        batch_size: int = 0,
+        **kwargs: Any,
+    ) -> MemoryRawBatchCursor:
+        filter = self._encode_values(filter)
+        return MemoryRawBatchCursor(
+            self, filter, projection, skip, limit, sort, batch_size
+        )
+
+    def find_one(
+        self,
+        filter: Optional[Any] = None,
+        projection: Optional[Mapping[str, Any]] = None,
+        **kwargs: Any,
+    ) -> Any:
+        if filter is not None and not isinstance(filter, Mapping):
+            filter = {"_id": filter}
+        for document in self.find(filter, projection, limit=-1, **kwargs):
+            return document
+        return None
+
+    def count_documents(self, filter: Mapping[str, Any], **kwargs: Any) -> int:
+        filter = self._encode_values(filter)
+        with self._store.lock:
+            return len(self._store.find(filter))
+
+    def aggregate(
+        self, pipeline: Sequence[Mapping[str, Any]], **kwargs: Any
+    ) -> MemoryCursor:
+        return _ListCursor(self, _aggregate(self, pipeline))
+
+    def watch(
+        self,
+        pipeline: Optional[Sequence[Mapping[str, Any]]] = None,
+        full_document: Optional[str] = None,
+        resume_after: Optional[Mapping[str, Any]] = None,
+        max_await_time_ms: Optional[int] = None,
+        start_after: Optional[Mapping[str, Any]] = None,
+        **kwargs: Any,
+    ) -> "MemoryChangeStream":
+        return MemoryChangeStream(
+            self,
+            pipeline,
+            full_document,
+            resume_after or start_after,
+            max_await_time_ms,
+        )
+
+    # Indexes
+
+    def create_indexes(self, indexes: Sequence[IndexModel], **kwargs: Any) -> List[str]:
+        with self._store.lock:
+            return [self._store.add_index(index.document) for index in indexes]
+
+    def create_index(self, keys: Any, **kwargs: Any) -> str:
+        return self.create_indexes([IndexModel(keys, **kwargs)])[0]
+
+    def index_information(self) -> Dict[str, Any]:
+        with self._store.lock:
+            return {
+                name: {
+                    "key": index.keys,
+                    **{
+                        key: value
+                        for key, value in index.document.items()
+                        if key not in ("key", "name")
+                    },
+                }
+                for name, index in self._store.indexes.items()
+            }
+
+    def list_indexes(self) -> MemoryCursor:
+        with self._store.lock:
+            documents = [
+                {"v": 2, **index.document} for index in self._store.indexes.values()
+            ]
+        return _ListCursor(self, documents)
+
+    def drop_index(self, name: str, **kwargs: Any) -> None:
+        with self._store.lock:
+            if name == "_id_" or name not in self._store.indexes:
+                raise OperationFailure(f"index not found with name [{name}]", 27)
+            del self._store.indexes[name]
+
+    def drop(self, **kwargs: Any) -> None:
+        self.database.drop_collection(self.name)
+
+
+class _ListCursor(MemoryCursor):
+    """
+    A cursor over a fixed list of documents, such as the result of a command.
+    """
+
+    def __init__(self, collection: MemoryCollection, documents: List[Any]) -> None:
+        super().__init__(collection)
+        self._documents = iter([encode(document) for document in documents])
+
+
+class MemoryChangeStream:
+    """
+    A change stream with the interface of a pymongo `ChangeStream`.
+
+    Resume tokens are positions in the change log of the collection. Resuming
+    from a change that is no longer in the log raises the `OperationFailure`
+    a server raises when the oplog no longer holds it.
+    """
+
+    def __init__(
+        self,
+        collection: MemoryCollection,
+        pipeline: Optional[Sequence[Mapping[str, Any]]] = None,
+        full_document: Optional[str] = None,
+        resume_after: Optional[Mapping[str, Any]] = None,
+        max_await_time_ms: Optional[int] = None,
+    ) -> None:
+        self.collection = collection
+        self._store = collection._store
+        self._pipeline = list(pipeline or [])
+        self._full_document = full_document
+        self._max_await = (max_await_time_ms or 1000) / 1000
+        with self._store.lock:
+            position = self._store.watch()
+            if resume_after is not None:
+                position = int(resume_after["_data"], 16)
+                assert self._store.changes is not None
+                first = self._store.change_count - len(self._store.changes)
+                if not first <= position <= self._store.change_count:
+                    raise OperationFailure(
+                        "Resume of change stream was not possible, as the resume "
+                        "point may no longer be in the oplog.",
+                        286,
+                    )
+        self._position = position
+        self.alive = True
+
+    @property
+    def resume_token(self) -> Dict[str, Any]:
+        return _token(self._position)
+
+    def try_next(self) -> Optional[Dict[str, Any]]:
+        """
+        Returns the next change or None if there is none yet.
+        """
+        while self.alive:
+            with self._store.lock:
+                changes = self._store.changes
+                assert changes is not None
+                first = self._store.change_count - len(changes)
+                if self._position >= self._store.change_count:
+                    return None
+                if self._position < first:
+                    self.alive = False
+                    raise OperationFailure(
+                        "Resume of change stream was not possible, as the resume "
+                        "point may no longer be in the oplog.",
+                        286,
+                    )
+                change = changes[self._position - first]
+                self._position += 1
+                event = self._event(change)
+            if event["operationType"] == "invalidate":
+                self.alive = False
+                return event
+            if _aggregate(self.collection, self._pipeline, [event]):
+                decoded: Dict[str, Any] = decode(
+                    encode(event), self.collection.codec_options
+                )
+                return decoded
+        return None
+
+    def _event(self, change: Mapping[str, Any]) -> Dict[str, Any]:
+        event: Dict[str, Any] = {
+            "_id": _token(self._position),
+            "operationType": change["operationType"],
+            "ns": {"db": self.collection.database.name, "coll": self.collection.name},
+        }
+        if "documentKey" in change:
+            event["documentKey"] = change["documentKey"]
+        if "fullDocument" in change:
+            event["fullDocument"] = decode(change["fullDocument"])
+        elif change["operationType"] == "update" and self._full_document in (
+            "updateLookup",
+            "whenAvailable",
+            "required",
+        ):
+            entry = self._store.documents.get(
+                _index_value(change["documentKey"]["_id"])
+            )
+            event["fullDocument"] = None if entry is None else decode(entry[1])
+        if "updateDescription" in change:
+            event["updateDescription"] = change["updateDescription"]
+        return event
+
+    def __iter__(self) -> "MemoryChangeStream":
+        return self
+
+    def __next__(self) -> Dict[str, Any]:
+        while self.alive:
+            change = self.try_next()
+            if change is not None:
+                return change
+            with self._store.changed:
+                if self.alive and self._position >= self._store.change_count:
+                    self._store.changed.wait(self._max_await)
+        raise StopIteration
+
+    next = __next__
+
+    def close(self) -> None:
+        with self._store.changed:
+            self.alive = False
+            self._store.changed.notify_all()
+
+    def __enter__(self) -> "MemoryChangeStream":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+def _token(position: int) -> Dict[str, Any]:
+    return {"_data": f"{position:016x}"}
+
+
+class MemoryDatabase:
+    """
+    An in-memory database with the interface of a pymongo `Database`.
+
+    Parameters:
+        name: The name of the database.
+        client: The client the database belongs to. Defaults to a new
+            `MemoryClient`.
+        codec_options: The codec options of the collections.
+    """
+
+    def __init__(
+        self,
+        name: str = "test",
+        client: Optional["MemoryClient"] = None,
+        codec_options: Optional["CodecOptions[Any]"] = None,
+    ) -> None:
+        self.name = name
+        self.client = MemoryClient() if client is None else client
+        self.codec_options: "CodecOptions[Any]" = (
+            codec_options or DEFAULT_CODEC_OPTIONS
+        )
+        self._stores: Dict[str, _Store] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        with self._lock:
+            store = self._stores.setdefault(name, _Store())
+        return MemoryCollection(self, name, _store=store)
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __repr__(self) -> str:
+        return f"MemoryDatabase({self.name!r})"
+
+    def get_collection(self, name: str, **kwargs: Any) -> MemoryCollection:
+        return self[name].with_options(**kwargs)
+
+    def list_collection_names(self, **kwargs: Any) -> List[str]:
+        with self._lock:
+            return list(self._stores)
+
+    def drop_collection(self, name: str, **kwargs: Any) -> None:
+        if isinstance(name, MemoryCollection):
+            name = name.name
+        with self._lock:
+            store = self._stores.pop(name, None)
+        if store is not None:
+            store.drop()
+
+    def command(self, command: Union[str, Mapping[str, Any]], **kwargs: Any) -> Any:
+        name = command if isinstance(command, str) else next(iter(command))
+        if name in ("hello", "isMaster", "ismaster"):
+            return dict(HELLO)
+        if name == "ping":
+            return {"ok": 1.0}
+        raise OperationFailure(f"no such command: '{name}'", 59)
+
+
+class MemoryClient:
+    """
+    An in-memory client with the interface of a pymongo `MongoClient`.
+    """
+
+    def __init__(self) -> None:
+        self._databases: Dict[str, MemoryDatabase] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        with self._lock:
+            if name not in self._databases:
+                self._databases[name] = MemoryDatabase(name, self)
+            return self._databases[name]
+
+    def __getattr__(self, name: str) -> MemoryDatabase:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_database(self, name: str = "test", **kwargs: Any) -> MemoryDatabase:
+        return self[name]
+
+    def drop_database(self, name: Union[str, MemoryDatabase]) -> None:
+        if isinstance(name, MemoryDatabase):
+            name = name.name
+        with self._lock:
+            self._databases.pop(name, None)
+
+    def list_database_names(self) -> List[str]:
+        with self._lock:
+            return list(self._databases)
+
+    def close(self) -> None:
+        pass
+
+
+# Asynchronous API
+
+
+class AsyncMemoryCursor:
+    """
+    A cursor with the interface of a Motor `AsyncIOMotorCursor`.
+    """
+
+    def __init__(self, cursor: MemoryCursor) -> None:
+        self.delegate = cursor
+
+    def sort(self, key_or_list: Any, direction: int = 1) -> "AsyncMemoryCursor":
+        self.delegate.sort(key_or_list, direction)
+        return self
+
+    def skip(self, skip: int) -> "AsyncMemoryCursor":
+        self.delegate.skip(skip)
+        return self
+
+    def limit(self, limit: int) -> "AsyncMemoryCursor":
+        self.delegate.limit(limit)
+        return self
+
+    def batch_size(self, batch_size: int) -> "AsyncMemoryCursor":
+        self.delegate.batch_size(batch_size)
+        return self
+
+    @property
+    def alive(self) -> bool:
+        return self.delegate.alive
+
+    def __aiter__(self) -> "AsyncMemoryCursor":
+        return self
+
+    async def __anext__(self) -> Any:
+        try:
+            return next(self.delegate)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    next = __anext__
+
+    async def to_list(self, length: Optional[int] = None) -> List[Any]:
+        return self.delegate.to_list(length)
+
+    async def explain(self) -> Dict[str, Any]:
+        return self.delegate.explain()
+
+    async def close(self) -> None:
+        self.delegate.close()
+
+
+class AsyncMemoryChangeStream:
+    """
+    A change stream with the interface of a Motor `AsyncIOMotorChangeStream`.
+    """
+
+    # The seconds between checks for new changes.
+    poll_interval = 0.01
+
+    def __init__(self, stream: MemoryChangeStream) -> None:
+        self.delegate = stream
+
+    @property
+    def alive(self) -> bool:
+        return self.delegate.alive
+
+    @property
+    def resume_token(self) -> Dict[str, Any]:
+        return self.delegate.resume_token
+
+    async def try_next(self) -> Optional[Dict[str, Any]]:
+        return self.delegate.try_next()
+
+    def __aiter__(self) -> "AsyncMemoryChangeStream":
+        return self
+
+    async def __anext__(self) -> Dict[str, Any]:
+        while self.alive:
+            change = self.delegate.try_next()
+            if change is not None:
+                return change
+            await asyncio.sleep(self.poll_interval)
+        raise StopAsyncIteration
+
+    next = __anext__
+
+    async def close(self) -> None:
+        self.delegate.close()
+
+    async def __aenter__(self) -> "AsyncMemoryChangeStream":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.close()
+
+
+def _async_method(name: str) -> Any:
+    async def method(self: "AsyncMemoryCollection", *args: Any, **kwargs: Any) -> Any:
+        return getattr(self.delegate, name)(*args, **kwargs)
+
+    method.__name__ = name
+    return method
+
+
+class AsyncMemoryCollection:
+    """
+    An in-memory collection with the interface of a Motor
+    `AsyncIOMotorCollection`.
+    """
+
+    def __init__(
+        self, database: "AsyncMemoryDatabase", collection: MemoryCollection
+    ) -> None:
+        self.database = database
+        self.delegate = collection
+
+    @property
+    def name(self) -> str:
+        return self.delegate.name
+
+    @property
+    def full_name(self) -> str:
+        return self.delegate.full_name
+
+    @property
+    def codec_options(self) -> "CodecOptions[Any]":
+        return self.delegate.codec_options
+
+    def __getitem__(self, name: str) -> "AsyncMemoryCollection":
+        return self.database[f"{self.name}.{name}"]
+
+    def __getattr__(self, name: str) -> "AsyncMemoryCollection":
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, AsyncMemoryCollection):
+            return self.delegate == other.delegate
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self.delegate)
+
+    def __repr__(self) -> str:
+        return f"AsyncMemoryCollection({self.database!r}, {self.name!r})"
+
+    def with_options(self, **kwargs: Any) -> "AsyncMemoryCollection":
+        return AsyncMemoryCollection(self.database, self.delegate.with_options(**kwargs))
+
+    def find(self, *args: Any, **kwargs: Any) -> AsyncMemoryCursor:
+        return AsyncMemoryCursor(self.delegate.find(*args, **kwargs))
+
+    def find_raw_batches(self, *args: Any, **kwargs: Any) -> AsyncMemoryCursor:
+        return AsyncMemoryCursor(self.delegate.find_raw_batches(*args, **kwargs))
+
+    def list_indexes(self) -> AsyncMemoryCursor:
+        return AsyncMemoryCursor(self.delegate.list_indexes())
+
+    def aggregate(self, *args: Any, **kwargs: Any) -> AsyncMemoryCursor:
+        return AsyncMemoryCursor(self.delegate.aggregate(*args, **kwargs))
+
+    def watch(self, *args: Any, **kwargs: Any) -> AsyncMemoryChangeStream:
+        return AsyncMemoryChangeStream(self.delegate.watch(*args, **kwargs))
+
+    insert_one = _async_method("insert_one")
+    insert_many = _async_method("insert_many")
+    replace_one = _async_method("replace_one")
+    update_one = _async_method("update_one")
+    update_many = _async_method("update_many")
+    delete_one = _async_method("delete_one")
+    delete_many = _async_method("delete_many")
+    bulk_write = _async_method("bulk_write")
+    find_one = _async_method("find_one")
+    count_documents = _async_method("count_documents")
+    create_indexes = _async_method("create_indexes")
+    create_index = _async_method("create_index")
+    index_information = _async_method("index_information")
+    drop_index = _async_method("drop_index")
+    drop = _async_method("drop")
+
+
+class AsyncMemoryDatabase:
+    """
+    An in-memory database with the interface of a Motor `AsyncIOMotorDatabase`.
+
+    Parameters:
+        name: The name of the database.
+        client: The client the database belongs to. Defaults to a new
+            `AsyncMemoryClient`.
+        codec_options: The codec options of the collections.
+    """
+
+    def __init__(
+        self,
+        name: str = "test",
+        client: Optional["AsyncMemoryClient"] = None,
+        codec_options: Optional["CodecOptions[Any]"] = None,
+    ) -> None:
+        self.client = AsyncMemoryClient() if client is None else client
+        self.delegate = MemoryDatabase(name, self.client.delegate, codec_options)
+
+    @property
+    def name(self) -> str:
+        return self.delegate.name
+
+    @property
+    def codec_options(self) -> "CodecOptions[Any]":
+        return self.delegate.codec_options
+
+    def __getitem__(self, name: str) -> AsyncMemoryCollection:
+        return AsyncMemoryCollection(self, self.delegate[name])
+
+    def __getattr__(self, name: str) -> AsyncMemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __repr__(self) -> str:
+        return f"AsyncMemoryDatabase({self.name!r})"
+
+    def get_collection(self, name: str, **kwargs: Any) -> AsyncMemoryCollection:
+        return self[name].with_options(**kwargs)
+
+    async def list_collection_names(self, **kwargs: Any) -> List[str]:
+        return self.delegate.list_collection_names()
+
+    async def drop_collection(self, name: Any, **kwargs: Any) -> None:
+        if isinstance(name, AsyncMemoryCollection):
+            name = name.name
+        self.delegate.drop_collection(name)
+
+    async def command(self, command: Any, **kwargs: Any) -> Any:
+        return self.delegate.command(command, **kwargs)
+
+
+class AsyncMemoryClient:
+    """
+    An in-memory client with the interface of a Motor `AsyncIOMotorClient`.
+    """
+
+    def __init__(self) -> None:
+        self.delegate = MemoryClient()
+        self._databases: Dict[str, AsyncMemoryDatabase] = {}
+
+    def __getitem__(self, name: str) -> AsyncMemoryDatabase:
+        if name not in self._databases:
+            database = AsyncMemoryDatabase(name, self)
+            # Share the storage with the synchronous client.
+            database.delegate = self.delegate[name]
+            self._databases[name] = database
+        return self._databases[name]
+
+    def __getattr__(self, name: str) -> AsyncMemoryDatabase:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_database(self, name: str = "test", **kwargs: Any) -> AsyncMemoryDatabase:
+        return self[name]
+
+    async def drop_database(self, name: Union[str, AsyncMemoryDatabase]) -> None:
+        if isinstance(name, AsyncMemoryDatabase):
+            name = name.name
+        self._databases.pop(name, None)
+        self.delegate.drop_database(name)
+
+    async def list_database_names(self) -> List[str]:
+        return self.delegate.list_database_names()
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,200 @@
+"""
+Reports how long each mongoclass operation spent converting documents and
+waiting for the database.
+
+Register a listener with `add_listener`. It is called with an
+`OperationEvent` after every completed operation. When no listener is
+registered, operations only check whether the list of listeners is empty.
+"""
+
+from dataclasses import dataclass
+import logging
+import time
+from typing import Any, Callable, List, Optional, Type
+
+from bson import encode
+from bson.raw_bson import RawBSONDocument
+
+__all__ = [
+    "OperationEvent",
+    "add_listener",
+    "remove_listener",
+    "OpenTelemetryListener",
+]
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class OperationEvent:
+    """
+    Describes a completed mongoclass operation.
+
+    Attributes:
+        cls: The mongoclass.
+        collection: The name of the collection.
+        operation: The name of the function, for example `"afind_one"`.
+        conversion_time: The seconds spent converting between objects and
+            documents.
+        io_time: The seconds spent waiting for the database.
+        count: The number of documents sent or received.
+        size: The encoded size of those documents in bytes.
+    """
+
+    cls: Type[Any]
+    collection: str
+    operation: str
+    conversion_time: float
+    io_time: float
+    count: int
+    size: int
+
+    @property
+    def duration(self) -> float:
+        return self.conversion_time + self.io_time
+
+
+Listener = Callable[[OperationEvent], None]
+
+# Mutated in place so that `from .monitoring import _listeners` stays current.
+_listeners: List[Listener] = []
+
+
+def add_listener(listener: Listener) -> None:
+    """
+    Registers a function that is called with an `OperationEvent` after every
+    completed operation.
+
+    Exceptions raised by a listener are logged and otherwise ignored.
+    """
+    _listeners.append(listener)
+
+
+def remove_listener(listener: Listener) -> None:
+    """
+    Unregisters a listener added with `add_listener`.
+
+    Raises:
+        ValueError: If the listener is not registered.
+    """
+    _listeners.remove(listener)
+
+
+def _size(document: Any) -> int:
+    if isinstance(document, RawBSONDocument):
+        return len(document.raw)
+    return len(encode(document))
+
+
+class _Recorder:
+    """
+    Accumulates the timings of one operation. Each call to `converted` or
+    `received` attributes the time since the previous call.
+    """
+
+    __slots__ = (
+        "cls",
+        "collection",
+        "operation",
+        "conversion_time",
+        "io_time",
+        "count",
+        "size",
+        "mark",
+    )
+
+    def __init__(self, cls: Type[Any], operation: str) -> None:
+        self.cls = cls
+        self.collection: str = cls.__mongoclass_config__.collection.name
+        self.operation = operation
+        self.conversion_time = 0.0
+        self.io_time = 0.0
+        self.count = 0
+        self.size = 0
+        self.mark = time.perf_counter()
+
+    def converted(self, *documents: Any) -> None:
+        """
+        Ends a conversion that produced the documents to send.
+        """
+        now = time.perf_counter()
+        self.conversion_time += now - self.mark
+        self.add(documents)
+        self.mark = time.perf_counter()
+
+    def received(self, *documents: Any) -> None:
+        """
+        Ends a round trip that returned the documents.
+        """
+        now = time.perf_counter()
+        self.io_time += now - self.mark
+        self.add(documents)
+        self.mark = time.perf_counter()
+
+    def add(self, documents: Any) -> None:
+        for document in documents:
+            if document is not None:
+                self.count += 1
+                self.size += _size(document)
+
+    def resume(self) -> None:
+        """
+        Ignores the time since the last call, e.g. while a caller held a
+        yielded object.
+        """
+        self.mark = time.perf_counter()
+
+    def publish(self) -> None:
+        event = OperationEvent(
+            cls=self.cls,
+            collection=self.collection,
+            operation=self.operation,
+            conversion_time=self.conversion_time,
+            io_time=self.io_time,
+            count=self.count,
+            size=self.size,
+        )
+        for listener in list(_listeners):
+            try:
+                listener(event)
+            except Exception:
+                logger.exception("Listener %r failed.", listener)
+
+
+class OpenTelemetryListener:
+    """
+    A listener that records each operation as an OpenTelemetry span.
+
+    The span covers the duration of the operation and carries the database
+    semantic attributes and the `mongoclasses.*` timings.
+
+    Parameters:
+        tracer: An OpenTelemetry tracer. Defaults to the tracer of the
+            `mongoclasses` instrumentation scope, which requires the
+            `opentelemetry-api` package.
+    """
+
+    def __init__(self, tracer: Optional[Any] = None) -> None:
+        if tracer is None:
+            from opentelemetry import trace  # type: ignore[import-not-found]
+
+            tracer = trace.get_tracer("mongoclasses")
+        self.tracer = tracer
+
+    def __call__(self, event: OperationEvent) -> None:
+        end = time.time_ns()
+        span = self.tracer.start_span(
+            f"{event.operation} {event.collection}",
+            start_time=end - int(event.duration * 1e9),
+            attributes={
+                "db.system": "mongodb",
+                "db.collection.name": event.collection,
+                "db.operation.name": event.operation,
+                "mongoclasses.class": event.cls.__qualname__,
+                "mongoclasses.conversion_time": event.conversion_time,
+                "mongoclasses.io_time": event.io_time,
+                "mongoclasses.document_count": event.count,
+                "mongoclasses.document_size": event.size,
+            },
+        )
+        span.end(end_time=end)
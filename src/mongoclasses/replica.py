@@ -0,0 +1,411 @@
+"""
+Local copies of the collection of a mongoclass, kept current by a change
+stream.
+
+A replica loads the collection once, then applies the inserts, updates,
+replaces and deletes reported by a change stream. Lookups by `_id` and by the
+fields with a single field unique index are served from memory.
+
+Change streams require a replica set or a sharded cluster, a single node
+replica set is enough.
+
+    replica = Replica(Country)
+    replica.load()
+    ...
+    replica.poll()
+    france = replica.get_by("code", "FR")
+"""
+
+import threading
+from typing import (
+    Any,
+    Dict,
+    Generic,
+    Hashable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Type,
+    TypeVar,
+    cast,
+)
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.collection import Collection
+from pymongo.errors import OperationFailure, PyMongoError
+
+from . import (
+    DeveloperError,
+    MongoclassInstance,
+    _freeze,
+    _is_async,
+    _structure,
+    get_collection,
+    get_id,
+)
+
+__all__ = ["Replica", "AsyncReplica"]
+
+T = TypeVar("T", bound=MongoclassInstance)
+
+# The errors raised when a change stream cannot resume from its token:
+# ChangeStreamFatalError and ChangeStreamHistoryLost.
+RELOAD_CODES = (280, 286)
+
+# The change stream events after which the replica must be loaded again.
+RELOAD_OPERATIONS = ("drop", "rename", "dropDatabase", "invalidate")
+
+
+class _BaseReplica(Generic[T]):
+    def __init__(self, cls: Type[T], /, trusted: bool = False) -> None:
+        config = cls.__mongoclass_config__
+        names = {db_field: name for name, db_field in config.db_fields.items()}
+        self.cls = cls
+        self.trusted = trusted
+        self.resume_token: Optional[Mapping[str, Any]] = None
+        # The attribute names of the fields with a single field unique index.
+        self.unique_fields: List[str] = [
+            names[field]
+            for index in config.indexes
+            if index.document.get("unique")
+            for field in index.document["key"]
+            if len(index.document["key"]) == 1 and field in names
+        ]
+        self._objects: Dict[Hashable, T] = {}
+        self._unique: Dict[str, Dict[Hashable, Hashable]] = {
+            name: {} for name in self.unique_fields
+        }
+        self._lock = threading.RLock()
+        self._loaded = False
+
+    def get(self, id: Any, default: Optional[T] = None) -> Optional[T]:
+        """
+        Returns the instance with the given `_id`, or `default`.
+        """
+        with self._lock:
+            return self._objects.get(_freeze(id), default)
+
+    def get_by(self, name: str, value: Any) -> Optional[T]:
+        """
+        Returns the instance whose field has the given value, or None.
+
+        Raises:
+            DeveloperError: If the field does not have a unique index.
+        """
+        if name not in self._unique:
+            raise DeveloperError(f"The field {name!r} does not have a unique index.")
+        with self._lock:
+            id_key = self._unique[name].get(_freeze(value))
+            return None if id_key is None else self._objects.get(id_key)
+
+    def __len__(self) -> int:
+        return len(self._objects)
+
+    def __contains__(self, id: Any) -> bool:
+        return _freeze(id) in self._objects
+
+    def __iter__(self) -> Iterator[T]:
+        with self._lock:
+            return iter(list(self._objects.values()))
+
+    def _reset(self, documents: List[Any], resume_token: Any) -> None:
+        objects = [_structure(self.cls, d, None, self.trusted) for d in documents]
+        with self._lock:
+            self._objects.clear()
+            for index in self._unique.values():
+                index.clear()
+            for obj in objects:
+                self._put(obj)
+            self.resume_token = resume_token
+            self._loaded = True
+
+    def _put(self, obj: T) -> None:
+        id_key = _freeze(get_id(obj))
+        self._remove(id_key)
+        self._objects[id_key] = obj
+        for name, index in self._unique.items():
+            index[_freeze(getattr(obj, name))] = id_key
+
+    def _remove(self, id_key: Hashable) -> None:
+        previous = self._objects.pop(id_key, None)
+        if previous is None:
+            return
+        for name, index in self._unique.items():
+            value = _freeze(getattr(previous, name))
+            if index.get(value) == id_key:
+                del index[value]
+
+    def _apply(self, change: Mapping[str, Any]) -> bool:
+        """
+        Applies a change and returns False if the replica must be reloaded.
+        """
+        operation = change["operationType"]
+        if operation in RELOAD_OPERATIONS:
+            return False
+
+        with self._lock:
+            if operation in ("insert", "update", "replace"):
+                document = change.get("fullDocument")
+                if document is None:
+                    # The document was deleted before the update was read.
+                    self._remove(_freeze(change["documentKey"]["_id"]))
+                else:
+                    self._put(_structure(self.cls, document, None, self.trusted))
+            elif operation == "delete":
+                self._remove(_freeze(change["documentKey"]["_id"]))
+            self.resume_token = change["_id"]
+        return True
+
+    def _check_loaded(self) -> None:
+        if not self._loaded:
+            raise DeveloperError("The replica must be loaded first.")
+
+
+class Replica(_BaseReplica[T]):
+    """
+    A local copy of the collection of a mongoclass, kept current by a change
+    stream.
+
+    Call `load` once, then `poll` to apply the pending changes or `run` in a
+    thread to apply them as they happen. Lost connections are resumed from
+    `resume_token`, and the replica is loaded again if the change stream
+    cannot be resumed.
+
+    Parameters:
+        cls: A mongoclass type with synchronous collection.
+        trusted: If True, the documents are structured without validation,
+            see `from_document`.
+
+    Attributes:
+        resume_token: The resume token of the last change applied.
+        unique_fields: The fields that can be passed to `get_by`.
+    """
+
+    def __init__(self, cls: Type[T], /, trusted: bool = False) -> None:
+        super().__init__(cls, trusted=trusted)
+        collection = get_collection(cls)
+        if _is_async(collection):
+            raise TypeError("Use AsyncReplica with asynchronous collections.")
+        self._collection = cast("Collection[Any]", collection)
+        self._stream: Any = None
+
+    def load(self) -> None:
+        """
+        Reads the whole collection.
+
+        The change stream is opened first, so no change made while reading is
+        missed.
+        """
+        self._close_stream()
+        self._stream = self._collection.watch(full_document="updateLookup")
+        resume_token = self._stream.resume_token
+        self._reset(list(self._collection.find()), resume_token)
+
+    def poll(self) -> int:
+        """
+        Applies the changes that are available without waiting.
+
+        Returns:
+            The number of changes applied.
+        """
+        self._check_loaded()
+        count = 0
+        while True:
+            change = self._next(wait=False)
+            if change is None:
+                return count
+            if self._apply(change):
+                count += 1
+            else:
+                self.load()
+
+    def run(self) -> None:
+        """
+        Applies the changes as they happen, until `close` is called.
+        """
+        self._check_loaded()
+        while self._stream is not None:
+            change = self._next(wait=True)
+            if change is not None and not self._apply(change):
+                self.load()
+
+    def close(self) -> None:
+        """
+        Closes the change stream, which stops `run`.
+        """
+        self._close_stream()
+
+    def _close_stream(self) -> None:
+        stream, self._stream = self._stream, None
+        if stream is not None:
+            stream.close()
+
+    def _next(self, wait: bool) -> Optional[Mapping[str, Any]]:
+        stream = self._stream
+        if stream is None:
+            return None
+        try:
+            if wait:
+                change = next(stream, None)
+            else:
+                change = stream.try_next()
+            return cast(Optional[Mapping[str, Any]], change)
+        except OperationFailure as exc:
+            if exc.code not in RELOAD_CODES:
+                raise
+            self.load()
+        except PyMongoError:
+            if self._stream is not stream:
+                # Closed by another thread.
+                return None
+            self._resume()
+        return None
+
+    def _resume(self) -> None:
+        self._close_stream()
+        try:
+            self._stream = self._collection.watch(
+                full_document="updateLookup", resume_after=self.resume_token
+            )
+        except OperationFailure as exc:
+            if exc.code not in RELOAD_CODES:
+                raise
+            self.load()
+
+    def __enter__(self) -> "Replica[T]":
+        self.load()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+class AsyncReplica(_BaseReplica[T]):
+    """
+    A local copy of the collection of a mongoclass with a Motor collection,
+    kept current by a change stream.
+
+    Await `load` once, then `poll` to apply the pending changes or run `run`
+    as a task to apply them as they happen. Lost connections are resumed
+    from `resume_token`, and the replica is loaded again if the change
+    stream cannot be resumed.
+
+    Parameters:
+        cls: A mongoclass type with asynchronous collection.
+        trusted: If True, the documents are structured without validation,
+            see `from_document`.
+
+    Attributes:
+        resume_token: The resume token of the last change applied.
+        unique_fields: The fields that can be passed to `get_by`.
+    """
+
+    def __init__(self, cls: Type[T], /, trusted: bool = False) -> None:
+        super().__init__(cls, trusted=trusted)
+        collection = get_collection(cls)
+        if not _is_async(collection):
+            raise TypeError("Use Replica with synchronous collections.")
+        self._collection = cast("AsyncIOMotorCollection[Any]", collection)
+        self._stream: Any = None
+        # A change read while opening the stream, applied after loading.
+        self._pending: Optional[Mapping[str, Any]] = None
+
+    async def load(self) -> None:
+        """
+        Reads the whole collection.
+
+        The change stream is opened first, so no change made while reading is
+        missed.
+        """
+        await self._close_stream()
+        self._stream = self._collection.watch(full_document="updateLookup")
+        # Motor opens the change stream on the first read.
+        self._pending = await self._stream.try_next()
+        resume_token = self._stream.resume_token
+        documents = await self._collection.find().to_list(None)
+        self._reset(documents, resume_token)
+
+    async def poll(self) -> int:
+        """
+        Applies the changes that are available without waiting.
+
+        Returns:
+            The number of changes applied.
+        """
+        self._check_loaded()
+        count = 0
+        while True:
+            change = await self._next(wait=False)
+            if change is None:
+                return count
+            if self._apply(change):
+                count += 1
+            else:
+                await self.load()
+
+    async def run(self) -> None:
+        """
+        Applies the changes as they happen, until `close` is called or the
+        task is cancelled.
+        """
+        self._check_loaded()
+        while self._stream is not None:
+            change = await self._next(wait=True)
+            if change is not None and not self._apply(change):
+                await self.load()
+
+    async def close(self) -> None:
+        """
+        Closes the change stream, which stops `run`.
+        """
+        await self._close_stream()
+
+    async def _close_stream(self) -> None:
+        stream, self._stream = self._stream, None
+        if stream is not None:
+            await stream.close()
+
+    async def _next(self, wait: bool) -> Optional[Mapping[str, Any]]:
+        if self._pending is not None:
+            change, self._pending = self._pending, None
+            return change
+        stream = self._stream
+        if stream is None:
+            return None
+        try:
+            if wait:
+                change = await stream.next()
+            else:
+                change = await stream.try_next()
+            return cast(Optional[Mapping[str, Any]], change)
+        except StopAsyncIteration:
+            return None
+        except OperationFailure as exc:
+            if exc.code not in RELOAD_CODES:
+                raise
+            await self.load()
+        except PyMongoError:
+            if self._stream is not stream:
+                return None
+            await self._resume()
+        return None
+
+    async def _resume(self) -> None:
+        await self._close_stream()
+        self._stream = self._collection.watch(
+            full_document="updateLookup", resume_after=self.resume_token
+        )
+        try:
+            self._pending = await self._stream.try_next()
+        except OperationFailure as exc:
+            if exc.code not in RELOAD_CODES:
+                raise
+            await self.load()
+
+    async def __aenter__(self) -> "AsyncReplica[T]":
+        await self.load()
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.close()
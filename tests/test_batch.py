@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from mongoclasses._batch import BatchLoader, id_key, match_ids, unique_ids
+
+
+class Fetcher:
+    def __init__(self, documents):
+        self.documents = {document["_id"]: document for document in documents}
+        self.calls = []
+
+    async def __call__(self, ids):
+        self.calls.append(ids)
+        await asyncio.sleep(0)
+        return [self.documents[id] for id in ids if id in self.documents]
+
+
+@pytest.mark.asyncio
+async def test_batch_loader():
+    fetch = Fetcher([{"_id": 1, "tags": []}, {"_id": 2, "tags": []}])
+    loader = BatchLoader(fetch, 0)
+    results = await asyncio.gather(*(loader.load(id) for id in (2, 3, 1, 2)))
+    assert [r and r["_id"] for r in results] == [2, None, 1, 2]
+    assert results[0] is not results[3]
+    assert fetch.calls == [[2, 3, 1]]
+
+
+@pytest.mark.asyncio
+async def test_batch_loader_window():
+    fetch = Fetcher([{"_id": 1}])
+    loader = BatchLoader(fetch, 0.01, max_size=2)
+    first = loader.load(1)
+    await asyncio.sleep(0)
+    results = await asyncio.gather(first, loader.load(1), loader.load(2))
+    assert results == [{"_id": 1}, {"_id": 1}, None]
+    assert fetch.calls == [[1], [2]]
+
+
+@pytest.mark.asyncio
+async def test_batch_loader_error():
+    async def fetch(ids):
+        raise RuntimeError("boom")
+
+    loader = BatchLoader(fetch, 0)
+    with pytest.raises(RuntimeError):
+        await asyncio.gather(loader.load(1), loader.load(2))
+
+
+def test_ids():
+    assert id_key(1) == id_key(1.0) != id_key(True)
+    assert id_key({"a": 1}) == id_key({"a": 1})
+    assert unique_ids([2, 1, 2.0, True]) == [2, 1, True]
+    documents = [{"_id": 1, "tags": []}]
+    matched = match_ids([1, 2, 1], documents)
+    assert matched == [documents[0], None, documents[0]]
+    assert matched[0] is documents[0] and matched[2] is not documents[0]
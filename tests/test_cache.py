@@ -0,0 +1,53 @@
+from bson import ObjectId
+
+from mongoclasses._batch import id_key
+from mongoclasses._cache import CacheStats, DocumentCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru():
+    cache = DocumentCache(2)
+    for id in (1, 2, 3):
+        data, version = cache.get(id_key(id))
+        assert data is None
+        cache.set(id_key(id), str(id).encode(), version)
+
+    assert cache.get(id_key(1))[0] is None
+    assert cache.get(id_key(2))[0] == b"2"
+    assert cache.stats() == CacheStats(hits=1, misses=4, evictions=1, size=2)
+
+
+def test_ttl():
+    clock = Clock()
+    cache = DocumentCache(10, ttl=5, timer=clock)
+    key = id_key(ObjectId())
+    cache.set(key, b"doc", cache.get(key)[1])
+
+    clock.now = 5
+    assert cache.get(key)[0] == b"doc"
+    clock.now = 6
+    assert cache.get(key)[0] is None
+    assert cache.stats() == CacheStats(hits=1, misses=2, evictions=1, size=0)
+
+
+def test_write_invalidation():
+    cache = DocumentCache(10)
+    key = id_key(1)
+    _, version = cache.get(key)
+    cache.evict(key)
+    # The document was read before the write, so it is not cached.
+    cache.set(key, b"old", version)
+    assert cache.get(key)[0] is None
+
+    cache.refresh(key, b"new")
+    assert cache.get(key)[0] == b"new"
+    cache.evict(key)
+    assert cache.get(key)[0] is None
+    assert cache.stats().invalidations == 1
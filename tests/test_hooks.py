@@ -0,0 +1,511 @@
+import copy
+import dataclasses as dc
+from datetime import date, datetime
+from decimal import Decimal
+from enum import Enum
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence, Set, Tuple
+import uuid
+
+from bson import Decimal128, ObjectId, decode, encode
+from bson.binary import Binary, UuidRepresentation
+from bson.codec_options import CodecOptions, TypeCodec, TypeEncoder
+from cattrs.errors import ClassValidationError
+from cattrs.gen import make_dict_structure_fn, make_dict_unstructure_fn, override
+from cattrs.preconf.bson import make_converter
+from pymongo import MongoClient
+from typing_extensions import Annotated
+import pytest
+
+from mongoclasses import (
+    _get_field_name,
+    mongoclass,
+    from_document,
+    get_collection,
+    get_converter,
+    get_id,
+    set_id,
+    to_document,
+    DeveloperError,
+    FieldMeta,
+)
+
+
+@pytest.fixture
+def database():
+    # The hooks never touch the server, so the database is not dropped.
+    return MongoClient().test_database
+
+
+def reference_converter(cls):
+    """
+    Returns a converter configured the way mongoclasses configured them before
+    the hooks were generated.
+    """
+    converter = make_converter()
+    overrides = {}
+    for field in dc.fields(cls):
+        field_name = _get_field_name(field)
+        if field_name != field.name:
+            overrides[field.name] = override(rename=field_name)
+    converter.register_unstructure_hook(
+        cls, make_dict_unstructure_fn(cls, converter, **overrides)
+    )
+    converter.register_structure_hook(
+        cls, make_dict_structure_fn(cls, converter, **overrides)
+    )
+    return converter
+
+
+def assert_parity(obj):
+    cls = type(obj)
+    converter = reference_converter(cls)
+    document = to_document(obj)
+    assert document == converter.unstructure(obj)
+    assert list(document) == list(converter.unstructure(obj))
+    assert from_document(cls, document) == converter.structure(document, cls)
+    assert from_document(cls, document) == obj
+
+
+class Color(Enum):
+    RED = "red"
+    BLUE = "blue"
+
+
+@dc.dataclass
+class Point:
+    x: int = 0
+    y: int = 0
+
+
+def test_flat(database):
+    @mongoclass(db=database)
+    class Foo:
+        _id: ObjectId = dc.field(default_factory=ObjectId)
+        name: str = "foo"
+        count: int = 1
+        ratio: float = 0.5
+        active: bool = True
+        data: bytes = b"abc"
+        created: datetime = dc.field(
+            default_factory=lambda: datetime(2024, 1, 1, 12, 30)
+        )
+        anything: Any = None
+
+    assert_parity(Foo())
+    assert_parity(Foo(anything={"a": [1, 2]}))
+
+
+def test_renamed_fields(database):
+    @mongoclass(db=database)
+    class Foo:
+        id: Annotated[ObjectId, FieldMeta(db_field="_id")] = dc.field(
+            default_factory=ObjectId
+        )
+        name: Annotated[str, FieldMeta(db_field="n")] = ""
+        tags: Annotated[List[str], FieldMeta(db_field="t")] = dc.field(
+            default_factory=list
+        )
+
+    assert_parity(Foo(name="foo", tags=["a"]))
+    assert to_document(Foo(name="foo")).keys() == {"_id", "n", "t"}
+
+
+def test_optional_and_collections(database):
+    @mongoclass(db=database)
+    class Foo:
+        _id: ObjectId = dc.field(default_factory=ObjectId)
+        maybe: Optional[str] = None
+        maybe_point: Optional[Point] = None
+        numbers: List[int] = dc.field(default_factory=list)
+        sequence: Sequence[str] = dc.field(default_factory=list)
+        pair: Tuple[int, ...] = ()
+        unique: Set[int] = dc.field(default_factory=set)
+        frozen: FrozenSet[str] = frozenset()
+        mapping: Dict[str, int] = dc.field(default_factory=dict)
+        nested: Dict[str, List[Point]] = dc.field(default_factory=dict)
+
+    assert_parity(Foo())
+    assert_parity(
+        Foo(
+            maybe="a",
+            maybe_point=Point(1, 2),
+            numbers=[1, 2],
+            sequence=["a"],
+            pair=(1, 2),
+            unique={3},
+            frozen=frozenset({"b"}),
+            mapping={"a": 1},
+            nested={"a": [Point(1, 1)]},
+        )
+    )
+
+
+def test_nested(database):
+    @mongoclass(db=database)
+    class Bar:
+        _id: int = 0
+        point: Point = dc.field(default_factory=Point)
+
+    @mongoclass(db=database)
+    class Foo:
+        _id: ObjectId = dc.field(default_factory=ObjectId)
+        bar: Bar = dc.field(default_factory=Bar)
+        bars: List[Bar] = dc.field(default_factory=list)
+        points: List[Point] = dc.field(default_factory=list)
+
+    assert_parity(Foo(bar=Bar(1, Point(2, 3)), bars=[Bar(2)], points=[Point(4, 5)]))
+
+
+def test_nested_mongoclass_uses_attribute_names(database):
+    @mongoclass(db=database)
+    class Bar:
+        id: Annotated[int, FieldMeta(db_field="_id")] = 0
+
+    @mongoclass(db=database)
+    class Foo:
+        _id: int = 0
+        bar: Bar = dc.field(default_factory=Bar)
+        bars: List[Bar] = dc.field(default_factory=list)
+
+    foo = Foo(bar=Bar(id=1), bars=[Bar(id=2)])
+    assert_parity(foo)
+    assert to_document(foo) == {"_id": 0, "bar": {"id": 1}, "bars": [{"id": 2}]}
+    assert to_document(Bar(id=1)) == {"_id": 1}
+
+
+def test_fallback_types(database):
+    @mongoclass(db=database)
+    class Foo:
+        _id: int = 0
+        color: Color = Color.RED
+        day: date = date(2024, 1, 1)
+        choice: Optional[Color] = None
+
+    assert_parity(Foo(color=Color.BLUE, choice=Color.RED))
+
+
+def test_hooks_registered_late(database):
+    converter = make_converter()
+
+    @mongoclass(db=database, converter=converter, precompile=True)
+    class Foo:
+        _id: int = 0
+        day: date = date(2024, 1, 1)
+
+    converter.register_unstructure_hook(date, date.toordinal)
+    converter.register_structure_hook(date, lambda value, _: date.fromordinal(value))
+    document = to_document(Foo())
+    assert document["day"] == date(2024, 1, 1).toordinal()
+    assert from_document(Foo, document) == Foo()
+
+
+def test_coercion(database):
+    @mongoclass(db=database)
+    class Foo:
+        _id: int = 0
+        name: str = ""
+        numbers: List[float] = dc.field(default_factory=list)
+
+    document = {"_id": "1", "name": 2, "numbers": [1, "2.5"]}
+    assert from_document(Foo, document) == reference_converter(Foo).structure(
+        document, Foo
+    )
+
+
+def test_structure_errors(database):
+    @mongoclass(db=database)
+    class Foo:
+        _id: int
+        created: datetime = datetime(2024, 1, 1)
+
+    with pytest.raises(ClassValidationError):
+        from_document(Foo, {})
+
+    with pytest.raises(ClassValidationError):
+        from_document(Foo, {"_id": 1, "created": "yesterday"})
+
+
+def test_constructor_errors(database):
+    calls = []
+
+    @mongoclass(db=database)
+    class Foo:
+        _id: int = 0
+
+        def __post_init__(self):
+            calls.append(self._id)
+            if self._id < 0:
+                raise ValueError("negative")
+
+    with pytest.raises(ValueError):
+        from_document(Foo, {"_id": -1})
+    assert calls == [-1]
+
+
+def test_precompile(database):
+    @mongoclass(db=database, precompile=True)
+    class Foo:
+        _id: int = 0
+
+    hooks = Foo.__mongoclass_config__.hooks
+    assert "unstructure" in vars(hooks)
+    assert "structure" in vars(hooks)
+    assert_parity(Foo(_id=1))
+
+
+def test_trusted(database):
+    @dc.dataclass
+    class Point:
+        x: int = 0
+        y: int = 0
+
+    @mongoclass(db=database)
+    class Foo:
+        id: Annotated[ObjectId, FieldMeta(db_field="_id")] = dc.field(
+            default_factory=ObjectId
+        )
+        created: datetime = datetime(2024, 1, 1)
+        tags: List[str] = dc.field(default_factory=list)
+        point: Point = dc.field(default_factory=Point)
+        numbers: Tuple[int, ...] = ()
+        version: int = dc.field(init=False, default=1)
+
+        def __post_init__(self):
+            self.version += 1
+
+    foo = Foo(tags=["a"], point=Point(1, 2), numbers=(1, 2))
+    document = to_document(foo)
+    trusted = from_document(Foo, document, trusted=True)
+    assert trusted.__dict__ == {**from_document(Foo, document).__dict__, "version": 1}
+    assert trusted.numbers == (1, 2)
+    assert trusted.point == Point(1, 2)
+
+    # Missing keys are handed to the validating hook.
+    assert from_document(Foo, {"_id": foo.id}, trusted=True).version == 2
+
+
+def test_trusted_slots(database):
+    @mongoclass(db=database, frozen=True)
+    class Foo:
+        __slots__ = ("_id", "name")
+        _id: int
+        name: str
+
+    assert from_document(Foo, {"_id": 1, "name": "a"}, trusted=True) == Foo(1, "a")
+
+
+def test_slots(database):
+    @mongoclass(db=database, slots=True, track_changes=True)
+    class Foo:
+        id: Annotated[int, FieldMeta(db_field="_id")] = 0
+        name: str = ""
+        tags: List[str] = dc.field(default_factory=list)
+
+        def __post_init__(self):
+            super().__init__()
+
+    foo = Foo(1, "a", ["b"])
+    assert not hasattr(foo, "__dict__")
+    assert Foo.__mongoclass_config__.hooks.cls is Foo
+    assert get_id(foo) == 1
+    set_id(foo, 2)
+    assert foo.id == 2
+
+    document = to_document(foo)
+    assert document == {"_id": 2, "name": "a", "tags": ["b"]}
+    assert from_document(Foo, document) == foo
+    assert from_document(Foo, document, trusted=True) == foo
+    assert_parity(foo)
+
+    @mongoclass(db=database, slots=True)
+    class Bar(Foo):
+        count: int = 0
+
+    bar = Bar(1, count=2)
+    assert not hasattr(bar, "__dict__")
+    assert Bar.__slots__ == ("count",)
+    assert from_document(Bar, to_document(bar)) == bar
+
+    @mongoclass(db=database, slots=True, frozen=True)
+    class Baz:
+        _id: int = 0
+
+    baz = Baz(1)
+    assert not hasattr(baz, "__dict__")
+    assert copy.copy(baz) == baz
+
+
+class DecimalCodec(TypeCodec):
+    python_type = Decimal
+    bson_type = Decimal128
+
+    def transform_python(self, value):
+        return Decimal128(value)
+
+    def transform_bson(self, value):
+        return value.to_decimal()
+
+
+class ColorEncoder(TypeEncoder):
+    python_type = Color
+
+    def transform_python(self, value):
+        return value.value
+
+
+def test_codecs(database):
+    database = database.with_options(
+        codec_options=CodecOptions(uuid_representation=UuidRepresentation.STANDARD)
+    )
+
+    @mongoclass(db=database, codecs=[DecimalCodec(), ColorEncoder()])
+    class Foo:
+        _id: uuid.UUID = dc.field(default_factory=uuid.uuid4)
+        price: Decimal = Decimal("0")
+        color: Color = Color.RED
+        prices: List[Decimal] = dc.field(default_factory=list)
+        point: Point = dc.field(default_factory=Point)
+
+    codec_options = get_collection(Foo).codec_options
+    foo = Foo(price=Decimal("1.5"), color=Color.BLUE, prices=[Decimal("2")])
+    document = to_document(foo)
+    assert document == {
+        "_id": foo._id,
+        "price": Decimal("1.5"),
+        "color": Color.BLUE,
+        "prices": [Decimal("2")],
+        "point": {"x": 0, "y": 0},
+    }
+
+    data = decode(encode(document, codec_options=codec_options))
+    assert data["price"] == Decimal128("1.5")
+    assert data["color"] == "blue"
+    decoded = decode(encode(document, codec_options=codec_options), codec_options)
+    assert decoded["price"] == Decimal("1.5")
+    assert from_document(Foo, decoded) == foo
+    assert from_document(Foo, decoded, trusted=True) == foo
+
+    @mongoclass(db=database)
+    class Bar:
+        _id: int = 0
+        color: Color = Color.RED
+
+    # Classes without codecs still convert the values.
+    assert get_converter(Bar) is not get_converter(Foo)
+    assert to_document(Bar(1)) == {"_id": 1, "color": "red"}
+
+
+def test_codecs_uuid(database):
+    def make_class(database):
+        @mongoclass(db=database, codecs=[])
+        class Foo:
+            _id: int = 0
+            key: uuid.UUID = dc.field(default_factory=uuid.uuid4)
+
+        return Foo
+
+    # UUIDs are left to BSON when the collection has a UUID representation.
+    Foo = make_class(
+        database.with_options(
+            codec_options=CodecOptions(uuid_representation=UuidRepresentation.STANDARD)
+        )
+    )
+    codec_options = get_collection(Foo).codec_options
+    foo = Foo()
+    document = to_document(foo)
+    assert document["key"] is foo.key
+    data = decode(encode(document, codec_options=codec_options))
+    assert data["key"] == Binary.from_uuid(foo.key)
+    decoded = decode(encode(document, codec_options=codec_options), codec_options)
+    assert from_document(Foo, decoded) == foo
+    assert from_document(Foo, decoded, trusted=True) == foo
+
+    # Otherwise the converter needs hooks for them.
+    Foo = make_class(database)
+    with pytest.raises(ClassValidationError):
+        from_document(Foo, decoded)
+
+    class Text(str, Enum):
+        A = "a"
+
+    class TextEncoder(TypeEncoder):
+        python_type = Text
+
+        def transform_python(self, value):
+            return value.value
+
+    with pytest.raises(DeveloperError):
+
+        @mongoclass(db=database, codecs=[TextEncoder()])
+        class Baz:
+            _id: int = 0
+
+
+def test_converter(database):
+    @mongoclass(db=database)
+    class Bar:
+        _id: int = 0
+
+    @mongoclass(db=database)
+    class Foo:
+        _id: int = 0
+        day: date = date(2024, 1, 1)
+        bar: Optional[Bar] = None
+
+    # Hooks registered on the converter of a class only apply to it.
+    assert get_converter(Foo) is not get_converter(Bar)
+    get_converter(Bar).register_unstructure_hook(date, date.toordinal)
+    assert not isinstance(to_document(Foo())["day"], int)
+
+    converter = make_converter()
+    converter.register_unstructure_hook(date, date.toordinal)
+    converter.register_structure_hook(date, lambda value, _: date.fromordinal(value))
+
+    @mongoclass(db=database, collection_name="foo", converter=converter)
+    class Baz:
+        _id: int = 0
+        day: date = date(2024, 1, 1)
+        bar: Optional[Bar] = None
+
+    @mongoclass(db=database, collection_name="foo", converter=converter)
+    class Qux:
+        id: Annotated[int, FieldMeta(db_field="_id")] = 0
+        day: date = date(2024, 1, 1)
+
+    assert get_converter(Baz) is get_converter(Qux) is converter
+    baz = Baz(bar=Bar(1))
+    day = date(2024, 1, 1).toordinal()
+    assert to_document(baz) == {"_id": 0, "day": day, "bar": {"_id": 1}}
+    assert from_document(Baz, to_document(baz)) == baz
+    assert converter.unstructure(baz) == to_document(baz)
+    assert converter.unstructure(Qux(1)) == {"_id": 1, "day": day}
+    assert converter.structure({"_id": 1, "day": day}, Qux) == Qux(1)
+
+
+def test_shared_converter(database):
+    @mongoclass(db=database)
+    class Bar:
+        _id: int = 0
+        day: date = date(2024, 1, 1)
+
+    @mongoclass(db=database)
+    class Foo:
+        _id: int = 0
+        day: date = date(2024, 1, 1)
+        bars: List[Bar] = dc.field(default_factory=list)
+
+    # The types that the generated functions do not handle are converted by a
+    # converter shared by the classes, until a class has its own.
+    foo = Foo(bars=[Bar()])
+    assert from_document(Foo, to_document(foo)) == foo
+    assert from_document(Bar, to_document(Bar()), trusted=True) == Bar()
+    assert Foo.__mongoclass_config__.hooks._converter is None
+    assert Bar.__mongoclass_config__.hooks._converter is None
+
+    converter = get_converter(Foo)
+    converter.register_unstructure_hook(date, date.toordinal)
+    converter.register_structure_hook(date, lambda value, _: date.fromordinal(value))
+    day = date(2024, 1, 1).toordinal()
+    assert to_document(foo) == {"_id": 0, "day": day, "bars": [{"_id": 0, "day": day}]}
+    assert from_document(Foo, to_document(foo)) == foo
+    assert not isinstance(to_document(Bar())["day"], int)
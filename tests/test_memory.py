@@ -0,0 +1,273 @@
+import dataclasses as dc
+import re
+
+from bson import ObjectId
+from pymongo import DeleteOne, IndexModel, InsertOne, UpdateOne
+from pymongo.errors import (
+    BulkWriteError,
+    DuplicateKeyError,
+    OperationFailure,
+    WriteError,
+)
+import pytest
+
+from mongoclasses import (
+    afind_one,
+    ainsert_one,
+    aiter_objects,
+    create_indexes,
+    find,
+    find_one,
+    insert_one,
+    iter_objects,
+    mongoclass,
+    update_one,
+)
+from mongoclasses.memory import AsyncMemoryClient, MemoryClient, MemoryDatabase
+
+
+@pytest.fixture
+def collection():
+    collection = MemoryDatabase().items
+    collection.insert_many(
+        [
+            {"_id": 1, "name": "a", "qty": 5, "tags": ["x", "y"], "size": {"h": 10}},
+            {"_id": 2, "name": "b", "qty": 15, "tags": ["y"], "size": {"h": 20}},
+            {"_id": 3, "name": "c", "qty": 25, "tags": [], "items": [{"n": 1}]},
+        ]
+    )
+    return collection
+
+
+def ids(cursor):
+    return [document["_id"] for document in cursor]
+
+
+def test_find(collection):
+    assert ids(collection.find()) == [1, 2, 3]
+    assert ids(collection.find({"name": "b"})) == [2]
+    assert ids(collection.find({"qty": {"$gt": 5, "$lte": 25}})) == [2, 3]
+    assert ids(collection.find({"qty": {"$in": [5, 25]}})) == [1, 3]
+    assert ids(collection.find({"qty": {"$nin": [5, 25]}})) == [2]
+    assert ids(collection.find({"qty": {"$ne": 5}})) == [2, 3]
+    assert ids(collection.find({"size": {"$exists": False}})) == [3]
+    assert ids(collection.find({"size.h": {"$gte": 20}})) == [2]
+    assert ids(collection.find({"tags": "y"})) == [1, 2]
+    assert ids(collection.find({"tags": {"$all": ["x", "y"]}})) == [1]
+    assert ids(collection.find({"tags": {"$size": 0}})) == [3]
+    assert ids(collection.find({"items.n": 1})) == [3]
+    assert ids(collection.find({"items": {"$elemMatch": {"n": {"$gt": 0}}}})) == [3]
+    assert ids(collection.find({"name": {"$regex": "^[ab]"}})) == [1, 2]
+    assert ids(collection.find({"name": re.compile("C", re.I)})) == [3]
+    assert ids(collection.find({"qty": {"$not": {"$gt": 5}}})) == [1]
+    assert ids(collection.find({"$or": [{"_id": 1}, {"name": "c"}]})) == [1, 3]
+    assert ids(collection.find({"$and": [{"qty": 15}, {"name": "b"}]})) == [2]
+    assert ids(collection.find({"$nor": [{"_id": 1}, {"_id": 2}]})) == [3]
+    assert ids(collection.find({"missing": None})) == [1, 2, 3]
+
+
+def test_find_options(collection):
+    assert ids(collection.find(sort=[("qty", -1)])) == [3, 2, 1]
+    assert ids(collection.find(sort=[("qty", -1)], skip=1, limit=1)) == [2]
+    assert ids(collection.find().sort("name", -1).limit(2)) == [3, 2]
+    assert collection.find({"_id": 1}, {"name": 1}).to_list() == [
+        {"_id": 1, "name": "a"}
+    ]
+    assert collection.find_one({"_id": 3}, {"_id": 0, "tags": 0, "items": 0}) == {
+        "name": "c",
+        "qty": 25,
+    }
+    assert collection.find_one({"_id": 4}) is None
+    assert collection.count_documents({"qty": {"$lt": 20}}) == 2
+
+
+def test_update(collection):
+    result = collection.update_one(
+        {"_id": 1},
+        {
+            "$set": {"size.w": 3},
+            "$unset": {"name": ""},
+            "$inc": {"qty": 2},
+            "$push": {"tags": {"$each": ["z", "z"]}},
+            "$addToSet": {"extra": "x"},
+        },
+    )
+    assert (result.matched_count, result.modified_count) == (1, 1)
+    assert collection.find_one({"_id": 1}) == {
+        "_id": 1,
+        "qty": 7,
+        "tags": ["x", "y", "z", "z"],
+        "size": {"h": 10, "w": 3},
+        "extra": ["x"],
+    }
+
+    collection.update_one(
+        {"_id": 1},
+        {
+            "$pull": {"tags": "z"},
+            "$min": {"qty": 1},
+            "$mul": {"size.h": 2},
+            "$rename": {"extra": "more"},
+            "$pop": {"tags": 1},
+        },
+    )
+    assert collection.find_one({"_id": 1}) == {
+        "_id": 1,
+        "qty": 1,
+        "tags": ["x"],
+        "size": {"h": 20, "w": 3},
+        "more": ["x"],
+    }
+
+    result = collection.update_one({"_id": 1}, {"$set": {"qty": 1}})
+    assert (result.matched_count, result.modified_count) == (1, 0)
+
+    with pytest.raises(WriteError):
+        collection.update_one({"_id": 1}, {"$set": {"_id": 5}})
+    with pytest.raises(WriteError):
+        collection.update_one({"_id": 1}, {"$inc": {"tags": 1}})
+
+
+def test_upsert(collection):
+    result = collection.update_one(
+        {"_id": 4, "name": "d"},
+        {"$set": {"qty": 1}, "$setOnInsert": {"new": True}},
+        upsert=True,
+    )
+    assert result.upserted_id == 4
+    assert collection.find_one({"_id": 4}) == {
+        "_id": 4,
+        "name": "d",
+        "qty": 1,
+        "new": True,
+    }
+
+    result = collection.replace_one({"_id": 5}, {"name": "e"}, upsert=True)
+    assert result.upserted_id == 5
+    result = collection.replace_one({"_id": 5}, {"name": "f"})
+    assert result.modified_count == 1
+    assert collection.find_one({"_id": 5}) == {"_id": 5, "name": "f"}
+
+
+def test_delete(collection):
+    assert collection.delete_one({"qty": {"$gt": 5}}).deleted_count == 1
+    assert ids(collection.find()) == [1, 3]
+    assert collection.delete_many({}).deleted_count == 2
+    assert collection.find_one() is None
+
+
+def test_unique_index(collection):
+    collection.create_indexes([IndexModel("name", unique=True)])
+    with pytest.raises(DuplicateKeyError):
+        collection.insert_one({"name": "a"})
+    with pytest.raises(DuplicateKeyError):
+        collection.update_one({"_id": 2}, {"$set": {"name": "a"}})
+    with pytest.raises(DuplicateKeyError):
+        collection.insert_one({"_id": 1})
+
+    collection.update_one({"_id": 1}, {"$set": {"name": "z"}})
+    collection.insert_one({"name": "a"})
+
+    collection.create_indexes(
+        [IndexModel("code", unique=True, sparse=True, name="code")]
+    )
+    collection.insert_one({"name": "d"})
+    collection.insert_one({"name": "e"})
+    collection.insert_one({"name": "f", "code": 1})
+    with pytest.raises(DuplicateKeyError):
+        collection.insert_one({"name": "g", "code": 1})
+    assert "code" in collection.index_information()
+
+
+def test_bulk_write(collection):
+    with pytest.raises(BulkWriteError) as exc_info:
+        collection.bulk_write(
+            [
+                InsertOne({"_id": 4}),
+                InsertOne({"_id": 1}),
+                DeleteOne({"_id": 2}),
+            ]
+        )
+    assert exc_info.value.details["nInserted"] == 1
+    assert exc_info.value.details["writeErrors"][0]["index"] == 1
+    assert ids(collection.find()) == [1, 2, 3, 4]
+
+    result = collection.bulk_write(
+        [UpdateOne({"_id": 1}, {"$set": {"qty": 0}}), DeleteOne({"_id": 2})]
+    )
+    assert (result.modified_count, result.deleted_count) == (1, 1)
+
+
+def test_aggregate(collection):
+    assert ids(collection.aggregate([{"$unwind": "$tags"}])) == [1, 1, 2]
+    unwound = collection.aggregate(
+        [{"$unwind": {"path": "$tags", "preserveNullAndEmptyArrays": True}}]
+    )
+    assert ids(unwound) == [1, 1, 2, 3]
+
+    pipeline = [
+        {"$match": {"qty": {"$gt": 5}}},
+        {"$sort": {"qty": -1}},
+        {"$addFields": {"copy": "$name", "one": 1}},
+        {"$project": {"copy": 1, "one": 1}},
+        {"$limit": 1},
+    ]
+    assert list(collection.aggregate(pipeline)) == [{"_id": 3, "copy": "c", "one": 1}]
+
+    collection.database.sizes.insert_many([{"_id": "s", "h": 10}, {"h": 30}])
+    lookup = {"from": "sizes", "localField": "size.h", "foreignField": "h", "as": "s"}
+    pipeline = [{"$lookup": lookup}, {"$skip": 1}]
+    joined = list(collection.aggregate([{"$lookup": lookup}]))
+    assert [document["s"] for document in joined] == [[{"_id": "s", "h": 10}], [], []]
+    assert ids(collection.aggregate(pipeline)) == [2, 3]
+    assert list(collection.aggregate([{"$count": "n"}])) == [{"n": 3}]
+
+    with pytest.raises(OperationFailure):
+        collection.aggregate([{"$group": {"_id": "$name"}}])
+
+
+def test_isolation(collection):
+    document = collection.find_one({"_id": 1})
+    document["tags"].append("z")
+    assert collection.find_one({"_id": 1})["tags"] == ["x", "y"]
+
+
+def test_client():
+    client = MemoryClient()
+    client.db.items.insert_one({"_id": 1})
+    assert client["db"]["items"].find_one() == {"_id": 1}
+    assert client.db.command("hello")["isWritablePrimary"]
+    client.drop_database("db")
+    assert client.db.items.find_one() is None
+
+
+def test_mongoclass():
+    @mongoclass(db=MemoryDatabase(), indexes=[IndexModel("email", unique=True)])
+    class User:
+        _id: ObjectId = dc.field(default_factory=ObjectId)
+        email: str = ""
+        logins: int = 0
+
+    create_indexes(User)
+    user = User(email="a@example.com")
+    insert_one(user)
+    with pytest.raises(DuplicateKeyError):
+        insert_one(User(email="a@example.com"))
+
+    update_one(user, {"$inc": {"logins": 1}})
+    user.logins = 1
+    assert find_one(User, {"_id": user._id}) == user
+    assert list(iter_objects(User, find(User, {"logins": {"$gte": 1}}))) == [user]
+
+
+@pytest.mark.asyncio
+async def test_async_mongoclass():
+    @mongoclass(db=AsyncMemoryClient().test)
+    class User:
+        _id: ObjectId = dc.field(default_factory=ObjectId)
+        email: str = ""
+
+    user = User(email="a@example.com")
+    await ainsert_one(user)
+    assert await afind_one(User, {"_id": user._id}) == user
+    assert [obj async for obj in aiter_objects(User, find(User))] == [user]
@@ -0,0 +1,140 @@
+import dataclasses as dc
+
+from bson import ObjectId, encode
+import pytest
+
+from mongoclasses import (
+    afind_one,
+    ainsert_one,
+    find,
+    find_one,
+    insert_many,
+    insert_one,
+    iter_objects,
+    mongoclass,
+    replace_one,
+    to_document,
+)
+from mongoclasses.memory import AsyncMemoryDatabase, MemoryDatabase
+from mongoclasses.monitoring import (
+    OpenTelemetryListener,
+    OperationEvent,
+    add_listener,
+    remove_listener,
+)
+
+
+@pytest.fixture
+def events():
+    events = []
+    add_listener(events.append)
+    yield events
+    remove_listener(events.append)
+
+
+def make_class(db):
+    @mongoclass(db=db, collection_name="foo")
+    class Foo:
+        _id: ObjectId = dc.field(default_factory=ObjectId)
+        name: str = "foo"
+
+    return Foo
+
+
+def test_events(events):
+    Foo = make_class(MemoryDatabase())
+    foo = Foo()
+    size = len(encode(to_document(foo)))
+
+    insert_one(foo)
+    replace_one(foo)
+    assert find_one(Foo, {"_id": foo._id}) == foo
+    assert find_one(Foo, {"_id": ObjectId()}) is None
+    insert_many([Foo(), Foo()])
+    assert len(list(iter_objects(Foo, find(Foo)))) == 3
+
+    assert [(e.operation, e.count) for e in events] == [
+        ("insert_one", 1),
+        ("replace_one", 1),
+        ("find_one", 1),
+        ("find_one", 0),
+        ("insert_many", 2),
+        ("iter_objects", 3),
+    ]
+    assert events[0].cls is Foo
+    assert events[0].collection == "foo"
+    assert events[0].size == size
+    assert events[5].size == 3 * size
+    for event in events:
+        assert event.conversion_time >= 0 and event.io_time >= 0
+        assert event.duration == event.conversion_time + event.io_time
+
+
+@pytest.mark.asyncio
+async def test_async_events(events):
+    Foo = make_class(AsyncMemoryDatabase())
+    foo = Foo()
+    await ainsert_one(foo)
+    await afind_one(Foo, {"_id": foo._id})
+    assert [(e.operation, e.count) for e in events] == [
+        ("ainsert_one", 1),
+        ("afind_one", 1),
+    ]
+
+
+def test_remove_listener(events):
+    Foo = make_class(MemoryDatabase())
+    remove_listener(events.append)
+    insert_one(Foo())
+    assert events == []
+    add_listener(events.append)
+
+    with pytest.raises(ValueError):
+        remove_listener(print)
+
+
+def test_listener_error(events, caplog):
+    def fail(event):
+        raise RuntimeError
+
+    Foo = make_class(MemoryDatabase())
+    add_listener(fail)
+    try:
+        insert_one(Foo())
+    finally:
+        remove_listener(fail)
+    assert len(events) == 1
+    assert "failed" in caplog.text
+
+
+def test_opentelemetry_listener():
+    class Span:
+        def end(self, end_time):
+            self.end_time = end_time
+
+    class Tracer:
+        def start_span(self, name, start_time, attributes):
+            self.name = name
+            self.start_time = start_time
+            self.attributes = attributes
+            self.span = Span()
+            return self.span
+
+    tracer = Tracer()
+    listener = OpenTelemetryListener(tracer)
+    listener(
+        OperationEvent(
+            cls=OperationEvent,
+            collection="foo",
+            operation="find_one",
+            conversion_time=0.5,
+            io_time=1.5,
+            count=1,
+            size=10,
+        )
+    )
+    assert tracer.name == "find_one foo"
+    assert tracer.span.end_time - tracer.start_time == 2 * 10**9
+    assert tracer.attributes["db.collection.name"] == "foo"
+    assert tracer.attributes["mongoclasses.io_time"] == 1.5
+    assert tracer.attributes["mongoclasses.document_count"] == 1
@@ -1,33 +1,89 @@
+import array
+import asyncio
+import copy
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import dataclasses as dc
-
-from bson import ObjectId
+from datetime import datetime
+from decimal import Decimal
+import re
+from typing import List, Optional
+
+from bson import Decimal128, ObjectId
+from bson.codec_options import CodecOptions, TypeCodec
+from cattrs.errors import ClassValidationError
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCursor
-from pymongo import MongoClient
+from pymongo import ASCENDING, TEXT, IndexModel, MongoClient
+from pymongo.collation import Collation
+from pymongo.errors import (
+    BulkWriteError,
+    DuplicateKeyError,
+    ServerSelectionTimeoutError,
+)
 from pymongo.cursor import Cursor
 import pytest
 import pytest_asyncio
 from typing_extensions import Annotated
 
 
+import mongoclasses
 from mongoclasses import (
     acreate_indexes,
+    aensure_indexes,
+    aensure_all_indexes,
     ainsert_one,
+    ainsert_many,
+    abulk_save,
+    asave,
     afind_one,
+    afind_by_ids,
+    afetch_fields,
     aupdate_one,
     areplace_one,
     adelete_one,
     mongoclass,
     create_indexes,
+    ensure_indexes,
+    ensure_all_indexes,
     insert_one,
+    insert_many,
     find_one,
+    find_by_ids,
+    fetch_fields,
     update_one,
     replace_one,
     delete_one,
+    bulk_save,
+    save,
     find,
+    find_parallel,
+    find_columns,
+    afind_columns,
+    dump,
+    adump,
+    load,
+    aload,
+    get_collection,
+    to_document,
     iter_objects,
     aiter_objects,
+    aiter_batches,
+    paginate,
+    apaginate,
+    aggregate,
+    aaggregate,
+    lookup,
+    cache_stats,
+    clear_cache,
+    DeveloperError,
     FieldMeta,
+    InsertManyError,
+    LoadError,
+    ReplaceOp,
+    UpdateOp,
+    DeleteOp,
+    WriteBuffer,
 )
+from mongoclasses.memory import MemoryDatabase
 
 
 @pytest.fixture
@@ -52,6 +108,13 @@ async def async_database(async_client):
     return async_client.test_database
 
 
+@pytest.fixture
+def unreachable_database():
+    # Motor cursors are built without a server, and fail once they are read.
+    client = AsyncIOMotorClient("mongodb://localhost:1", serverSelectionTimeoutMS=1)
+    return client.test_database
+
+
 def test_insert_one(database):
     @mongoclass(db=database)
     class Foo:
@@ -73,6 +136,51 @@ async def test_ainsert_one(async_database):
     assert await async_database.foo.find_one({"_id": foo._id}) is not None
 
 
+def test_insert_many(database):
+    @mongoclass(db=database)
+    class Foo:
+        _id: ObjectId = dc.field(default_factory=ObjectId)
+
+    foos = [Foo() for _ in range(5)]
+    result = insert_many(foos, batch_size=2)
+    assert result.inserted_ids == [foo._id for foo in foos]
+    assert database.foo.count_documents({}) == 5
+
+
+def test_insert_many_partial_failure(database):
+    @mongoclass(db=database)
+    class Foo:
+        _id: int = 0
+
+    insert_one(Foo(_id=1))
+    foos = [Foo(_id=0), Foo(_id=1), Foo(_id=2)]
+    with pytest.raises(InsertManyError) as exc_info:
+        insert_many(foos)
+
+    assert exc_info.value.not_inserted == [foos[1]]
+    assert exc_info.value.inserted == [foos[0], foos[2]]
+    assert exc_info.value.details["writeErrors"][0]["index"] == 1
+
+    foos = [Foo(_id=3), Foo(_id=1), Foo(_id=4)]
+    with pytest.raises(InsertManyError) as exc_info:
+        insert_many(foos, ordered=True)
+
+    assert exc_info.value.not_inserted == foos[1:]
+    assert database.foo.find_one({"_id": 4}) is None
+
+
+@pytest.mark.asyncio
+async def test_ainsert_many(async_database):
+    @mongoclass(db=async_database)
+    class Foo:
+        _id: ObjectId = dc.field(default_factory=ObjectId)
+
+    foos = [Foo() for _ in range(5)]
+    result = await ainsert_many(foos, batch_size=2)
+    assert result.inserted_ids == [foo._id for foo in foos]
+    assert await async_database.foo.count_documents({}) == 5
+
+
 def test_update_one(database):
     @mongoclass(db=database)
     class Foo:
@@ -132,6 +240,86 @@ async def test_areplace_one(async_database):
     assert document["bar"] == "baz"
 
 
+def test_save(database):
+    @mongoclass(db=database, track_changes=True)
+    class Foo:
+        _id: ObjectId = dc.field(default_factory=ObjectId)
+        bar: str = ""
+        count: int = 0
+
+    foo = Foo()
+    result = save(foo)
+    assert result.upserted_id == foo._id
+    assert save(foo) is None
+
+    database.foo.update_one({"_id": foo._id}, {"$set": {"bar": "untouched"}})
+    foo.count += 1
+    result = save(foo)
+    assert result.modified_count == 1
+    assert database.foo.find_one({"_id": foo._id}) == {
+        "_id": foo._id,
+        "bar": "untouched",
+        "count": 1,
+    }
+
+    loaded = find_one(Foo, {"_id": foo._id})
+    assert save(loaded) is None
+
+
+def test_save_snapshot(database, monkeypatch):
+    @mongoclass(db=database, track_changes=True)
+    class Foo:
+        _id: int = 0
+        tags: List[str] = dc.field(default_factory=list)
+
+    insert_one(Foo(1, ["a"]))
+    calls = []
+    encode = mongoclasses.encode
+
+    def spy(*args, **kwargs):
+        calls.append(args)
+        return encode(*args, **kwargs)
+
+    # The snapshots of loaded instances are the documents as received.
+    monkeypatch.setattr(mongoclasses, "encode", spy)
+    foo = find_one(Foo, {"_id": 1})
+    assert find_by_ids(Foo, [1]) == [foo]
+    assert paginate(Foo).objects == [foo]
+    assert calls == []
+
+    monkeypatch.undo()
+    assert save(foo) is None
+    foo.tags.append("b")
+    assert save(foo).modified_count == 1
+    assert database.foo.find_one({"_id": 1})["tags"] == ["a", "b"]
+
+
+def test_save_without_tracking(database):
+    @mongoclass(db=database)
+    class Foo:
+        _id: ObjectId = dc.field(default_factory=ObjectId)
+
+    with pytest.raises(DeveloperError):
+        save(Foo())
+
+
+@pytest.mark.asyncio
+async def test_asave(async_database):
+    @mongoclass(db=async_database, track_changes=True)
+    class Foo:
+        _id: ObjectId = dc.field(default_factory=ObjectId)
+        count: int = 0
+
+    foo = Foo()
+    await ainsert_one(foo)
+    assert await asave(foo) is None
+    foo.count = 5
+    result = await asave(foo)
+    assert result.modified_count == 1
+    document = await async_database.foo.find_one({"_id": foo._id})
+    assert document["count"] == 5
+
+
 def test_delete_one(database):
     @mongoclass(db=database)
     class Foo:
@@ -155,6 +343,78 @@ async def test_adelete_one(async_database):
     assert await async_database.foo.find_one({"_id": foo._id}) is None
 
 
+def test_bulk_save(database):
+    @mongoclass(db=database)
+    class Foo:
+        _id: ObjectId = dc.field(default_factory=ObjectId)
+        bar: str = ""
+
+    @mongoclass(db=database)
+    class Baz:
+        _id: ObjectId = dc.field(default_factory=ObjectId)
+
+    foo1, foo2, foo3 = Foo(), Foo(), Foo()
+    insert_one(foo1)
+    insert_one(foo2)
+    foo1.bar = "abc"
+    baz = Baz()
+
+    result = bulk_save(
+        [
+            ReplaceOp(foo1),
+            ReplaceOp(baz, upsert=True),
+            UpdateOp(foo3, {"$set": {"bar": "def"}}, upsert=True),
+            DeleteOp(foo2),
+        ]
+    )
+    assert result.matched_count == 1
+    assert result.upserted_ids == {1: baz._id, 2: foo3._id}
+    assert result.deleted_count == 1
+    assert database.foo.find_one({"_id": foo1._id})["bar"] == "abc"
+    assert database.foo.find_one({"_id": foo2._id}) is None
+    assert database.baz.find_one({"_id": baz._id}) is not None
+
+
+@pytest.mark.asyncio
+async def test_abulk_save(async_database):
+    @mongoclass(db=async_database)
+    class Foo:
+        _id: ObjectId = dc.field(default_factory=ObjectId)
+        bar: str = ""
+
+    foo1, foo2 = Foo(), Foo()
+    await ainsert_one(foo1)
+    await ainsert_one(foo2)
+
+    result = await abulk_save(
+        [UpdateOp(foo1, {"$set": {"bar": "abc"}}), DeleteOp(foo2)]
+    )
+    assert result.modified_count == 1
+    assert result.deleted_count == 1
+
+
+def test_bulk_save_collection_options(database):
+    @mongoclass(db=database, collection_name="foo")
+    class Foo:
+        _id: int = 0
+        name: str = ""
+
+    @mongoclass(db=database, collection_name="foo", codecs=[DecimalCodec()])
+    class Bar:
+        _id: int = 0
+        price: Decimal = Decimal("0")
+
+    # The collections are equal, but only the second one encodes decimals.
+    result = bulk_save(
+        [
+            ReplaceOp(Foo(1, "abc"), upsert=True),
+            ReplaceOp(Bar(2, Decimal("1.5")), upsert=True),
+        ]
+    )
+    assert result.upserted_ids == {0: 1, 1: 2}
+    assert find_one(Bar, {"_id": 2}).price == Decimal("1.5")
+
+
 def test_find_one(database):
     @mongoclass(db=database)
     class Foo:
@@ -182,6 +442,157 @@ async def test_afind_one(async_database):
     assert await afind_one(Foo, {"_id": ObjectId()}) is None
 
 
+def test_find_one_projection(database):
+    @mongoclass(db=database)
+    class Foo:
+        _id: ObjectId = dc.field(default_factory=ObjectId)
+        name: Annotated[str, FieldMeta(db_field="n")] = ""
+        blob: Annotated[bytes, FieldMeta(deferred=True)] = b""
+
+    foo = Foo(name="foo", blob=b"abc")
+    insert_one(foo)
+    database.foo.update_one({"_id": foo._id}, {"$set": {"legacy": 1}})
+
+    loaded = find_one(Foo, {"_id": foo._id})
+    assert "blob" not in vars(loaded)
+    assert loaded.blob == b"abc"
+    assert loaded == foo
+
+    loaded = find_one(Foo, {"_id": foo._id}, only=["name"])
+    assert vars(loaded).keys() >= {"_id", "name"}
+    assert "blob" not in vars(loaded)
+
+    loaded = find_one(Foo, {"_id": foo._id}, exclude=["name"])
+    assert "name" not in vars(loaded)
+    with pytest.raises(DeveloperError):
+        to_document(loaded)
+    fetch_fields(loaded)
+    assert loaded.name == "foo"
+    assert loaded.blob == b"abc"
+
+
+def test_find_one_cache(database):
+    @mongoclass(db=database, cache_size=10)
+    class Foo:
+        _id: ObjectId = dc.field(default_factory=ObjectId)
+        name: str = ""
+
+    foo = Foo(name="foo")
+    insert_one(foo)
+    assert find_one(Foo, {"_id": foo._id}) == foo
+
+    database.foo.update_one({"_id": foo._id}, {"$set": {"name": "direct"}})
+    cached = find_one(Foo, {"_id": foo._id})
+    assert cached.name == "foo"
+    cached.name = "mutated"
+    assert find_one(Foo, {"_id": foo._id}).name == "foo"
+    assert find_one(Foo, {"name": "direct"}).name == "direct"
+
+    update_one(foo, {"$set": {"name": "updated"}})
+    assert find_one(Foo, {"_id": foo._id}).name == "updated"
+
+    foo.name = "replaced"
+    replace_one(foo)
+    database.foo.update_one({"_id": foo._id}, {"$set": {"name": "direct"}})
+    assert find_one(Foo, {"_id": foo._id}).name == "replaced"
+
+    delete_one(foo)
+    assert find_one(Foo, {"_id": foo._id}) is None
+
+    stats = cache_stats(Foo)
+    assert (stats.hits, stats.misses, stats.size) == (3, 3, 0)
+    clear_cache(Foo)
+
+    @mongoclass(db=database)
+    class Bar:
+        _id: int = 0
+
+    with pytest.raises(DeveloperError):
+        cache_stats(Bar)
+
+    @mongoclass(db=database, cache_size=10)
+    class Baz:
+        _id: str = ""
+
+    insert_many([Baz("ab"), Baz("ac")])
+    assert find_one(Baz, {"_id": re.compile("^ab")}) == Baz("ab")
+    assert find_one(Baz, {"_id": "ac"}) == Baz("ac")
+    assert cache_stats(Baz).size == 1
+
+
+@pytest.mark.asyncio
+async def test_afind_one_cache(async_database):
+    @mongoclass(db=async_database, cache_size=10, cache_ttl=60)
+    class Foo:
+        _id: ObjectId = dc.field(default_factory=ObjectId)
+        name: str = ""
+
+    foo = Foo(name="foo")
+    await ainsert_one(foo)
+    assert await afind_one(Foo, {"_id": foo._id}) == foo
+    await aupdate_one(foo, {"$set": {"name": "updated"}})
+    assert (await afind_one(Foo, {"_id": foo._id})).name == "updated"
+    await adelete_one(foo)
+    assert await afind_one(Foo, {"_id": foo._id}) is None
+    assert cache_stats(Foo).hits == 0
+
+
+def test_find_by_ids(database):
+    @mongoclass(db=database)
+    class Foo:
+        _id: int = 0
+
+    insert_many([Foo(1), Foo(2)])
+    assert find_by_ids(Foo, [2, 3, 1]) == [Foo(2), None, Foo(1)]
+    assert find_by_ids(Foo, []) == []
+
+
+@pytest.mark.asyncio
+async def test_afind_by_ids(async_database):
+    @mongoclass(db=async_database)
+    class Foo:
+        _id: int = 0
+
+    await ainsert_many([Foo(1), Foo(2)])
+    assert await afind_by_ids(Foo, [2, 3, 1]) == [Foo(2), None, Foo(1)]
+
+
+@pytest.mark.asyncio
+async def test_afind_one_batched(async_database):
+    @mongoclass(db=async_database, batch_window=0)
+    class Foo:
+        _id: int = 0
+        tags: List[str] = dc.field(default_factory=list)
+
+    await ainsert_many([Foo(1, ["a"]), Foo(2)])
+    results = await asyncio.gather(
+        afind_one(Foo, {"_id": 1}),
+        afind_one(Foo, {"_id": 3}),
+        afind_one(Foo, {"_id": 1}),
+        afind_one(Foo, {"tags": []}),
+    )
+    assert results == [Foo(1, ["a"]), None, Foo(1, ["a"]), Foo(2)]
+    assert results[0].tags is not results[2].tags
+
+
+@pytest.mark.asyncio
+async def test_afind_one_projection(async_database):
+    @mongoclass(db=async_database)
+    class Foo:
+        _id: ObjectId = dc.field(default_factory=ObjectId)
+        blob: Annotated[bytes, FieldMeta(deferred=True)] = b""
+
+    foo = Foo(blob=b"abc")
+    await ainsert_one(foo)
+
+    loaded = await afind_one(Foo, {"_id": foo._id})
+    with pytest.raises(AttributeError):
+        loaded.blob
+
+    await afetch_fields(loaded, "blob")
+    assert loaded.blob == b"abc"
+
+
 def test_find(database):
     @mongoclass(db=database)
     class Foo:
@@ -227,6 +638,313 @@ async def test_aiter_objects(async_database):
         assert isinstance(obj, Foo)
 
 
+@pytest.mark.asyncio
+async def test_aiter_objects_motor_cursor(unreachable_database):
+    @mongoclass(db=unreachable_database)
+    class Foo:
+        _id: ObjectId = dc.field(default_factory=ObjectId)
+        name: str = ""
+
+    # Motor cursors cannot be hashed.
+    cursor = find(Foo, only=["name"])
+    assert isinstance(cursor, AsyncIOMotorCursor)
+    with pytest.raises(ServerSelectionTimeoutError):
+        async for _ in aiter_objects(Foo, cursor):
+            pass
+
+
+def test_iter_objects_partial(database):
+    @mongoclass(db=database)
+    class Foo:
+        _id: ObjectId = dc.field(default_factory=ObjectId)
+        name: str = ""
+        description: str = ""
+
+    foo = Foo(name="foo", description="bar")
+    insert_one(foo)
+    cursor = find(Foo, {"_id": foo._id}, only=["name"])
+
+    objs = list(iter_objects(Foo, cursor))
+    assert "description" not in vars(objs[0])
+    assert objs[0].name == "foo"
+    assert objs[0].description == "bar"
+
+
+def test_iter_objects_lazy(database):
+    @dc.dataclass
+    class Bar:
+        value: int = 0
+
+    @mongoclass(db=database)
+    class Foo:
+        _id: ObjectId = dc.field(default_factory=ObjectId)
+        name: str = ""
+        bar: Bar = dc.field(default_factory=Bar)
+        tags: List[str] = dc.field(default_factory=list)
+
+    foo = Foo(name="foo", bar=Bar(value=1), tags=["a", "b"])
+    insert_one(foo)
+    cursor = find(Foo, {"_id": foo._id}, lazy=True)
+
+    objs = list(iter_objects(Foo, cursor))
+    assert vars(objs[0]).keys() >= {"_id", "name"}
+    assert "bar" not in vars(objs[0])
+    assert objs[0].bar == Bar(value=1)
+    assert objs[0] == foo
+
+    # The raw values are converted without fetching the document again.
+    obj = next(iter_objects(Foo, find(Foo, {"_id": foo._id}, lazy=True)))
+    other = copy.copy(obj)
+    database.foo.delete_one({"_id": foo._id})
+    assert to_document(obj) == to_document(foo)
+    assert other.bar == Bar(value=1)
+    assert other.tags == ["a", "b"]
+
+
+@pytest.mark.asyncio
+async def test_aiter_objects_lazy(async_database):
+    @dc.dataclass
+    class Bar:
+        value: int = 0
+
+    @mongoclass(db=async_database)
+    class Foo:
+        _id: ObjectId = dc.field(default_factory=ObjectId)
+        bar: Bar = dc.field(default_factory=Bar)
+
+    foo = Foo(bar=Bar(value=1))
+    await ainsert_one(foo)
+    cursor = find(Foo, {"_id": foo._id}, lazy=True)
+
+    async for obj in aiter_objects(Foo, cursor):
+        assert obj.bar == Bar(value=1)
+
+
+@pytest.mark.asyncio
+async def test_aiter_objects_batches(async_database):
+    @mongoclass(db=async_database)
+    class Foo:
+        _id: int = 0
+
+    await ainsert_many([Foo(i) for i in range(25)])
+
+    cursor = find(Foo, sort=[("_id", 1)])
+    objs = [obj async for obj in aiter_objects(Foo, cursor, batch_size=10, prefetch=2)]
+    assert objs == [Foo(i) for i in range(25)]
+
+    with ThreadPoolExecutor() as executor:
+        cursor = find(Foo, sort=[("_id", 1)])
+        batches = aiter_batches(Foo, cursor, batch_size=10, executor=executor)
+        assert [len(objs) async for objs in batches] == [10, 10, 5]
+
+    with pytest.raises(DeveloperError):
+        async for _ in aiter_batches(Foo, find(Foo), batch_size=0):
+            pass
+
+
+@pytest.mark.asyncio
+async def test_aiter_batches_motor_cursor(unreachable_database):
+    @mongoclass(db=unreachable_database)
+    class Foo:
+        _id: int = 0
+
+    with pytest.raises(ServerSelectionTimeoutError):
+        async for _ in aiter_batches(Foo, find(Foo), batch_size=10):
+            pass
+
+
+@mongoclass(db=MemoryDatabase())
+class Parallel:
+    # Defined at the top level so that worker processes can import it. The
+    # in-memory database keeps the import of this module from connecting to
+    # a server; the workers only structure the batches they are sent.
+    _id: int = 0
+
+
+def count_objects(objs):
+    return len(objs)
+
+
+def test_find_parallel(database):
+    get_collection(Parallel).delete_many({})
+    insert_many([Parallel(i) for i in range(50)])
+
+    with ProcessPoolExecutor(2) as executor:
+        objs = find_parallel(
+            Parallel, sort=[("_id", 1)], batch_size=10, executor=executor
+        )
+        assert list(objs) == [Parallel(i) for i in range(50)]
+
+        counts = find_parallel(
+            Parallel,
+            batch_size=10,
+            executor=executor,
+            ordered=False,
+            reduce=count_objects,
+        )
+        assert list(counts) == [10] * 5
+
+    @mongoclass(db=database)
+    class Foo:
+        _id: int = 0
+
+    with pytest.raises(DeveloperError):
+        find_parallel(Foo)
+
+
+def make_columns_class(db):
+    @mongoclass(db=db, collection_name="columns")
+    class Foo:
+        _id: int = 0
+        name: Annotated[str, FieldMeta(db_field="n")] = ""
+        score: Optional[float] = None
+        active: bool = False
+        created: datetime = datetime(1970, 1, 1)
+        tags: List[str] = dc.field(default_factory=list)
+
+    return Foo
+
+
+def test_find_columns(database):
+    Foo = make_columns_class(database)
+    created = datetime(2024, 1, 1)
+    insert_many(
+        [
+            Foo(i, f"foo {i}", i / 2 if i % 2 else None, i % 2 == 0, created, ["a"])
+            for i in range(5)
+        ]
+    )
+    # Stored with a BSON type that does not match the field.
+    get_collection(Foo).insert_one({"_id": 5, "score": 3})
+
+    batches = list(
+        find_columns(
+            Foo,
+            {"_id": {"$gte": 1}},
+            fields=["_id", "name", "score", "active", "created", "tags"],
+            sort=[("_id", 1)],
+            batch_size=2,
+        )
+    )
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    columns = {
+        name: [value for batch in batches for value in batch.columns[name]]
+        for name in batches[0].columns
+    }
+    nulls = {
+        name: [value for batch in batches for value in batch.nulls[name]]
+        for name in batches[0].nulls
+    }
+    assert isinstance(batches[0].columns["_id"], array.array)
+    assert columns["_id"] == [1, 2, 3, 4, 5]
+    assert columns["name"] == ["foo 1", "foo 2", "foo 3", "foo 4", None]
+    assert columns["score"] == [0.5, 0, 1.5, 0, 3.0]
+    assert nulls["score"] == [0, 1, 0, 1, 0]
+    assert columns["active"] == [0, 1, 0, 1, 0]
+    assert nulls["active"] == [0, 0, 0, 0, 1]
+    assert columns["created"][0] == 1704067200000
+    assert columns["tags"][:4] == [["a"]] * 4
+
+    batch = next(find_columns(Foo, fields=["score"]))
+    assert list(batch.columns) == ["score"]
+    assert len(batch) == 6
+
+    with pytest.raises(DeveloperError):
+        next(find_columns(Foo, fields=["missing"]))
+
+
+@pytest.mark.asyncio
+async def test_afind_columns(async_database):
+    Foo = make_columns_class(async_database)
+    await get_collection(Foo).insert_many([{"_id": i, "n": str(i)} for i in range(3)])
+    batches = [
+        batch
+        async for batch in afind_columns(Foo, fields=["name"], batch_size=2)
+    ]
+    assert [batch.columns["name"] for batch in batches] == [["0", "1"], ["2"]]
+
+
+@pytest.mark.parametrize("name", ["foo.bson", "foo.bson.gz", "foo.jsonl"])
+def test_dump_load(database, tmp_path, name):
+    Foo = make_columns_class(database)
+    created = datetime(2024, 1, 1)
+    foos = [Foo(i, str(i), i / 2, created=created, tags=["a"]) for i in range(5)]
+    insert_many(foos)
+
+    path = tmp_path / name
+    assert dump(Foo, path, filter={"_id": {"$lt": 4}}, batch_size=2) == 4
+    get_collection(Foo).delete_many({})
+    assert load(Foo, path, batch_size=3) == 4
+    assert list(iter_objects(Foo, find(Foo, sort=[("_id", 1)]))) == foos[:4]
+
+    get_collection(Foo).delete_many({"_id": {"$in": [1, 3]}})
+    with pytest.raises(BulkWriteError) as exc_info:
+        load(Foo, path, batch_size=3, validate=True)
+    details = exc_info.value.details
+    assert details["nInserted"] == 2
+    assert [error["index"] for error in details["writeErrors"]] == [0, 2]
+
+
+def test_load_validate(database, tmp_path):
+    Foo = make_columns_class(database)
+    path = tmp_path / "foo.jsonl"
+    path.write_text('{"_id": 1, "score": 1}\n\n{"_id": 2, "score": "x"}\n')
+    with pytest.raises(LoadError) as info:
+        load(Foo, path, batch_size=1, validate=True)
+    assert info.value.index == 1
+    assert info.value.details["nInserted"] == 1
+    assert isinstance(info.value.__cause__, ClassValidationError)
+    get_collection(Foo).delete_many({})
+    assert load(Foo, path) == 2
+
+    with pytest.raises(DeveloperError):
+        dump(Foo, tmp_path / "foo.csv")
+
+    path = tmp_path / "foo.bson"
+    dump(Foo, path)
+    path.write_bytes(path.read_bytes()[:-3])
+    get_collection(Foo).delete_many({})
+    with pytest.raises(ValueError):
+        load(Foo, path)
+
+
+@pytest.mark.asyncio
+async def test_adump_aload(async_database, tmp_path):
+    Foo = make_columns_class(async_database)
+    await get_collection(Foo).insert_many([{"_id": i, "n": str(i)} for i in range(3)])
+    path = tmp_path / "foo.bson.gz"
+    assert await adump(Foo, path, batch_size=2) == 3
+    await get_collection(Foo).delete_many({})
+    assert await aload(Foo, path, validate=True) == 3
+    assert await get_collection(Foo).count_documents({}) == 3
+
+
+class DecimalCodec(TypeCodec):
+    python_type = Decimal
+    bson_type = Decimal128
+
+    def transform_python(self, value):
+        return Decimal128(value)
+
+    def transform_bson(self, value):
+        return value.to_decimal()
+
+
+def test_codecs(database):
+    @mongoclass(db=database, codecs=[DecimalCodec()])
+    class Foo:
+        _id: int = 0
+        price: Decimal = Decimal("0")
+
+    foo = Foo(1, Decimal("1.5"))
+    insert_one(foo)
+    assert find_one(Foo, {"price": Decimal("1.5")}) == foo
+    update_one(foo, {"$set": {"price": Decimal("2.5")}})
+    assert find_one(Foo, {"_id": 1}).price == Decimal("2.5")
+    raw = get_collection(Foo).with_options(codec_options=CodecOptions())
+    assert raw.find_one({"_id": 1})["price"] == Decimal128("2.5")
+
+
 def test_create_indexes(database):
     @mongoclass(db=database)
     class Foo:
@@ -244,3 +962,346 @@ async def test_acreate_indexes(async_database):
         name: Annotated[str, FieldMeta(unique=True)] = ""
 
     assert await acreate_indexes(Foo) == ["name_1"]
+
+
+def test_ensure_indexes(database):
+    @mongoclass(db=database)
+    class Foo:
+        _id: ObjectId = dc.field(default_factory=ObjectId)
+        name: Annotated[str, FieldMeta(unique=True)] = ""
+        age: Annotated[int, FieldMeta(index=-1, sparse=True)] = 0
+
+    database.foo.create_index("legacy")
+    report = ensure_indexes(Foo)
+    assert report.created == ["name_1", "age_-1"]
+    assert report.existing == []
+    assert report.extra == ["legacy_1"]
+
+    report = ensure_indexes(Foo)
+    assert report.created == []
+    assert report.existing == ["name_1", "age_-1"]
+
+    @mongoclass(db=database)
+    class Bar:
+        _id: ObjectId = dc.field(default_factory=ObjectId)
+        name: Annotated[str, FieldMeta(unique=True)] = ""
+
+    reports = ensure_all_indexes([Foo, Bar])
+    assert reports[Foo].existing == ["name_1", "age_-1"]
+    assert reports[Bar].created == ["name_1"]
+
+
+def test_diff_indexes_text():
+    declared = [
+        IndexModel([("title", TEXT), ("body", TEXT)], weights={"title": 10}),
+        IndexModel([("tag", ASCENDING), ("$**", TEXT)], name="tag_text"),
+    ]
+    # As listed by the server.
+    current = [
+        {
+            "v": 2,
+            "key": {"_fts": "text", "_ftsx": 1},
+            "name": "title_text_body_text",
+            "weights": {"body": 1, "title": 10},
+            "default_language": "english",
+            "language_override": "language",
+            "textIndexVersion": 3,
+        },
+        {
+            "v": 2,
+            "key": {"tag": 1, "_fts": "text", "_ftsx": 1},
+            "name": "tag_text",
+            "weights": {"$**": 1},
+            "default_language": "french",
+            "language_override": "language",
+            "textIndexVersion": 3,
+        },
+    ]
+    missing, existing, extra = mongoclasses._diff_indexes(declared, current)
+    assert missing == [declared[1]]
+    assert existing == ["title_text_body_text"]
+    assert extra == []
+
+
+def test_diff_indexes_collation():
+    declared = [
+        IndexModel("name", collation=Collation("fr", strength=2)),
+        IndexModel("city", collation=Collation("simple")),
+        IndexModel("age", collation=Collation("en")),
+    ]
+    defaults = {
+        "caseLevel": False,
+        "caseFirst": "off",
+        "numericOrdering": False,
+        "alternate": "non-ignorable",
+        "maxVariable": "punct",
+        "normalization": False,
+        "backwards": False,
+        "version": "57.1",
+    }
+    current = [
+        {
+            "v": 2,
+            "key": {"name": 1},
+            "name": "name_1",
+            "collation": {"locale": "fr", "strength": 2, **defaults},
+        },
+        {"v": 2, "key": {"city": 1}, "name": "city_1"},
+        {
+            "v": 2,
+            "key": {"age": 1},
+            "name": "age_1",
+            "collation": {"locale": "en", "strength": 1, **defaults},
+        },
+    ]
+    missing, existing, extra = mongoclasses._diff_indexes(declared, current)
+    assert missing == [declared[2]]
+    assert existing == ["name_1", "city_1"]
+
+
+@pytest.mark.asyncio
+async def test_aensure_indexes(async_database):
+    @mongoclass(db=async_database)
+    class Foo:
+        _id: ObjectId = dc.field(default_factory=ObjectId)
+        name: Annotated[str, FieldMeta(unique=True)] = ""
+
+    report = await aensure_indexes(Foo)
+    assert report.created == ["name_1"]
+    assert (await aensure_indexes(Foo)).existing == ["name_1"]
+
+    reports = await aensure_all_indexes([Foo])
+    assert reports[Foo].created == []
+
+
+def test_paginate(database):
+    @mongoclass(db=database)
+    class Foo:
+        _id: int = 0
+        name: Annotated[str, FieldMeta(db_field="n")] = ""
+        age: int = 0
+
+    names = ["a", "b", "b", "c", "d", "d", "d"]
+    insert_many([Foo(_id=i, name=name, age=i) for i, name in enumerate(names)])
+
+    pages = []
+    token = None
+    while True:
+        page = paginate(
+            Foo,
+            {"age": {"$gte": 1}},
+            sort=[("name", -1)],
+            limit=2,
+            after=token,
+        )
+        pages.append([foo._id for foo in page.objects])
+        token = page.next
+        if token is None:
+            break
+    assert pages == [[6, 5], [4, 3], [2, 1]]
+
+    page = paginate(Foo, limit=10)
+    assert [foo._id for foo in page.objects] == list(range(7))
+    assert page.next is None
+
+    with pytest.raises(ValueError):
+        paginate(Foo, sort=[("age", 1)], after=paginate(Foo, limit=1).next)
+    with pytest.raises(ValueError):
+        paginate(Foo, after="invalid")
+    with pytest.raises(DeveloperError):
+        paginate(Foo, limit=0)
+    with pytest.raises(DeveloperError):
+        paginate(Foo, sort=[("missing", 1)])
+
+
+def test_paginate_deferred(database):
+    @mongoclass(db=database)
+    class Foo:
+        _id: int = 0
+        rank: Annotated[int, FieldMeta(deferred=True)] = 0
+
+    insert_many([Foo(_id=i, rank=-i) for i in range(3)])
+    page = paginate(Foo, sort=[("rank", 1)], limit=2)
+    assert [foo._id for foo in page.objects] == [2, 1]
+    page = paginate(Foo, sort=[("rank", 1)], limit=2, after=page.next)
+    assert [foo._id for foo in page.objects] == [0]
+
+
+@pytest.mark.asyncio
+async def test_apaginate(async_database):
+    @mongoclass(db=async_database)
+    class Foo:
+        _id: int = 0
+        age: int = 0
+
+    await ainsert_many([Foo(_id=i, age=i % 2) for i in range(5)])
+    page = await apaginate(Foo, sort=[("age", 1)], limit=3)
+    assert [foo._id for foo in page.objects] == [0, 2, 4]
+    page = await apaginate(Foo, sort=[("age", 1)], limit=3, after=page.next)
+    assert [foo._id for foo in page.objects] == [1, 3]
+    assert page.next is None
+
+
+@pytest.mark.asyncio
+async def test_apaginate_motor_cursor(unreachable_database):
+    @mongoclass(db=unreachable_database)
+    class Foo:
+        _id: int = 0
+        rank: Annotated[int, FieldMeta(deferred=True)] = 0
+
+    with pytest.raises(ServerSelectionTimeoutError):
+        await apaginate(Foo, sort=[("rank", 1)])
+
+
+def test_aggregate(database):
+    @mongoclass(db=database)
+    class Author:
+        _id: int = 0
+        name: Annotated[str, FieldMeta(db_field="n")] = ""
+
+    @mongoclass(db=database)
+    class Book:
+        _id: int = 0
+        title: Annotated[str, FieldMeta(db_field="t")] = ""
+        author_id: int = 0
+
+    @dc.dataclass
+    class AuthorBooks:
+        _id: int
+        books: List[Book]
+
+    @dc.dataclass
+    class Count:
+        total: int
+
+    insert_many([Author(_id=1, name="a"), Author(_id=2, name="b")])
+    insert_many([Book(_id=i, title=str(i), author_id=i % 2 + 1) for i in range(3)])
+
+    results = list(aggregate(Book, [{"$match": {"author_id": 1}}]))
+    assert results == [
+        Book(_id=0, title="0", author_id=1),
+        Book(_id=2, title="2", author_id=1),
+    ]
+
+    pipeline = [
+        {"$sort": {"_id": 1}},
+        lookup(Book, "_id", "author_id", "books"),
+        {"$project": {"n": 0}},
+    ]
+    results = list(
+        aggregate(
+            Author,
+            pipeline,
+            result_cls=AuthorBooks,
+            allow_disk_use=True,
+            batch_size=1,
+        )
+    )
+    assert [r._id for r in results] == [1, 2]
+    assert [book._id for book in results[0].books] == [0, 2]
+    assert [book.title for book in results[0].books] == ["0", "2"]
+    assert all(isinstance(book, Book) for book in results[0].books)
+
+    stage = lookup(Author, "author_id", "name", "author")
+    assert stage["$lookup"]["from"] == "author"
+    assert stage["$lookup"]["foreignField"] == "n"
+
+    assert list(aggregate(Book, [{"$count": "total"}], result_cls=Count)) == [Count(3)]
+
+
+@pytest.mark.asyncio
+async def test_aaggregate(async_database):
+    @mongoclass(db=async_database)
+    class Foo:
+        _id: int = 0
+        age: int = 0
+
+    await ainsert_many([Foo(_id=i, age=i) for i in range(4)])
+    results = [
+        foo async for foo in aaggregate(Foo, [{"$match": {"age": {"$gte": 2}}}])
+    ]
+    assert results == [Foo(_id=2, age=2), Foo(_id=3, age=3)]
+    with pytest.raises(TypeError):
+        aggregate(Foo, [])
+
+
+@pytest.mark.asyncio
+async def test_write_buffer(async_database, monkeypatch):
+    @mongoclass(db=async_database)
+    class Foo:
+        _id: int = 0
+        count: int = 0
+        name: str = ""
+
+    writes = []
+    collection = Foo.__mongoclass_config__.collection
+    original = collection.bulk_write
+
+    async def bulk_write(requests, **kwargs):
+        writes.append(len(requests))
+        return await original(requests, **kwargs)
+
+    monkeypatch.setattr(collection, "bulk_write", bulk_write)
+    async with WriteBuffer(Foo, window=60) as buffer:
+        foos = [Foo(_id=i) for i in range(3)]
+        results = await asyncio.gather(
+            *[buffer.insert_one(foo) for foo in foos],
+            buffer.update_one(foos[0], {"$inc": {"count": 1}}),
+            buffer.update_one(foos[0], {"$inc": {"count": 2}}),
+            buffer.update_one(foos[0], {"$set": {"name": "a"}}),
+            buffer.update_one(foos[1], {"$set": {"count": 5}}),
+            buffer.update_one(foos[1], {"$inc": {"count": 1}}),
+            buffer.update_one(Foo(_id=9), {"$set": {"name": "b"}}),
+            buffer.flush(),
+        )
+
+    assert writes == [7]
+    assert [result.inserted_id for result in results[:3]] == [0, 1, 2]
+    assert [result.matched_count for result in results[3:9]] == [1, 1, 1, 1, 1, 0]
+    assert results[3] is not results[4]
+    documents = await async_database.foo.find().sort("_id").to_list(None)
+    assert documents == [
+        {"_id": 0, "count": 3, "name": "a"},
+        {"_id": 1, "count": 6, "name": ""},
+        {"_id": 2, "count": 0, "name": ""},
+    ]
+
+    async with WriteBuffer(Foo, max_size=2, max_pending=1) as buffer:
+        results = await asyncio.gather(
+            buffer.insert_one(Foo(_id=3)),
+            buffer.insert_one(Foo(_id=0)),
+            buffer.insert_one(Foo(_id=4)),
+            return_exceptions=True,
+        )
+    assert isinstance(results[1], DuplicateKeyError)
+    assert results[0].inserted_id == 3 and results[2].inserted_id == 4
+
+    with pytest.raises(DeveloperError):
+        await buffer.insert_one(Foo(_id=5))
+    with pytest.raises(DeveloperError):
+        WriteBuffer(Foo, max_size=0)
+
+
+@pytest.mark.asyncio
+async def test_write_buffer_close(async_database, monkeypatch):
+    @mongoclass(db=async_database)
+    class Foo:
+        _id: int = 0
+
+    started = asyncio.Event()
+    collection = Foo.__mongoclass_config__.collection
+    original = collection.bulk_write
+
+    async def bulk_write(requests, **kwargs):
+        started.set()
+        await asyncio.sleep(0.01)
+        return await original(requests, **kwargs)
+
+    monkeypatch.setattr(collection, "bulk_write", bulk_write)
+    buffer = WriteBuffer(Foo, max_size=1)
+    task = asyncio.ensure_future(buffer.insert_one(Foo(_id=1)))
+    await started.wait()
+    # The batch is being written, and no longer queued.
+    await buffer.close()
+    assert await async_database.foo.find_one() == {"_id": 1}
+    assert (await task).inserted_id == 1
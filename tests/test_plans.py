@@ -0,0 +1,158 @@
+import dataclasses as dc
+from typing_extensions import Annotated
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import ServerSelectionTimeoutError
+import pytest
+
+from mongoclasses import (
+    FieldMeta,
+    QueryPlanError,
+    QueryPlanWarning,
+    aexplain,
+    afind_one,
+    aiter_objects,
+    ensure_indexes,
+    explain,
+    find,
+    find_one,
+    insert_one,
+    mongoclass,
+    set_plan_guard,
+)
+from mongoclasses._plans import Suggester, parse_plan
+from mongoclasses.memory import AsyncMemoryDatabase, MemoryDatabase
+
+
+@pytest.fixture
+def guard():
+    def set(mode):
+        set_plan_guard(mode)
+
+    yield set
+    set_plan_guard(None)
+
+
+def make_class(db):
+    @mongoclass(
+        db=db,
+        collection_name="foo",
+        indexes=[IndexModel([("user_name", ASCENDING), ("age", DESCENDING)])],
+    )
+    class Foo:
+        _id: ObjectId = dc.field(default_factory=ObjectId)
+        name: Annotated[str, FieldMeta(db_field="user_name")] = ""
+        age: int = 0
+        city: str = ""
+
+    return Foo
+
+
+def test_explain():
+    Foo = make_class(MemoryDatabase())
+    plan = explain(Foo, {"city": "Paris"}, sort=[("age", ASCENDING)])
+    assert plan.collection_scan and plan.in_memory_sort
+    assert not plan.ok
+    assert plan.stages == ["SORT", "COLLSCAN"]
+    assert "Foo.city, Foo.age" in plan.suggestion
+    assert "IndexModel([('city', 1), ('age', 1)])" in plan.suggestion
+
+    plan = explain(Foo, {"user_name": "bob"})
+    assert "'user_name_1_age_-1' is declared" in plan.suggestion
+    assert "ensure_indexes()" in plan.suggestion
+
+    ensure_indexes(Foo)
+    plan = explain(Foo, {"user_name": "bob"}, sort=[("age", DESCENDING)], limit=1)
+    assert plan.ok and plan.suggestion is None
+    assert plan.stages == ["LIMIT", "FETCH", "IXSCAN"]
+    assert plan.indexes == ["user_name_1_age_-1"]
+
+
+@pytest.mark.asyncio
+async def test_aexplain():
+    Foo = make_class(AsyncMemoryDatabase())
+    plan = await aexplain(Foo, {"city": "Paris"})
+    assert plan.collection_scan and not plan.in_memory_sort
+    with pytest.raises(TypeError):
+        explain(Foo)
+
+
+def test_plan_guard(guard):
+    Foo = make_class(MemoryDatabase())
+    foo = Foo(name="bob")
+    insert_one(foo)
+
+    guard("warn")
+    with pytest.warns(QueryPlanWarning, match="Foo.city"):
+        find(Foo, {"city": "Paris"})
+    with pytest.warns(QueryPlanWarning, match="find_one"):
+        find_one(Foo, {"user_name": "bob"})
+
+    guard("raise")
+    with pytest.raises(QueryPlanError) as exc_info:
+        find(Foo, {"age": {"$gt": 1}})
+    assert exc_info.value.plan.collection_scan
+
+    ensure_indexes(Foo)
+    assert find_one(Foo, {"user_name": "bob"}) == foo
+    assert find_one(Foo, {"_id": foo._id}) == foo
+
+    with pytest.raises(Exception):
+        set_plan_guard("error")
+
+
+@pytest.mark.asyncio
+async def test_async_plan_guard(guard):
+    Foo = make_class(AsyncMemoryDatabase())
+    guard("raise")
+    with pytest.raises(QueryPlanError):
+        await afind_one(Foo, {"city": "Paris"})
+
+    cursor = find(Foo, {"city": "Paris"})
+    with pytest.raises(QueryPlanError):
+        async for _ in aiter_objects(Foo, cursor):
+            pass
+
+
+@pytest.mark.asyncio
+async def test_motor_plan_guard(guard):
+    # Motor cursors cannot be hashed, and fail once they are explained.
+    client = AsyncIOMotorClient("mongodb://localhost:1", serverSelectionTimeoutMS=1)
+    Foo = make_class(client.test_database)
+    guard("warn")
+    cursor = find(Foo, {"city": "Paris"})
+    with pytest.raises(ServerSelectionTimeoutError):
+        async for _ in aiter_objects(Foo, cursor):
+            pass
+
+
+def test_parse_server_plan():
+    explanation = {
+        "queryPlanner": {
+            "winningPlan": {
+                "queryPlan": {
+                    "stage": "SORT",
+                    "sortPattern": {"age": 1},
+                    "inputStage": {
+                        "stage": "FETCH",
+                        "inputStage": {
+                            "stage": "IXSCAN",
+                            "keyPattern": {"city": 1},
+                            "indexName": "city_1",
+                        },
+                    },
+                },
+            },
+        },
+        "ok": 1.0,
+    }
+    suggester = Suggester(
+        "Foo", "foo", {}, [], {"city": "Paris"}, [("age", ASCENDING)]
+    )
+    plan = parse_plan(explanation, suggester)
+    assert plan.stages == ["SORT", "FETCH", "IXSCAN"]
+    assert plan.indexes == ["city_1"]
+    assert plan.in_memory_sort and not plan.collection_scan
+    assert "IndexModel([('city', 1), ('age', 1)])" in plan.suggestion
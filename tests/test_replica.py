@@ -0,0 +1,223 @@
+import asyncio
+import dataclasses as dc
+import functools
+from itertools import islice
+import threading
+import time
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient
+from pymongo.errors import ServerSelectionTimeoutError
+import pytest
+import pytest_asyncio
+from typing_extensions import Annotated
+
+from mongoclasses import (
+    DeveloperError,
+    FieldMeta,
+    awatch,
+    delete_one,
+    get_collection,
+    insert_one,
+    mongoclass,
+    replace_one,
+    update_one,
+    watch,
+)
+from mongoclasses import memory
+from mongoclasses.memory import AsyncMemoryDatabase, MemoryDatabase
+from mongoclasses.replica import AsyncReplica, Replica
+
+
+@functools.lru_cache(maxsize=None)
+def replica_set_unavailable():
+    """
+    Returns why the local server cannot be used, or None.
+    """
+    client = MongoClient(serverSelectionTimeoutMS=1000)
+    try:
+        hello = client.admin.command("hello")
+    except ServerSelectionTimeoutError:
+        return "No local MongoDB server."
+    finally:
+        client.close()
+    if "setName" not in hello:
+        return "Change streams require a replica set."
+    return None
+
+
+def replica_set_client(client_class):
+    reason = replica_set_unavailable()
+    if reason is not None:
+        pytest.skip(reason)
+    return client_class()
+
+
+@pytest.fixture(params=["memory", "replica_set"])
+def database(request):
+    if request.param == "memory":
+        return MemoryDatabase()
+    client = replica_set_client(MongoClient)
+    client.drop_database("test_replica")
+    return client.test_replica
+
+
+@pytest_asyncio.fixture(params=["memory", "replica_set"])
+async def async_database(request):
+    if request.param == "memory":
+        return AsyncMemoryDatabase()
+    client = replica_set_client(AsyncIOMotorClient)
+    await client.drop_database("test_replica")
+    return client.test_replica
+
+
+def make_class(db):
+    @mongoclass(db=db, collection_name="foo")
+    class Foo:
+        _id: ObjectId = dc.field(default_factory=ObjectId)
+        code: Annotated[str, FieldMeta(unique=True, db_field="c")] = ""
+        name: str = ""
+
+    return Foo
+
+
+def test_watch(database):
+    Foo = make_class(database)
+    token = get_collection(Foo).watch().resume_token
+    foo = Foo(code="a")
+    insert_one(foo)
+    update_one(foo, {"$set": {"name": "b"}})
+    replace_one(Foo(_id=foo._id, code="c"))
+    delete_one(foo)
+
+    events = list(islice(watch(Foo, resume_after=token), 4))
+    assert [event.operation for event in events] == [
+        "insert",
+        "update",
+        "replace",
+        "delete",
+    ]
+    assert all(event.id == foo._id for event in events)
+    assert events[0].obj == foo
+    # The current document is looked up, and it was deleted since.
+    assert events[1].obj is None
+    assert events[1].updated_fields == {"name": "b"}
+    assert events[2].obj == Foo(_id=foo._id, code="c")
+    assert events[3].obj is None
+
+    events = watch(Foo, resume_after=events[2].resume_token)
+    assert next(events).operation == "delete"
+    events.close()
+
+
+@pytest.mark.asyncio
+async def test_awatch(async_database):
+    Foo = make_class(async_database)
+    events = awatch(Foo, [{"$match": {"operationType": "insert"}}])
+    task = asyncio.ensure_future(events.__anext__())
+    # Lets the change stream open before the insert.
+    await asyncio.sleep(0.1)
+    await get_collection(Foo).insert_one({"c": "a"})
+    event = await asyncio.wait_for(task, 5)
+    assert event.obj.code == "a"
+    await events.aclose()
+
+
+def test_replica(database):
+    Foo = make_class(database)
+    a, b = Foo(code="a"), Foo(code="b")
+    insert_one(a)
+
+    replica = Replica(Foo)
+    with pytest.raises(DeveloperError):
+        replica.poll()
+    replica.load()
+    assert replica.unique_fields == ["code"]
+    assert list(replica) == [a]
+    assert replica.get(a._id) == a
+
+    insert_one(b)
+    update_one(a, {"$set": {"c": "z"}})
+    assert replica.poll() == 2
+    assert len(replica) == 2
+    assert replica.get_by("code", "z")._id == a._id
+    assert replica.get_by("code", "a") is None
+    assert replica.get_by("code", "b") == b
+
+    delete_one(b)
+    assert replica.poll() == 1
+    assert b._id not in replica
+    assert replica.poll() == 0
+
+    with pytest.raises(DeveloperError):
+        replica.get_by("name", "")
+
+    get_collection(Foo).drop()
+    insert_one(b)
+    replica.poll()
+    assert list(replica) == [b]
+    replica.close()
+
+
+def test_replica_history_lost(monkeypatch):
+    monkeypatch.setattr(memory, "CHANGE_LOG_SIZE", 2)
+    Foo = make_class(MemoryDatabase())
+    with Replica(Foo) as replica:
+        for code in "abc":
+            insert_one(Foo(code=code))
+        assert replica.poll() == 0
+        assert sorted(foo.code for foo in replica) == ["a", "b", "c"]
+
+
+def test_replica_collection_type():
+    with pytest.raises(TypeError):
+        Replica(make_class(AsyncMemoryDatabase()))
+    with pytest.raises(TypeError):
+        AsyncReplica(make_class(MemoryDatabase()))
+
+
+def test_replica_run(database):
+    Foo = make_class(database)
+    replica = Replica(Foo)
+    replica.load()
+    thread = threading.Thread(target=replica.run)
+    thread.start()
+    try:
+        foo = Foo(code="a")
+        insert_one(foo)
+        deadline = time.monotonic() + 5
+        while foo._id not in replica and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert replica.get_by("code", "a") == foo
+    finally:
+        replica.close()
+        thread.join(5)
+    assert not thread.is_alive()
+
+
+@pytest.mark.asyncio
+async def test_async_replica(async_database):
+    Foo = make_class(async_database)
+    foo = Foo(code="a")
+    await get_collection(Foo).insert_one({"_id": foo._id, "c": "a", "name": ""})
+
+    async with AsyncReplica(Foo) as replica:
+        assert replica.get(foo._id) == foo
+        await get_collection(Foo).update_one({"_id": foo._id}, {"$set": {"c": "b"}})
+        await get_collection(Foo).insert_one({"c": "c"})
+        deadline = time.monotonic() + 5
+        count = 0
+        while count < 2 and time.monotonic() < deadline:
+            count += await replica.poll()
+            await asyncio.sleep(0.01)
+        assert replica.get_by("code", "b") == Foo(_id=foo._id, code="b")
+        assert len(replica) == 2
+
+        task = asyncio.ensure_future(replica.run())
+        await get_collection(Foo).delete_one({"_id": foo._id})
+        while foo._id in replica and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        assert foo._id not in replica
+        await replica.close()
+        await asyncio.wait_for(task, 5)
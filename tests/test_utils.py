@@ -1,4 +1,6 @@
+from concurrent.futures import ThreadPoolExecutor
 import dataclasses as dc
+from datetime import datetime
 from typing import Any
 
 from bson import ObjectId, SON
@@ -9,14 +11,18 @@ from typing_extensions import Annotated
 import pytest
 
 from mongoclasses import (
+    _diff_documents,
     _get_field_meta,
     _get_field_name,
+    _get_projection,
+    _iter_parallel,
     mongoclass,
     is_mongoclass,
     get_id,
     set_id,
     get_collection,
     get_converter,
+    get_mongoclasses,
     to_document,
     from_document,
     DeveloperError,
@@ -104,6 +110,53 @@ def test_mongoclass_with_unique_field(database):
     ]
 
 
+def test_mongoclass_with_field_indexes(database):
+    @mongoclass(db=database)
+    class Foo:
+        _id: ObjectId = dc.field(default_factory=ObjectId)
+        created: Annotated[datetime, FieldMeta(expire_after=3600)] = datetime.min
+        code: Annotated[str, FieldMeta(db_field="c", unique=True, sparse=True)] = ""
+        score: Annotated[
+            int, FieldMeta(index=-1, partial_filter={"score": {"$gt": 0}})
+        ] = 0
+        owner: Annotated[
+            str, FieldMeta(index=True, index_with=(("code", 1), ("score", -1)))
+        ] = ""
+
+    assert [idx.document for idx in Foo.__mongoclass_config__.indexes] == [
+        {"name": "created_1", "expireAfterSeconds": 3600, "key": SON([("created", 1)])},
+        {"name": "c_1", "unique": True, "sparse": True, "key": SON([("c", 1)])},
+        {
+            "name": "score_-1",
+            "partialFilterExpression": {"score": {"$gt": 0}},
+            "key": SON([("score", -1)]),
+        },
+        {
+            "name": "owner_1_c_1_score_-1",
+            "key": SON([("owner", 1), ("c", 1), ("score", -1)]),
+        },
+    ]
+
+    with pytest.raises(DeveloperError):
+
+        @mongoclass(db=database)
+        class Bar:
+            _id: ObjectId = dc.field(default_factory=ObjectId)
+            name: Annotated[str, FieldMeta(index_with=(("missing", 1),))] = ""
+
+
+def test_get_mongoclasses(database):
+    @mongoclass(db=database)
+    class Foo:
+        _id: int = 0
+
+    @mongoclass(db=database)
+    class Bar:
+        _id: int = 0
+
+    assert get_mongoclasses()[-2:] == [Foo, Bar]
+
+
 def test_get_field_meta(database):
     @mongoclass(db=database)
     class Foo:
@@ -222,4 +275,66 @@ def test_from_document(database):
     f2 = from_document(Foo, data)
     assert f2._id == f._id
     assert f2.name == f.name
-    assert f2.description == f.description
\ No newline at end of file
+    assert f2.description == f.description
+
+
+def test_diff_documents():
+    old = {"_id": 1, "a": 1, "b": {"c": 1, "d": 2}, "e": [1], "f": {"x.y": 1}}
+    new = {"_id": 1, "a": 2, "b": {"c": 1, "g": 3}, "e": [1, 2], "f": {"x.y": 2}}
+    assert _diff_documents(old, new) == {
+        "$set": {"a": 2, "b.g": 3, "e": [1, 2], "f": {"x.y": 2}},
+        "$unset": {"b.d": ""},
+    }
+    assert _diff_documents(old, old) == {}
+    assert _diff_documents({"_id": 1, "legacy": 1}, {"_id": 1}) == {}
+    assert _diff_documents({"a": 1}, {"a": True}) == {"$set": {"a": True}}
+
+
+def test_get_projection(database):
+    @mongoclass(db=database)
+    class Foo:
+        id: Annotated[int, FieldMeta(db_field="_id")] = 0
+        name: Annotated[str, FieldMeta(db_field="n")] = ""
+        blob: Annotated[bytes, FieldMeta(deferred=True)] = b""
+
+    assert _get_projection(Foo, None, None) == ({"_id": 1, "n": 1}, None)
+    assert _get_projection(Foo, ["blob"], None) == (
+        {"_id": 1, "blob": 1},
+        frozenset({"id", "blob"}),
+    )
+    assert _get_projection(Foo, None, ["name"]) == ({"_id": 1}, frozenset({"id"}))
+
+    with pytest.raises(DeveloperError):
+        _get_projection(Foo, ["missing"], None)
+
+
+def test_deferred_id_field(database):
+    with pytest.raises(DeveloperError):
+        @mongoclass(db=database)
+        class Foo:
+            _id: Annotated[int, FieldMeta(deferred=True)] = 0
+
+
+class RawBatches(list):
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_iter_parallel():
+    with ThreadPoolExecutor(2) as executor:
+        batches = RawBatches([b"ab", b"cd", b"e"])
+        results = _iter_parallel(batches, list, executor, 2, True, True)
+        assert list(results) == [97, 98, 99, 100, 101]
+        assert batches.closed
+
+        batches = RawBatches([b"ab", b"cd", b"e"])
+        results = _iter_parallel(batches, len, executor, 2, False, False)
+        assert sorted(results) == [1, 2, 2]
+
+        batches = RawBatches([b"ab", b"cd", b"e"])
+        results = _iter_parallel(batches, list, executor, 1, True, True)
+        assert next(results) == 97
+        results.close()
+        assert batches.closed